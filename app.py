@@ -1,10 +1,32 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory
-from datetime import datetime
+from flask import Flask, Response, g, render_template, request, jsonify, session, redirect, url_for, send_from_directory, send_file, stream_with_context
+from datetime import datetime, timedelta
+import atexit
+import base64
+import hashlib
+import hmac
 import json
 import os
 import sqlite3
+import sys
+import tempfile
+import threading
+import time
 from contextlib import closing
-from werkzeug.utils import secure_filename
+import click
+from db import ConnectionPool, add_column, apply_storage_profile, migrate, retry_on_locked, schema_version
+from cache import LRUCache
+import archive
+import geofence
+import ingest
+import passwords
+import photos
+import rollups
+import tokens
+from events import EventBroadcaster
+from metrics import EXPOSITION_CONTENT_TYPE, InstrumentedConnection, Metrics, StackSampler
+import export
+import bulk
+from photo_store import LocalPhotoStore
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
@@ -12,6 +34,29 @@ app.secret_key = 'your-secret-key-change-this-in-production'
 # Database configuration
 DATABASE = 'attendance.db'
 
+# Connection pool configuration
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', 256))
+
+# SQLite storage profile (applied to every pooled connection at startup)
+STORAGE_PROFILE = {
+    'journal_mode': os.environ.get('DB_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('DB_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('DB_CACHE_SIZE', -16000)),
+    'mmap_size': int(os.environ.get('DB_MMAP_SIZE', 268435456)),
+    'temp_store': 'MEMORY',
+    'busy_timeout': int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+}
+
+# Employee auth/device cache configuration
+EMPLOYEE_CACHE_SIZE = int(os.environ.get('EMPLOYEE_CACHE_SIZE', 4096))
+EMPLOYEE_CACHE_TTL = float(os.environ.get('EMPLOYEE_CACHE_TTL', 300))  # seconds, bounds staleness across workers
+
+# Geofence config and site index are reloaded by the worker that changes them, and by every
+# other worker once they are this old (seconds), which bounds staleness across workers
+GEOFENCE_CACHE_TTL = float(os.environ.get('GEOFENCE_CACHE_TTL', 30))
+
 # Geofence configuration (default values)
 GEOFENCE_CONFIG = {
     'latitude': 28.7041,  # Example: Delhi coordinates
@@ -19,114 +64,799 @@ GEOFENCE_CONFIG = {
     'radius': 100  # radius in meters
 }
 
+# Photo upload configuration
+PHOTO_MAX_BYTES = int(os.environ.get('PHOTO_MAX_BYTES', 5 * 1024 * 1024))
+PHOTO_CHUNK_SIZE = int(os.environ.get('PHOTO_CHUNK_SIZE', 64 * 1024))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+UPLOAD_ROOT = os.path.join('static', 'uploads')
+PHOTO_CACHE_MAX_AGE = 365 * 24 * 3600  # content-addressed photos never change
+
+# Photo storage backends, selected with PHOTO_STORE
+PHOTO_STORES = {
+    'local': lambda: LocalPhotoStore(UPLOAD_ROOT)
+}
+
+# Reject oversized requests before they are read (photo plus form fields)
+app.config['MAX_CONTENT_LENGTH'] = PHOTO_MAX_BYTES + 64 * 1024
+
+# Attendance records page size (default and upper bound)
+RECORDS_PAGE_SIZE = 100
+RECORDS_MAX_PAGE_SIZE = 500
+
+# Rows fetched per batch when streaming exports
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+
+# Rows per transaction for bulk import / batch approval
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 500))
+# Employees per HTTP import: each password is hashed in the request, so larger files go
+# through `flask import-employees` instead of holding a request open for minutes
+BULK_UPLOAD_MAX_ROWS = int(os.environ.get('BULK_UPLOAD_MAX_ROWS', 1000))
+
+# Offline punch sync limits
+SYNC_MAX_PUNCHES = int(os.environ.get('SYNC_MAX_PUNCHES', 200))
+SYNC_MAX_AGE_HOURS = int(os.environ.get('SYNC_MAX_AGE_HOURS', 24))
+SYNC_CLOCK_SKEW_SECONDS = 300  # tolerated client clock drift into the future
+SYNC_FLUSH_TIMEOUT = 10  # seconds to wait for queued online punches before answering 503
+
+# Attendance rollups: check-ins at or before WORKDAY_START + LATE_GRACE_MINUTES are on time
+WORKDAY_START = os.environ.get('WORKDAY_START', '09:30')
+LATE_GRACE_MINUTES = int(os.environ.get('LATE_GRACE_MINUTES', 10))
+ON_TIME_CUTOFF = rollups.cutoff_time(WORKDAY_START, LATE_GRACE_MINUTES)
+ANALYTICS_MAX_DAYS = 366
+
+# Admin live-update stream (Server-Sent Events)
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', 100))
+EVENTS_HEARTBEAT = 15  # seconds between keep-alive comments
+
+# Server-side geofence enforcement for punches
+GEOFENCE_ENFORCE_CHECKIN = os.environ.get('GEOFENCE_ENFORCE_CHECKIN', '1') == '1'
+GEOFENCE_ENFORCE_CHECKOUT = os.environ.get('GEOFENCE_ENFORCE_CHECKOUT', '1') == '1'
+
+# Grid cell size (degrees) for the multi-site spatial index
+SITE_INDEX_CELL_SIZE = float(os.environ.get('SITE_INDEX_CELL_SIZE', 0.05))
+
+# Adaptive location-poll schedule for employee dashboards (JSON override via POLL_SCHEDULE)
+POLL_SCHEDULE = json.loads(os.environ['POLL_SCHEDULE']) if os.environ.get('POLL_SCHEDULE') else geofence.DEFAULT_POLL_SCHEDULE
+POLL_SCHEDULE_ETAG = hashlib.sha1(json.dumps(POLL_SCHEDULE, sort_keys=True).encode()).hexdigest()
+
+# Browser cache lifetime for the employee geofence config (seconds)
+GEOFENCE_CONFIG_MAX_AGE = int(os.environ.get('GEOFENCE_CONFIG_MAX_AGE', 60))
+
+# /metrics is readable by a logged-in admin, or by a scraper sending this bearer token
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Opt-in sampling profiler: comma-separated route rules to sample, e.g. "/employee/checkin,/employee/checkout"
+PROFILE_ROUTES = {rule.strip() for rule in os.environ.get('PROFILE_ROUTES', '').split(',') if rule.strip()}
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))  # seconds between samples
+
+# Write-behind ingestion: punches are logged and acknowledged, then group-committed by a writer thread.
+# Queued punches are only visible to the process that queued them, so this needs a single server process.
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '0') == '1'
+INGEST_LOG_DIR = os.environ.get('INGEST_LOG_DIR', 'ingest')
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+INGEST_INTERVAL = float(os.environ.get('INGEST_INTERVAL', 0.005))  # seconds to fill a batch
+INGEST_FSYNC = os.environ.get('INGEST_FSYNC', '1') == '1'  # '0' survives process crashes, not power loss
+
+# Monthly archival: attendance_records keeps the current month and the previous ARCHIVE_KEEP_MONTHS;
+# older months are moved to compressed per-month files by `flask archive-attendance`
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+ARCHIVE_KEEP_MONTHS = int(os.environ.get('ARCHIVE_KEEP_MONTHS', 2))
+
+# Password hashing: salted scrypt; n is the CPU/memory cost (each hash uses ~128 * n * r bytes).
+# Changing the cost rehashes each password at its next successful login.
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 32768))
+PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))  # logins waiting for a worker before 503
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+PASSWORD_IMPORT_WORKERS = int(os.environ.get('PASSWORD_IMPORT_WORKERS', 1))  # bulk-import hashing threads
+
+# Signed punch tokens issued at employee login; punches carrying one are authorized without a DB read.
+# PUNCH_TOKEN_SECRET is a comma-separated key list, newest last; without it no tokens are issued and
+# every punch is checked against the database. PUNCH_TOKEN_REAUTH_HOURS after the password was last
+# entered, tokens stop being refreshed and the employee must log in again.
+# PUNCH_TOKEN_REQUIRED=1 rejects punches that only name an employeeId in the body.
+PUNCH_TOKEN_SECRETS = [key for key in os.environ.get('PUNCH_TOKEN_SECRET', '').split(',') if key]
+PUNCH_TOKEN_TTL = int(os.environ.get('PUNCH_TOKEN_TTL', 900))  # seconds
+PUNCH_TOKEN_REAUTH_HOURS = float(os.environ.get('PUNCH_TOKEN_REAUTH_HOURS', 12))
+PUNCH_TOKEN_REQUIRED = os.environ.get('PUNCH_TOKEN_REQUIRED', '0') == '1'
+if PUNCH_TOKEN_REQUIRED and not PUNCH_TOKEN_SECRETS:
+    raise RuntimeError('PUNCH_TOKEN_REQUIRED=1 needs PUNCH_TOKEN_SECRET to be set')
+
+db_pool = ConnectionPool(
+    DATABASE,
+    size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    statement_cache=DB_STATEMENT_CACHE,
+    busy_timeout=STORAGE_PROFILE['busy_timeout'] / 1000.0,
+    on_connect=lambda conn: apply_storage_profile(conn, STORAGE_PROFILE)
+)
+
+photo_store = PHOTO_STORES[os.environ.get('PHOTO_STORE', 'local')]()
+
+# Background pool that writes thumbnail / size-normalized photo variants
+thumbnail_worker = photos.ThumbnailWorker(max_workers=THUMBNAIL_WORKERS)
+
+# Bounded pool that hashes and verifies passwords off the request threads
+password_hasher = passwords.PasswordHasher(
+    passwords.scrypt_method(PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P),
+    max_workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_QUEUE,
+    timeout=PASSWORD_HASH_TIMEOUT,
+    import_workers=PASSWORD_IMPORT_WORKERS
+)
+
+# Signs and verifies the punch API's bearer tokens (None when no secret is configured)
+punch_tokens = tokens.PunchTokens(PUNCH_TOKEN_SECRETS, ttl=PUNCH_TOKEN_TTL) if PUNCH_TOKEN_SECRETS else None
+
+# Employee auth and device state, keyed by emp_id
+employee_cache = LRUCache(maxsize=EMPLOYEE_CACHE_SIZE, ttl=EMPLOYEE_CACHE_TTL)
+
+# Fans out change events from the write paths to connected admin dashboards
+broadcaster = EventBroadcaster(max_subscribers=EVENTS_MAX_SUBSCRIBERS)
+
+# Route latency, SQL statement and punch-phase timings served at /metrics
+metrics = Metrics()
+
+# Stack sampler for the routes in PROFILE_ROUTES, served at /admin/profile
+profiler = StackSampler(interval=PROFILE_INTERVAL)
+if PROFILE_ROUTES:
+    profiler.start()
+
 # Database helper functions
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get a pooled database connection (close() returns it to the pool); statements are timed"""
+    return InstrumentedConnection(db_pool.acquire(), metrics)
 
-def init_db():
-    """Initialize database with required tables"""
+def load_employee_auth(emp_id):
+    """Read an employee's credentials and device state from the database"""
     with closing(get_db()) as conn:
-        cursor = conn.cursor()
-        
-        # Create employees table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS employees (
-                emp_id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                password TEXT NOT NULL,
-                device_id TEXT,
-                device_approved INTEGER DEFAULT 0,
-                device_fingerprint TEXT
-            )
-        ''')
-        
-        # Add device_fingerprint column if it doesn't exist (for existing databases)
-        try:
-            cursor.execute('ALTER TABLE employees ADD COLUMN device_fingerprint TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        # Create admins table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                admin_id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                password TEXT NOT NULL
-            )
-        ''')
-        
-        # Create device_registrations table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS device_registrations (
-                reg_id TEXT PRIMARY KEY,
-                employee_id TEXT NOT NULL,
-                employee_name TEXT NOT NULL,
-                device_id TEXT NOT NULL,
-                device_fingerprint TEXT NOT NULL,
-                request_date TEXT NOT NULL,
-                status TEXT DEFAULT 'pending',
-                FOREIGN KEY (employee_id) REFERENCES employees(emp_id)
-            )
-        ''')
-        
-        # Add device_fingerprint column if it doesn't exist (for existing databases)
-        try:
-            cursor.execute('ALTER TABLE device_registrations ADD COLUMN device_fingerprint TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        # Create attendance_records table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS attendance_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                emp_id TEXT NOT NULL,
-                date TEXT NOT NULL,
-                check_in TEXT,
-                check_in_lat REAL,
-                check_in_lon REAL,
-                check_in_photo TEXT,
-                check_out TEXT,
-                check_out_lat REAL,
-                check_out_lon REAL,
-                FOREIGN KEY (emp_id) REFERENCES employees(emp_id),
-                UNIQUE(emp_id, date)
-            )
-        ''')
-        
-        # Add check_in_photo column if it doesn't exist (for existing databases)
-        try:
-            cursor.execute('ALTER TABLE attendance_records ADD COLUMN check_in_photo TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        # Create geofence_config table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS geofence_config (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                latitude REAL NOT NULL,
-                longitude REAL NOT NULL,
-                radius REAL NOT NULL
-            )
-        ''')
-        
-        # Insert default geofence config if not exists
-        cursor.execute('SELECT COUNT(*) FROM geofence_config')
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('''
-                INSERT INTO geofence_config (latitude, longitude, radius)
-                VALUES (?, ?, ?)
-            ''', (GEOFENCE_CONFIG['latitude'], GEOFENCE_CONFIG['longitude'], GEOFENCE_CONFIG['radius']))
-        
+        employee = conn.execute(
+            'SELECT emp_id, name, password, device_approved, device_fingerprint FROM employees WHERE emp_id = ?',
+            (emp_id,)
+        ).fetchone()
+        if not employee:
+            return None
+        employee = dict(employee)
+        sites = conn.execute('SELECT site_id FROM employee_sites WHERE emp_id = ?', (emp_id,)).fetchall()
+    # Empty set means "not restricted to particular sites"
+    employee['site_ids'] = frozenset(row['site_id'] for row in sites)
+    return employee
+
+def get_employee_auth(emp_id):
+    """Cached employee credentials and device state (None if the employee doesn't exist)"""
+    return employee_cache.get_or_load(emp_id, load_employee_auth)
+
+@retry_on_locked()
+def upgrade_password(table, key_column, key, old, new):
+    """Store a rehashed password, unless it was changed since it was read"""
+    with closing(get_db()) as conn:
+        conn.execute(f'UPDATE {table} SET password = ? WHERE {key_column} = ? AND password = ?', (new, key, old))
         conn.commit()
 
+def password_hashing_busy():
+    response = jsonify({
+        'success': False,
+        'message': 'Too many sign-ins in progress, please try again in a moment'
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Active geofence config, held in memory as (config, etag) and refreshed on writes
+# and after GEOFENCE_CACHE_TTL
+_active_geofence = None
+_active_geofence_expires = 0.0
+_geofence_lock = threading.Lock()
+
+def load_geofence_config():
+    """Read the active geofence config from the database into memory"""
+    global _active_geofence, _active_geofence_expires
+    expires = time.monotonic() + GEOFENCE_CACHE_TTL
+    with closing(get_db()) as conn:
+        config = conn.execute('SELECT latitude, longitude, radius FROM geofence_config ORDER BY id DESC LIMIT 1').fetchone()
+    
+    if config:
+        config = {
+            'latitude': config['latitude'],
+            'longitude': config['longitude'],
+            'radius': config['radius']
+        }
+    else:
+        config = dict(GEOFENCE_CONFIG)
+    
+    # Content-derived ETag so every worker process agrees on it
+    etag = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+    with _geofence_lock:
+        _active_geofence = (config, etag)
+        _active_geofence_expires = expires
+    return _active_geofence
+
+def get_active_geofence():
+    """Return the cached (config, etag) pair, loading it on first use and once it expires"""
+    active = _active_geofence
+    if active is None or time.monotonic() > _active_geofence_expires:
+        active = load_geofence_config()
+    return active
+
+# Named geofence sites, held in memory as (GridIndex, etag) and rebuilt on writes
+# and after GEOFENCE_CACHE_TTL
+_site_index = None
+_site_index_expires = 0.0
+
+def load_site_index():
+    """Read all active sites from the database and rebuild the spatial index"""
+    global _site_index, _site_index_expires
+    expires = time.monotonic() + GEOFENCE_CACHE_TTL
+    with closing(get_db()) as conn:
+        rows = conn.execute('''
+            SELECT site_id, name, latitude, longitude, radius, polygon
+            FROM geofence_sites
+            WHERE active = 1
+            ORDER BY site_id
+        ''').fetchall()
+    
+    fences = [
+        geofence.Fence(
+            row['site_id'], row['name'],
+            latitude=row['latitude'], longitude=row['longitude'], radius=row['radius'],
+            polygon=json.loads(row['polygon']) if row['polygon'] else None
+        )
+        for row in rows
+    ]
+    index = geofence.GridIndex(fences, cell_size=SITE_INDEX_CELL_SIZE)
+    etag = hashlib.sha1(json.dumps([f.to_dict() for f in fences], sort_keys=True).encode()).hexdigest()
+    with _geofence_lock:
+        _site_index = (index, etag)
+        _site_index_expires = expires
+    return _site_index
+
+def get_site_index():
+    """Return the cached (GridIndex, etag) pair, loading it on first use and once it expires"""
+    active = _site_index
+    if active is None or time.monotonic() > _site_index_expires:
+        active = load_site_index()
+    return active
+
+def allowed_sites(index, site_ids):
+    """An employee's assigned sites that are still active, or None (any site) if none of them is"""
+    return frozenset(site_ids).intersection(index.fences) or None
+
+def employee_fences(index, employee):
+    """Sites an employee may punch at: their active assigned sites, or every site if there are none"""
+    allowed = allowed_sites(index, employee['site_ids'] if employee else ())
+    return [index.fences[site_id] for site_id in sorted(allowed or index.fences)]
+
+def geofence_config_response(cache_control, emp_id=None):
+    """JSON response for the active geofence config, answering 304 when the ETag matches"""
+    config, config_etag = get_active_geofence()
+    index, sites_etag = get_site_index()
+    employee = get_employee_auth(emp_id) if emp_id else None
+    site_ids = sorted(employee['site_ids']) if employee else []
+    
+    # Cheap composite ETag - checked before any response body is built
+    etag = hashlib.sha1(f'{config_etag}:{sites_etag}:{POLL_SCHEDULE_ETAG}:{site_ids}'.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        sites = employee_fences(index, employee) if emp_id else [index.fences[i] for i in sorted(index.fences)]
+        response = jsonify({
+            'success': True,
+            'config': config,
+            'sites': [fence.to_dict() for fence in sites],
+            'pollSchedule': POLL_SCHEDULE
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def punch_token_fields(employee, authenticated_at):
+    """Response fields carrying a punch API token (none when tokens are disabled).
+    
+    The token is bound to the employee's approved device (if any) and sites, and
+    keeps authenticated_at, when the employee last entered their password.
+    """
+    if punch_tokens is None:
+        return {}
+    device_fingerprint = employee['device_fingerprint'] if employee['device_approved'] else None
+    return {
+        'token': punch_tokens.issue(employee['emp_id'], employee['name'], device_fingerprint,
+                                    employee['site_ids'], authenticated_at),
+        'tokenExpiresIn': PUNCH_TOKEN_TTL
+    }
+
+def authorize_punch(authorization, emp_id):
+    """Who a punch is for: (emp_id, token claims, None), or (None, None, (response body, HTTP status)).
+    
+    With a valid bearer token the employee comes from the token (a body
+    employeeId must match it) and the claims stand in for the employee row.
+    Without one (or with tokens disabled) the body's employeeId is used, claims
+    are None and the checks read the employee cache, unless PUNCH_TOKEN_REQUIRED is set.
+    """
+    token = tokens.bearer_token(authorization) if punch_tokens is not None else None
+    if token is None:
+        if PUNCH_TOKEN_REQUIRED:
+            return None, None, ({
+                'success': False,
+                'message': 'Sign-in required. Please log in again.'
+            }, 401)
+        return emp_id, None, None
+    try:
+        claims = punch_tokens.verify(token)
+    except tokens.InvalidToken as e:
+        return None, None, ({
+            'success': False,
+            'message': f'{e}. Please log in again.'
+        }, 401)
+    if emp_id and emp_id != claims['sub']:
+        return None, None, ({
+            'success': False,
+            'message': 'Employee ID does not match the signed-in employee'
+        }, 403)
+    return claims['sub'], claims, None
+
+def punch_device_error(emp_id, device_fingerprint, action, claims=None):
+    """Device rule for punches: returns an error message, or None if the device may punch"""
+    if claims is not None and claims.get('fp'):
+        return tokens.device_error(claims, device_fingerprint, action)
+    # No device in the token means none was approved when it was issued: check the current one
+    employee = get_employee_auth(emp_id)
+    if employee and employee['device_approved'] and employee['device_fingerprint']:
+        if not device_fingerprint:
+            return f'Device fingerprint required for {action}'
+        if device_fingerprint != employee['device_fingerprint']:
+            return f'Device mismatch detected. {action.capitalize()} denied. Please use your registered device.'
+    return None
+
+def punch_rules(emp_id):
+    """The employee, site index and geofence config check_punch_location() uses, read up front.
+    
+    A caller that holds a pooled connection passes these in rather than letting the
+    cache loaders take a second connection, which could drain the pool and deadlock.
+    """
+    index, _ = get_site_index()
+    return {
+        'employee': get_employee_auth(emp_id),
+        'index': index,
+        'config': None if len(index) else get_active_geofence()[0]
+    }
+
+def check_punch_location(emp_id, latitude, longitude, action, enforce=True, claims=None, rules=None):
+    """Server-side geofence check for a punch.
+    
+    When named sites exist the punch must fall inside one of the employee's
+    sites (looked up through the spatial index); otherwise the single legacy
+    geofence_config circle applies. The employee's sites come from the punch
+    token's claims when the punch carries one. rules, if given, is punch_rules()
+    read beforehand; otherwise the caches are read as needed. Returns ((latitude, longitude, site_id), None)
+    when the punch is accepted, or (None, error) when it is rejected, where
+    error is a dict with 'message', 'status' and optionally 'distance'.
+    """
+    if not enforce:
+        return (latitude, longitude, None), None
+    
+    location = geofence.parse_coordinates(latitude, longitude)
+    if location is None:
+        return None, {'message': f'A valid location is required for {action}', 'status': 400}
+    
+    index = rules['index'] if rules else get_site_index()[0]
+    if len(index):
+        # No sites in the token means none were assigned when it was issued: check the current ones
+        if claims is not None and claims.get('sites'):
+            allowed = allowed_sites(index, claims['sites'])
+        else:
+            employee = rules['employee'] if rules else get_employee_auth(emp_id)
+            allowed = allowed_sites(index, employee['site_ids'] if employee else ())
+        matches = index.match(location[0], location[1], allowed)
+        if not matches:
+            return None, {
+                'message': f'You are not inside any of your assigned sites. {action.capitalize()} denied.',
+                'status': 403
+            }
+        return (location[0], location[1], matches[0].site_id), None
+    
+    config = rules['config'] if rules else get_active_geofence()[0]
+    inside, distance = geofence.check_point(config, *location)
+    if not inside:
+        return None, {
+            'message': f'You are outside the geofence area ({round(distance)}m from center). {action.capitalize()} denied.',
+            'status': 403,
+            'distance': round(distance, 1)
+        }
+    return (location[0], location[1], None), None
+
+def location_error_response(error):
+    """(response body, HTTP status) for a punch rejected by check_punch_location()"""
+    body = {'success': False, 'message': error['message']}
+    if 'distance' in error:
+        body['distance'] = error['distance']
+    return body, error['status']
+
+def update_employee_status(conn, emp_id, date, status, check_in=None, check_out=None):
+    """Keep the per-employee summary row current (same transaction as the punch).
+    
+    A punch for an earlier date (a late offline sync) can still advance the last
+    check-in/out times, but never moves the status back to that date.
+    """
+    conn.execute('''
+        INSERT INTO employee_status (emp_id, last_check_in, last_check_out, status_date, status)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(emp_id) DO UPDATE
+        SET last_check_in = NULLIF(MAX(COALESCE(last_check_in, ''), COALESCE(excluded.last_check_in, '')), ''),
+            last_check_out = NULLIF(MAX(COALESCE(last_check_out, ''), COALESCE(excluded.last_check_out, '')), ''),
+            status_date = CASE WHEN excluded.status_date >= COALESCE(status_date, '')
+                               THEN excluded.status_date ELSE status_date END,
+            status = CASE WHEN excluded.status_date >= COALESCE(status_date, '')
+                          THEN excluded.status ELSE status END
+    ''', (emp_id, check_in, check_out, date, status))
+
+def checkin_event(emp_id, date, timestamp, latitude, longitude, photo=None, site_id=None, employee=None):
+    """Admin stream payload for a check-in (same fields as /admin/attendance-records rows).
+    
+    employee is the employee row or token claims (for the name); looked up when not given.
+    """
+    if employee is None:
+        employee = get_employee_auth(emp_id)
+    check_in = datetime.fromisoformat(timestamp)
+    coordinates = geofence.parse_coordinates(latitude, longitude)
+    return {
+        'empId': emp_id,
+        'name': employee['name'] if employee else None,
+        'date': date,
+        'checkInTime': check_in.strftime('%I:%M:%S %p'),
+        'lastCheckIn': check_in.strftime('%I:%M %p'),
+        'location': f'{coordinates[0]:.6f}, {coordinates[1]:.6f}' if coordinates else 'N/A',
+        'photo': photo,
+        'thumbnail': photos.variant_name(photo, 'thumb') if photo else None,
+        'siteId': site_id
+    }
+
+def checkout_event(emp_id, date, timestamp):
+    """Admin stream payload for a check-out"""
+    return {
+        'empId': emp_id,
+        'date': date,
+        'lastCheckOut': timestamp
+    }
+
+def record_check_in(conn, emp_id, date, timestamp, latitude, longitude, photo=None, site_id=None, overwrite=True):
+    """Insert or update today's check-in in a single statement, returning the row id.
+    
+    With overwrite=False an existing check-in for the date is kept and None is returned.
+    """
+    if not overwrite:
+        row = conn.execute('''
+            INSERT INTO attendance_records (emp_id, date, check_in, check_in_lat, check_in_lon, site_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(emp_id, date) DO NOTHING
+            RETURNING id, check_out
+        ''', (emp_id, date, timestamp, latitude, longitude, site_id)).fetchone()
+        if row is None:
+            return None
+    elif photo is None:
+        row = conn.execute('''
+            INSERT INTO attendance_records (emp_id, date, check_in, check_in_lat, check_in_lon, site_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(emp_id, date) DO UPDATE
+            SET check_in = excluded.check_in, check_in_lat = excluded.check_in_lat,
+                check_in_lon = excluded.check_in_lon, site_id = excluded.site_id
+            RETURNING id, check_out
+        ''', (emp_id, date, timestamp, latitude, longitude, site_id)).fetchone()
+    else:
+        row = conn.execute('''
+            INSERT INTO attendance_records (emp_id, date, check_in, check_in_lat, check_in_lon, check_in_photo, site_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(emp_id, date) DO UPDATE
+            SET check_in = excluded.check_in, check_in_lat = excluded.check_in_lat,
+                check_in_lon = excluded.check_in_lon, check_in_photo = excluded.check_in_photo,
+                site_id = excluded.site_id
+            RETURNING id, check_out
+        ''', (emp_id, date, timestamp, latitude, longitude, photo, site_id)).fetchone()
+    # A check-in again after checking out keeps the day's check-out, so the day stays checked out
+    status = 'checked_out' if row['check_out'] else 'checked_in'
+    update_employee_status(conn, emp_id, date, status, check_in=timestamp)
+    rollups.refresh(conn, emp_id, date, ON_TIME_CUTOFF)
+    return row['id']
+
+def record_check_out(conn, emp_id, date, timestamp, latitude, longitude):
+    """Record check-out in a single conditional UPDATE; returns an error message or None"""
+    row = conn.execute('''
+        UPDATE attendance_records
+        SET check_out = ?, check_out_lat = ?, check_out_lon = ?
+        WHERE emp_id = ? AND date = ? AND check_in IS NOT NULL AND check_out IS NULL
+        RETURNING id
+    ''', (timestamp, latitude, longitude, emp_id, date)).fetchone()
+    if row:
+        update_employee_status(conn, emp_id, date, 'checked_out', check_out=timestamp)
+        rollups.refresh(conn, emp_id, date, ON_TIME_CUTOFF)
+        return None
+    
+    # Nothing updated - work out why (only reached on the rejection path)
+    record = conn.execute(
+        'SELECT check_in, check_out FROM attendance_records WHERE emp_id = ? AND date = ?',
+        (emp_id, date)
+    ).fetchone()
+    if not record or not record['check_in']:
+        return 'You must check in first before checking out'
+    return 'You have already checked out today'
+
+def rebuild_rollups(conn, date_from=None, date_to=None):
+    """Rebuild the rollups for a date range, reading archived months from their archive files"""
+    totals = {'dailyRows': 0, 'monthlyRows': 0, 'seconds': 0}
+    
+    def add(result):
+        for key in totals:
+            totals[key] = round(totals[key] + result[key], 4)
+    
+    for month in archive.archived_months(conn, date_from, date_to):
+        first, last = rollups.month_bounds(month)
+        with archive.attached(conn, ARCHIVE_DIR, month) as schema:
+            add(rollups.rebuild(conn, ON_TIME_CUTOFF, max(first, date_from or first), min(last, date_to or last),
+                                f'{schema}.attendance_records'))
+    
+    # Whatever is left of the range lies in attendance_records
+    since = archive.hot_since(conn)
+    if not (since and date_to and date_to < since):
+        add(rollups.rebuild(conn, ON_TIME_CUTOFF, max(filter(None, (date_from, since)), default=None), date_to))
+    return totals
+
+# Schema migrations, applied in order by init_db() and recorded in PRAGMA user_version.
+# Each is idempotent, since a database from before versioning (user_version 0) may
+# already have some of the tables. Add new tables and indexes as a new version at the end.
+
+def migrate_core_tables(conn):
+    """Employees, admins, device registrations, attendance records and the default geofence"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS employees (
+            emp_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            device_id TEXT,
+            device_approved INTEGER DEFAULT 0,
+            device_fingerprint TEXT
+        )
+    ''')
+    add_column(conn, 'employees', 'device_fingerprint', 'TEXT')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            admin_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS device_registrations (
+            reg_id TEXT PRIMARY KEY,
+            employee_id TEXT NOT NULL,
+            employee_name TEXT NOT NULL,
+            device_id TEXT NOT NULL,
+            device_fingerprint TEXT NOT NULL,
+            request_date TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            FOREIGN KEY (employee_id) REFERENCES employees(emp_id)
+        )
+    ''')
+    add_column(conn, 'device_registrations', 'device_fingerprint', 'TEXT')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            emp_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            check_in TEXT,
+            check_in_lat REAL,
+            check_in_lon REAL,
+            check_in_photo TEXT,
+            check_out TEXT,
+            check_out_lat REAL,
+            check_out_lon REAL,
+            FOREIGN KEY (emp_id) REFERENCES employees(emp_id),
+            UNIQUE(emp_id, date)
+        )
+    ''')
+    add_column(conn, 'attendance_records', 'check_in_photo', 'TEXT')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS geofence_config (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            radius REAL NOT NULL
+        )
+    ''')
+    if not conn.execute('SELECT 1 FROM geofence_config LIMIT 1').fetchone():
+        conn.execute('''
+            INSERT INTO geofence_config (latitude, longitude, radius)
+            VALUES (?, ?, ?)
+        ''', (GEOFENCE_CONFIG['latitude'], GEOFENCE_CONFIG['longitude'], GEOFENCE_CONFIG['radius']))
+
+def migrate_geofence_sites(conn):
+    """Named circular or polygon fences and which of them each employee may punch at"""
+    add_column(conn, 'attendance_records', 'site_id', 'INTEGER')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS geofence_sites (
+            site_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            latitude REAL,
+            longitude REAL,
+            radius REAL,
+            polygon TEXT,
+            active INTEGER DEFAULT 1
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS employee_sites (
+            emp_id TEXT NOT NULL,
+            site_id INTEGER NOT NULL,
+            PRIMARY KEY (emp_id, site_id),
+            FOREIGN KEY (emp_id) REFERENCES employees(emp_id),
+            FOREIGN KEY (site_id) REFERENCES geofence_sites(site_id)
+        )
+    ''')
+
+def migrate_employee_status(conn):
+    """Materialized last check-in/out and today's status, backfilled once from history"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'employee_status'").fetchone():
+        return
+    conn.execute('''
+        CREATE TABLE employee_status (
+            emp_id TEXT PRIMARY KEY,
+            last_check_in TEXT,
+            last_check_out TEXT,
+            status_date TEXT,
+            status TEXT,
+            FOREIGN KEY (emp_id) REFERENCES employees(emp_id)
+        )
+    ''')
+    # Afterwards the punch write path keeps it current
+    conn.execute('''
+        INSERT INTO employee_status (emp_id, last_check_in, last_check_out, status_date, status)
+        SELECT a.emp_id, MAX(a.check_in), MAX(a.check_out), MAX(a.date),
+               (SELECT CASE WHEN l.check_out IS NOT NULL THEN 'checked_out' ELSE 'checked_in' END
+                FROM attendance_records l
+                WHERE l.emp_id = a.emp_id AND l.check_in IS NOT NULL
+                ORDER BY l.date DESC LIMIT 1)
+        FROM attendance_records a
+        WHERE a.check_in IS NOT NULL
+        GROUP BY a.emp_id
+    ''')
+
+def migrate_processed_punches(conn):
+    """Idempotency keys of synced offline punches"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS processed_punches (
+            idempotency_key TEXT PRIMARY KEY,
+            emp_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            status TEXT NOT NULL,
+            message TEXT,
+            processed_at TEXT NOT NULL
+        )
+    ''')
+
+def migrate_listing_indexes(conn):
+    """Covering indexes for the keyset-paginated admin attendance listing
+    (newest first overall, per employee and per site)"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_date_checkin
+        ON attendance_records (date, check_in, emp_id, check_in_lat, check_in_lon, check_in_photo, site_id)
+        WHERE check_in IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_emp_date_checkin
+        ON attendance_records (emp_id, date, check_in, check_in_lat, check_in_lon, check_in_photo, site_id)
+        WHERE check_in IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_site_date_checkin
+        ON attendance_records (site_id, date, check_in, emp_id, check_in_lat, check_in_lon, check_in_photo)
+        WHERE check_in IS NOT NULL
+    ''')
+
+def migrate_rollups(conn):
+    """attendance_daily / attendance_monthly, kept current by the punch write path and
+    rebuilt nightly by `flask rollup-attendance` (first filled by migration 9)"""
+    cursor = conn.cursor()
+    archive.create_table(cursor)
+    rollups.create_tables(cursor)
+
+def migrate_ingest_state(conn):
+    """Last committed entry of each write-behind punch log"""
+    ingest.create_table(conn.cursor())
+
+def migrate_monthly_weekdays(conn):
+    """Weekdays present per monthly rollup, so weekend days worked don't hide absences"""
+    add_column(conn, 'attendance_monthly', 'weekdays_present', 'INTEGER NOT NULL DEFAULT 0')
+    rollups.fill_weekdays_present(conn)
+
+def migrate_fill_rollups(conn):
+    """Rebuild the rollups from the attendance history still in attendance_records.
+    
+    Archiving leaves the rollups alone, so archived months keep the rows they were
+    given while live and need no archive files attached (which cannot happen
+    mid-transaction). Runs inside migrate()'s transaction, so a failed rebuild
+    rolls back with the version bump and the next start runs it again.
+    """
+    rollups.rebuild(conn, ON_TIME_CUTOFF, archive.hot_since(conn), commit=False)
+
+MIGRATIONS = [
+    (1, 'core tables', migrate_core_tables),
+    (2, 'geofence sites', migrate_geofence_sites),
+    (3, 'employee status', migrate_employee_status),
+    (4, 'processed punches', migrate_processed_punches),
+    (5, 'attendance listing indexes', migrate_listing_indexes),
+    (6, 'attendance rollups and archives', migrate_rollups),
+    (7, 'write-behind ingest state', migrate_ingest_state),
+    (8, 'weekdays present in monthly rollups', migrate_monthly_weekdays),
+    (9, 'fill attendance rollups', migrate_fill_rollups),
+]
+
+def init_db():
+    """Bring the database schema up to date; one PRAGMA read once it is current"""
+    with closing(get_db()) as conn:
+        started = time.perf_counter()
+        applied = migrate(conn, MIGRATIONS)
+        if applied:
+            app.logger.warning('Applied schema migrations %s in %.3fs',
+                               ', '.join(f'{version} ({description})' for version, description in applied),
+                               time.perf_counter() - started)
+
 # Initialize database on startup
 init_db()
 
+def apply_queued_punches(conn, punches):
+    """Write a batch of write-behind punches in the caller's transaction"""
+    for punch in punches:
+        if punch['action'] == 'checkin':
+            record_check_in(conn, punch['empId'], punch['date'], punch['timestamp'], punch['latitude'],
+                            punch['longitude'], punch.get('photo'), punch.get('siteId'))
+        else:
+            # Validated against the queue at submit time; a racing duplicate from another process is a no-op
+            record_check_out(conn, punch['empId'], punch['date'], punch['timestamp'], punch['latitude'],
+                             punch['longitude'])
+
+def publish_queued_events(events):
+    for event_type, data in events:
+        broadcaster.publish(event_type, data)
+
+# Punches logged by a process that exited before committing them (in either mode)
+ingest.replay_orphans(INGEST_LOG_DIR, get_db, apply_queued_punches)
+
+punch_queue = None
+if WRITE_BEHIND:
+    punch_queue = ingest.PunchQueue(
+        INGEST_LOG_DIR, get_db, apply_queued_punches,
+        on_commit=publish_queued_events,
+        batch_size=INGEST_BATCH_SIZE,
+        interval=INGEST_INTERVAL,
+        fsync=INGEST_FSYNC
+    )
+    atexit.register(punch_queue.close)
+
+# Request instrumentation
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request.url_rule is not None and request.url_rule.rule in PROFILE_ROUTES:
+        profiler.track(f'{request.method} {request.url_rule.rule}')
+
+@app.after_request
+def record_request_latency(response):
+    # Label by route rule, not raw path, so IDs in URLs don't create new series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+    return response
+
+@app.teardown_request
+def stop_request_profile(exc):
+    profiler.untrack()
+
 # Routes
 @app.route('/')
 def index():
@@ -145,67 +875,144 @@ def employee_login_post():
     device_fingerprint = data.get('deviceFingerprint')
     
     # Check if employee exists and password matches
-    with closing(get_db()) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT emp_id, name, password, device_approved, device_fingerprint FROM employees WHERE emp_id = ?', (emp_id,))
-        employee = cursor.fetchone()
-        
-        if not employee or employee['password'] != password:
+    employee = get_employee_auth(emp_id)
+    try:
+        matches, new_hash = password_hasher.verify(employee['password'] if employee else None, password)
+    except passwords.Busy:
+        return password_hashing_busy()
+    
+    if not matches:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid credentials'
+        }), 401
+    
+    # Legacy plaintext or outdated cost: store the password hashed at the current cost
+    if new_hash:
+        upgrade_password('employees', 'emp_id', emp_id, employee['password'], new_hash)
+        employee_cache.invalidate(emp_id)
+    
+    # Verify device fingerprint if device is approved
+    if employee['device_approved'] and employee['device_fingerprint']:
+        if not device_fingerprint:
             return jsonify({
                 'success': False,
-                'message': 'Invalid credentials'
-            }), 401
-        
-        # Verify device fingerprint if device is approved
-        if employee['device_approved'] and employee['device_fingerprint']:
-            if not device_fingerprint:
-                return jsonify({
-                    'success': False,
-                    'message': 'Device fingerprint required. Please register your device first.'
-                }), 403
-            
-            if device_fingerprint != employee['device_fingerprint']:
-                return jsonify({
-                    'success': False,
-                    'message': 'Device mismatch detected. This device is not registered for this employee. Please use your registered device or contact admin.'
-                }), 403
+                'message': 'Device fingerprint required. Please register your device first.'
+            }), 403
         
-        session['employee_id'] = emp_id
-        session['employee_name'] = employee['name']
+        if device_fingerprint != employee['device_fingerprint']:
+            return jsonify({
+                'success': False,
+                'message': 'Device mismatch detected. This device is not registered for this employee. Please use your registered device or contact admin.'
+            }), 403
+    
+    session['employee_id'] = emp_id
+    session['employee_name'] = employee['name']
+    session['employee_authenticated_at'] = int(time.time())
+    return jsonify({
+        'success': True,
+        'employeeId': emp_id,
+        'employeeName': employee['name'],
+        **punch_token_fields(employee, session['employee_authenticated_at'])
+    })
+
+@app.route('/employee/token', methods=['POST'])
+def employee_token():
+    """Issue a fresh punch token from the login session or a still-valid token.
+    
+    The employee is read again here, so device approvals and site changes made
+    since the last token take effect at the next refresh. Tokens are only
+    refreshed for PUNCH_TOKEN_REAUTH_HOURS after the password was last entered.
+    """
+    if punch_tokens is None:
         return jsonify({
-            'success': True,
-            'employeeId': emp_id,
-            'employeeName': employee['name']
-        })
+            'success': False,
+            'message': 'Punch tokens are not enabled'
+        }), 404
+    
+    # (password entered at, emp_id) for each sign-in presented; the most recent one is used
+    sign_ins = []
+    if session.get('employee_id'):
+        sign_ins.append((session.get('employee_authenticated_at') or 0, session['employee_id']))
+    token = tokens.bearer_token(request.headers.get('Authorization'))
+    if token:
+        try:
+            claims = punch_tokens.verify(token)
+            sign_ins.append((claims.get('auth') or 0, claims['sub']))
+        except tokens.InvalidToken:
+            pass
+    if not sign_ins:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    authenticated_at, emp_id = max(sign_ins)
+    if time.time() - authenticated_at > PUNCH_TOKEN_REAUTH_HOURS * 3600:
+        return jsonify({
+            'success': False,
+            'message': 'Sign-in expired. Please log in again.'
+        }), 401
+    
+    employee = get_employee_auth(emp_id)
+    if not employee:
+        return jsonify({
+            'success': False,
+            'message': 'Employee not found'
+        }), 404
+    return jsonify({
+        'success': True,
+        **punch_token_fields(employee, authenticated_at)
+    })
 
 @app.route('/employee/signup', methods=['GET'])
 def employee_signup():
     return render_template('employee_signup.html')
 
-@app.route('/employee/signup', methods=['POST'])
-def employee_signup_post():
-    data = request.get_json()
-    emp_id = data.get('empId')
-    emp_name = data.get('empName')
-    emp_email = data.get('empEmail')
-    password = data.get('password')
-    
-    # Check if employee already exists
+@retry_on_locked()
+def insert_employee(emp_id, name, email, password_hash):
+    """Create an employee in its own transaction (retried alone); returns False if the ID is taken"""
     with closing(get_db()) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT emp_id FROM employees WHERE emp_id = ?', (emp_id,))
         if cursor.fetchone():
-            return jsonify({
-                'success': False,
-                'message': 'Employee ID already exists'
-            }), 400
-        
-        # Create new employee
+            return False
         cursor.execute('''
             INSERT INTO employees (emp_id, name, email, password, device_id, device_approved)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (emp_id, emp_name, emp_email, password, None, 0))
+        ''', (emp_id, name, email, password_hash, None, 0))
         conn.commit()
+    return True
+
+@app.route('/employee/signup', methods=['POST'])
+def employee_signup_post():
+    data = request.get_json()
+    emp_id = data.get('empId')
+    emp_name = data.get('empName')
+    emp_email = data.get('empEmail')
+    password = data.get('password')
+    
+    try:
+        password_hash = password_hasher.hash(password)
+    except passwords.Busy:
+        return password_hashing_busy()
+    
+    # Create the employee unless the ID already exists
+    if not insert_employee(emp_id, emp_name, emp_email, password_hash):
+        return jsonify({
+            'success': False,
+            'message': 'Employee ID already exists'
+        }), 400
+    
+    # Drop any cached "employee not found" entry
+    employee_cache.invalidate(emp_id)
+    broadcaster.publish('employee_added', {
+        'empId': emp_id,
+        'name': emp_name,
+        'email': emp_email,
+        'deviceId': 'Not Registered',
+        'todayStatus': 'absent',
+        'lastCheckIn': 'Never'
+    })
     
     return jsonify({
         'success': True,
@@ -219,237 +1026,401 @@ def employee_dashboard():
         return redirect(url_for('employee_login'))
     return render_template('employee_dashboard.html')
 
+def validate_check_in(emp_id, device_fingerprint, latitude, longitude, authorization=None):
+    """Sign-in, device and geofence checks for a check-in.
+    
+    Returns ((emp_id, claims, (latitude, longitude, site_id)), None) when the
+    check-in may go ahead, or (None, (response body, HTTP status)).
+    """
+    with metrics.phase('check-in', 'auth'):
+        emp_id, claims, error = authorize_punch(authorization, emp_id)
+    if error:
+        return None, error
+    if not emp_id:
+        return None, ({
+            'success': False,
+            'message': 'Employee ID is required'
+        }, 400)
+    
+    # Verify device fingerprint
+    with metrics.phase('check-in', 'device'):
+        error = punch_device_error(emp_id, device_fingerprint, 'check-in', claims)
+    if error:
+        return None, ({
+            'success': False,
+            'message': error
+        }, 403)
+    
+    # Verify the punch is inside the geofence (before storing any photo)
+    with metrics.phase('check-in', 'geofence'):
+        location, error = check_punch_location(emp_id, latitude, longitude, 'check-in', GEOFENCE_ENFORCE_CHECKIN, claims)
+    if error:
+        return None, location_error_response(error)
+    return (emp_id, claims, location), None
+
+def punch_check_in(emp_id, device_fingerprint, latitude, longitude, save_photo=None, authorization=None):
+    """Validate and record a check-in; returns (response body, HTTP status).
+    
+    save_photo, if given, is called with today's date once the device and geofence
+    checks pass, and returns (photo key, created) or raises photos.PhotoTooLarge.
+    authorization is the request's Authorization header (see authorize_punch()).
+    Shared by the Flask route and the ASGI fast path.
+    """
+    checked, error = validate_check_in(emp_id, device_fingerprint, latitude, longitude, authorization)
+    if error:
+        return error
+    emp_id, claims, (latitude, longitude, site_id) = checked
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    photo_relative_path = None
+    if save_photo:
+        # Identical uploads are kept once in the content-addressed store
+        try:
+            with metrics.phase('check-in', 'photo'):
+                photo_relative_path, created = save_photo(today)
+        except photos.PhotoTooLarge as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }, 413
+        # Thumbnails are generated off the request thread
+        if created:
+            thumbnail_worker.submit(photo_store.local_path(photo_relative_path))
+    
+    # Use server timestamp for accuracy (more reliable than client timestamp)
+    server_timestamp = datetime.now().isoformat()
+    event = checkin_event(emp_id, today, server_timestamp, latitude, longitude, photo_relative_path, site_id, claims)
+    with metrics.phase('check-in', 'write'):
+        if punch_queue:
+            # Acknowledged once logged; the writer thread commits it and publishes the event
+            punch_queue.submit({
+                'action': 'checkin', 'empId': emp_id, 'date': today, 'timestamp': server_timestamp,
+                'latitude': latitude, 'longitude': longitude, 'photo': photo_relative_path, 'siteId': site_id
+            }, ('checkin', event))
+        else:
+            write_check_in(emp_id, today, server_timestamp, latitude, longitude, photo_relative_path, site_id)
+    if not punch_queue:
+        broadcaster.publish('checkin', event)
+    
+    return {
+        'success': True,
+        'message': 'Check-in recorded successfully with photo' if save_photo else 'Check-in recorded successfully',
+        'timestamp': server_timestamp  # Return server timestamp for accurate display
+    }, 200
+
+@retry_on_locked()
+def write_check_in(emp_id, date, timestamp, latitude, longitude, photo=None, site_id=None):
+    """Record a check-in in its own transaction (retried on its own, never re-reading an upload)"""
+    with closing(get_db()) as conn:
+        record_check_in(conn, emp_id, date, timestamp, latitude, longitude, photo, site_id)
+        conn.commit()
+
+def punch_check_out(emp_id, device_fingerprint, latitude, longitude, authorization=None):
+    """Validate and record a check-out; returns (response body, HTTP status)"""
+    with metrics.phase('check-out', 'auth'):
+        emp_id, claims, error = authorize_punch(authorization, emp_id)
+    if error:
+        return error
+    if not emp_id:
+        return {
+            'success': False,
+            'message': 'Employee ID is required'
+        }, 400
+    
+    # Verify device fingerprint
+    with metrics.phase('check-out', 'device'):
+        error = punch_device_error(emp_id, device_fingerprint, 'check-out', claims)
+    if error:
+        return {
+            'success': False,
+            'message': error
+        }, 403
+    
+    # Verify the punch is inside the geofence
+    with metrics.phase('check-out', 'geofence'):
+        location, error = check_punch_location(emp_id, latitude, longitude, 'check-out', GEOFENCE_ENFORCE_CHECKOUT, claims)
+    if error:
+        return location_error_response(error)
+    latitude, longitude, _ = location
+    
+    # Use server timestamp for accuracy
+    today = datetime.now().strftime('%Y-%m-%d')
+    server_timestamp = datetime.now().isoformat()
+    with metrics.phase('check-out', 'write'):
+        if punch_queue:
+            error = punch_queue.submit({
+                'action': 'checkout', 'empId': emp_id, 'date': today, 'timestamp': server_timestamp,
+                'latitude': latitude, 'longitude': longitude
+            }, ('checkout', checkout_event(emp_id, today, server_timestamp)),
+                check=queued_check_out_error, read=lambda: stored_punches(emp_id, today))
+        else:
+            error = write_check_out(emp_id, today, server_timestamp, latitude, longitude)
+    if error:
+        return {
+            'success': False,
+            'message': error
+        }, 400
+    if not punch_queue:
+        broadcaster.publish('checkout', checkout_event(emp_id, today, server_timestamp))
+    
+    return {
+        'success': True,
+        'message': 'Check-out recorded successfully',
+        'timestamp': server_timestamp  # Return server timestamp for accurate display
+    }, 200
+
+@retry_on_locked()
+def write_check_out(emp_id, date, timestamp, latitude, longitude):
+    """Record a check-out in its own transaction; returns an error message or None"""
+    with closing(get_db()) as conn:
+        # Only updates if checked in and not yet checked out
+        error = record_check_out(conn, emp_id, date, timestamp, latitude, longitude)
+        if not error:
+            conn.commit()
+    return error
+
+def stored_punches(emp_id, date):
+    """The committed check-in/out row for an employee and date, or None"""
+    with closing(get_db()) as conn:
+        return conn.execute(
+            'SELECT check_in, check_out FROM attendance_records WHERE emp_id = ? AND date = ?',
+            (emp_id, date)
+        ).fetchone()
+
+def queued_check_out_error(record, pending):
+    """Check-out rule in write-behind mode: the stored row merged with punches still queued"""
+    pending = pending or {}
+    if not pending.get('checkIn') and not (record and record['check_in']):
+        return 'You must check in first before checking out'
+    if pending.get('checkOut') or (record and record['check_out']):
+        return 'You have already checked out today'
+    return None
+
+def today_attendance(emp_id):
+    """Today's check-in/out for an employee as the dashboard expects it, or None"""
+    today = datetime.now().strftime('%Y-%m-%d')
+    # Read the queue before the table: a punch committed in between is then seen in one or the other
+    pending = punch_queue.pending(emp_id, today) if punch_queue else None
+    with closing(get_db()) as conn:
+        record = conn.execute('''
+            SELECT check_in, check_in_lat, check_in_lon, check_out, check_out_lat, check_out_lon
+            FROM attendance_records
+            WHERE emp_id = ? AND date = ?
+        ''', (emp_id, today)).fetchone()
+    
+    attendance = {}
+    if record and record['check_in']:
+        attendance = {
+            'checkIn': record['check_in'],
+            'checkInLat': record['check_in_lat'],
+            'checkInLon': record['check_in_lon']
+        }
+        if record['check_out']:
+            attendance['checkOut'] = record['check_out']
+            attendance['checkOutLat'] = record['check_out_lat']
+            attendance['checkOutLon'] = record['check_out_lon']
+    # Punches not yet committed by the write-behind queue (read-your-writes)
+    if pending:
+        attendance.update(pending)
+    return attendance if attendance.get('checkIn') else None
+
+def invalid_body():
+    # Same answer as the ASGI fast path gives a body that isn't a JSON object
+    return jsonify({
+        'success': False,
+        'message': 'Invalid request body'
+    }), 400
+
 @app.route('/employee/checkin', methods=['POST'])
 def employee_checkin():
     # Check if request contains file (photo) or JSON
     if 'photo' in request.files:
         # Handle photo upload
-        emp_id = request.form.get('employeeId')
-        timestamp = request.form.get('timestamp')
-        latitude = request.form.get('latitude')
-        longitude = request.form.get('longitude')
-        device_fingerprint = request.form.get('deviceFingerprint')
         photo_file = request.files['photo']
-        
-        if not emp_id:
-            return jsonify({
-                'success': False,
-                'message': 'Employee ID is required'
-            }), 400
-        
-        # Verify device fingerprint
-        with closing(get_db()) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT device_approved, device_fingerprint FROM employees WHERE emp_id = ?', (emp_id,))
-            employee = cursor.fetchone()
-            
-            if employee and employee['device_approved'] and employee['device_fingerprint']:
-                if not device_fingerprint:
-                    return jsonify({
-                        'success': False,
-                        'message': 'Device fingerprint required for check-in'
-                    }), 403
-                
-                if device_fingerprint != employee['device_fingerprint']:
-                    return jsonify({
-                        'success': False,
-                        'message': 'Device mismatch detected. Check-in denied. Please use your registered device.'
-                    }), 403
-        
-        # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join('static', 'uploads', 'checkin_photos')
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generate unique filename
-        today = datetime.now().strftime('%Y-%m-%d')
-        filename = f"{emp_id}_{today}_{datetime.now().strftime('%H%M%S')}.jpg"
-        filename = secure_filename(filename)
-        photo_path = os.path.join(upload_dir, filename)
-        
-        # Save photo
-        photo_file.save(photo_path)
-        
-        # Store relative path for web access (without leading slash)
-        photo_relative_path = os.path.join('checkin_photos', filename).replace('\\', '/')
-        
-        # Use server timestamp for accuracy (more reliable than client timestamp)
-        server_timestamp = datetime.now().isoformat()
-        
-        # Store check-in record with photo
-        with closing(get_db()) as conn:
-            cursor = conn.cursor()
-            # Check if record exists for today
-            cursor.execute('SELECT id FROM attendance_records WHERE emp_id = ? AND date = ?', (emp_id, today))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing record
-                cursor.execute('''
-                    UPDATE attendance_records 
-                    SET check_in = ?, check_in_lat = ?, check_in_lon = ?, check_in_photo = ?
-                    WHERE emp_id = ? AND date = ?
-                ''', (server_timestamp, latitude, longitude, photo_relative_path, emp_id, today))
-            else:
-                # Insert new record
-                cursor.execute('''
-                    INSERT INTO attendance_records (emp_id, date, check_in, check_in_lat, check_in_lon, check_in_photo)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (emp_id, today, server_timestamp, latitude, longitude, photo_relative_path))
-            conn.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Check-in recorded successfully with photo',
-            'timestamp': server_timestamp  # Return server timestamp for accurate display
-        })
+        body, status = punch_check_in(
+            request.form.get('employeeId'),
+            request.form.get('deviceFingerprint'),
+            request.form.get('latitude'),
+            request.form.get('longitude'),
+            save_photo=lambda today: photo_store.put(photo_file.stream, PHOTO_MAX_BYTES, PHOTO_CHUNK_SIZE, today),
+            authorization=request.headers.get('Authorization')
+        )
     else:
         # Handle JSON request (backward compatibility)
         data = request.get_json()
-        emp_id = data.get('employeeId')
-        device_fingerprint = data.get('deviceFingerprint')
-        
-        # Verify device fingerprint
-        with closing(get_db()) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT device_approved, device_fingerprint FROM employees WHERE emp_id = ?', (emp_id,))
-            employee = cursor.fetchone()
-            
-            if employee and employee['device_approved'] and employee['device_fingerprint']:
-                if not device_fingerprint:
-                    return jsonify({
-                        'success': False,
-                        'message': 'Device fingerprint required for check-in'
-                    }), 403
-                
-                if device_fingerprint != employee['device_fingerprint']:
-                    return jsonify({
-                        'success': False,
-                        'message': 'Device mismatch detected. Check-in denied. Please use your registered device.'
-                    }), 403
-        
-        # Store check-in record
-        today = datetime.now().strftime('%Y-%m-%d')
-        # Use server timestamp for accuracy
-        server_timestamp = datetime.now().isoformat()
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        
-        with closing(get_db()) as conn:
-            cursor = conn.cursor()
-            # Check if record exists for today
-            cursor.execute('SELECT id FROM attendance_records WHERE emp_id = ? AND date = ?', (emp_id, today))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing record
-                cursor.execute('''
-                    UPDATE attendance_records 
-                    SET check_in = ?, check_in_lat = ?, check_in_lon = ?
-                    WHERE emp_id = ? AND date = ?
-                ''', (server_timestamp, latitude, longitude, emp_id, today))
-            else:
-                # Insert new record
-                cursor.execute('''
-                    INSERT INTO attendance_records (emp_id, date, check_in, check_in_lat, check_in_lon)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (emp_id, today, server_timestamp, latitude, longitude))
-            conn.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Check-in recorded successfully',
-            'timestamp': server_timestamp  # Return server timestamp for accurate display
-        })
+        if not isinstance(data, dict):
+            return invalid_body()
+        body, status = punch_check_in(
+            data.get('employeeId'),
+            data.get('deviceFingerprint'),
+            data.get('latitude'),
+            data.get('longitude'),
+            authorization=request.headers.get('Authorization')
+        )
+    return jsonify(body), status
 
 @app.route('/employee/checkout', methods=['POST'])
 def employee_checkout():
     data = request.get_json()
-    emp_id = data.get('employeeId')
+    if not isinstance(data, dict):
+        return invalid_body()
+    body, status = punch_check_out(
+        data.get('employeeId'),
+        data.get('deviceFingerprint'),
+        data.get('latitude'),
+        data.get('longitude'),
+        authorization=request.headers.get('Authorization')
+    )
+    return jsonify(body), status
+
+def parse_punch_time(timestamp):
+    """Client punch time as a naive local datetime; None if missing, in the future or too old"""
+    try:
+        punch_time = datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return None
+    if punch_time.tzinfo is not None:
+        punch_time = punch_time.astimezone().replace(tzinfo=None)
+    now = datetime.now()
+    if punch_time > now + timedelta(seconds=SYNC_CLOCK_SKEW_SECONDS):
+        return None
+    if punch_time < now - timedelta(hours=SYNC_MAX_AGE_HOURS):
+        return None
+    return punch_time
+
+def apply_offline_punch(conn, emp_id, punch, applied_events, rules, claims=None):
+    """Validate and apply one queued punch inside the caller's transaction; returns (status, message).
+
+    rules is punch_rules() for the employee, read before conn was taken. Admin stream
+    events for applied punches are appended to applied_events, to publish after commit.
+    """
+    action = punch.get('action')
+    if action not in ('checkin', 'checkout'):
+        return 'rejected', "action must be 'checkin' or 'checkout'"
+    label = 'check-in' if action == 'checkin' else 'check-out'
+    
+    punch_time = parse_punch_time(punch.get('timestamp'))
+    if punch_time is None:
+        return 'rejected', f'Punch time is missing, in the future or older than {SYNC_MAX_AGE_HOURS} hours'
+    
+    enforce = GEOFENCE_ENFORCE_CHECKIN if action == 'checkin' else GEOFENCE_ENFORCE_CHECKOUT
+    location, error = check_punch_location(emp_id, punch.get('latitude'), punch.get('longitude'), label, enforce,
+                                           claims, rules)
+    if error:
+        return 'rejected', error['message']
+    latitude, longitude, site_id = location
+    
+    date = punch_time.strftime('%Y-%m-%d')
+    timestamp = punch_time.isoformat()
+    if action == 'checkin':
+        # Client clocks decide offline punch times, so they never replace a recorded check-in
+        if record_check_in(conn, emp_id, date, timestamp, latitude, longitude, site_id=site_id, overwrite=False) is None:
+            return 'rejected', f'Already checked in on {date}'
+        employee = claims if claims is not None else rules['employee'] or {'name': None}
+        applied_events.append(('checkin', checkin_event(emp_id, date, timestamp, latitude, longitude,
+                                                        site_id=site_id, employee=employee)))
+        return 'applied', 'Check-in recorded'
+    error = record_check_out(conn, emp_id, date, timestamp, latitude, longitude)
+    if error:
+        return 'rejected', error
+    applied_events.append(('checkout', checkout_event(emp_id, date, timestamp)))
+    return 'applied', 'Check-out recorded'
+
+@app.route('/employee/sync', methods=['POST'])
+def employee_sync():
+    """Apply a batch of punches queued offline, idempotently and in one transaction"""
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return invalid_body()
+    emp_id, claims, error = authorize_punch(request.headers.get('Authorization'), data.get('employeeId'))
+    if error:
+        return jsonify(error[0]), error[1]
     device_fingerprint = data.get('deviceFingerprint')
+    punches = data.get('punches')
     
     if not emp_id:
         return jsonify({
             'success': False,
             'message': 'Employee ID is required'
         }), 400
+    if not isinstance(punches, list) or len(punches) > SYNC_MAX_PUNCHES:
+        return jsonify({
+            'success': False,
+            'message': f'punches must be a list of at most {SYNC_MAX_PUNCHES} items'
+        }), 400
     
-    # Verify device fingerprint
-    with closing(get_db()) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT device_approved, device_fingerprint FROM employees WHERE emp_id = ?', (emp_id,))
-        employee = cursor.fetchone()
-        
-        if employee and employee['device_approved'] and employee['device_fingerprint']:
-            if not device_fingerprint:
-                return jsonify({
-                    'success': False,
-                    'message': 'Device fingerprint required for check-out'
-                }), 403
-            
-            if device_fingerprint != employee['device_fingerprint']:
-                return jsonify({
-                    'success': False,
-                    'message': 'Device mismatch detected. Check-out denied. Please use your registered device.'
-                }), 403
-        
-        # Check if employee has checked in today
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('SELECT id, check_in FROM attendance_records WHERE emp_id = ? AND date = ?', (emp_id, today))
-        record = cursor.fetchone()
-        
-        if not record or not record['check_in']:
-            return jsonify({
-                'success': False,
-                'message': 'You must check in first before checking out'
-            }), 400
-        
-        # Check if already checked out
-        cursor.execute('SELECT check_out FROM attendance_records WHERE emp_id = ? AND date = ?', (emp_id, today))
-        existing_checkout = cursor.fetchone()
-        if existing_checkout and existing_checkout['check_out']:
-            return jsonify({
-                'success': False,
-                'message': 'You have already checked out today'
-            }), 400
-        
-        # Use server timestamp for accuracy
-        server_timestamp = datetime.now().isoformat()
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        
-        # Update attendance record with check-out
-        cursor.execute('''
-            UPDATE attendance_records 
-            SET check_out = ?, check_out_lat = ?, check_out_lon = ?
-            WHERE emp_id = ? AND date = ?
-        ''', (server_timestamp, latitude, longitude, emp_id, today))
-        conn.commit()
-    
-    return jsonify({
-        'success': True,
-        'message': 'Check-out recorded successfully',
-        'timestamp': server_timestamp  # Return server timestamp for accurate display
-    })
-
-@app.route('/employee/register-device', methods=['POST'])
-def employee_register_device():
-    data = request.get_json()
-    emp_id = data.get('employeeId')
-    device_fingerprint = data.get('deviceFingerprint')
+    # Device rules apply to the whole batch (same employee, same device)
+    error = punch_device_error(emp_id, device_fingerprint, 'sync', claims)
+    if error:
+        return jsonify({
+            'success': False,
+            'message': error
+        }), 403
     
-    if not device_fingerprint:
+    # Online punches still in the write-behind queue must land first, so the rules see them
+    if punch_queue and not punch_queue.flush(SYNC_FLUSH_TIMEOUT):
         return jsonify({
             'success': False,
-            'message': 'Device fingerprint is required'
-        }), 400
+            'message': 'Punches are still being saved, please sync again shortly'
+        }), 503
     
-    # Generate device ID
-    device_id = f"Device-{emp_id}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    # Apply in the order the punches happened, not the order they arrived
+    ordered = sorted(
+        (p for p in punches if isinstance(p, dict)),
+        key=lambda p: str(p.get('timestamp') or '')
+    )
+    results, applied_events = apply_offline_punches(emp_id, ordered, punch_rules(emp_id), claims)
+    # Entries that aren't punch objects can't carry a key; report them so the client drops them
+    results.extend({'idempotencyKey': None, 'status': 'rejected', 'message': 'Punch must be an object'}
+                   for p in punches if not isinstance(p, dict))
+    for event_type, payload in applied_events:
+        broadcaster.publish(event_type, payload)
     
-    # Store registration request
-    reg_id = f"REG-{emp_id}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    request_date = datetime.now().isoformat()
+    return jsonify({
+        'success': True,
+        'applied': sum(1 for r in results if r['status'] == 'applied'),
+        'results': results
+    })
+
+@retry_on_locked()
+def apply_offline_punches(emp_id, punches, rules, claims=None):
+    """Apply a sync batch in one transaction, retried as a whole on lock errors (nothing is
+    kept from a failed attempt); returns (per-punch results, admin events to publish).
     
+    rules is punch_rules() for the employee: the batch holds one pooled connection and
+    takes no other.
+    """
+    results = []
+    applied_events = []
+    processed_at = datetime.now().isoformat()
+    with closing(get_db()) as conn:
+        for punch in punches:
+            key = str(punch.get('idempotencyKey') or '')
+            if not key:
+                results.append({'idempotencyKey': None, 'status': 'rejected', 'message': 'idempotencyKey is required'})
+                continue
+            
+            previous = conn.execute(
+                'SELECT status, message FROM processed_punches WHERE idempotency_key = ?', (key,)
+            ).fetchone()
+            if previous:
+                # Already seen - report the original outcome without re-applying
+                results.append({'idempotencyKey': key, 'status': 'duplicate',
+                                'originalStatus': previous['status'], 'message': previous['message']})
+                continue
+            
+            status, message = apply_offline_punch(conn, emp_id, punch, applied_events, rules, claims)
+            conn.execute('''
+                INSERT INTO processed_punches (idempotency_key, emp_id, action, status, message, processed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key, emp_id, str(punch.get('action')), status, message, processed_at))
+            results.append({'idempotencyKey': key, 'status': status, 'message': message})
+        conn.commit()
+    return results, applied_events
+
+@retry_on_locked()
+def insert_registration(reg_id, emp_id, device_id, device_fingerprint, request_date):
+    """Store a pending device registration in its own transaction (retried alone); returns the employee name"""
     with closing(get_db()) as conn:
         cursor = conn.cursor()
         # Get employee name
@@ -463,6 +1434,35 @@ def employee_register_device():
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (reg_id, emp_id, employee_name, device_id, device_fingerprint, request_date, 'pending'))
         conn.commit()
+    return employee_name
+
+@app.route('/employee/register-device', methods=['POST'])
+def employee_register_device():
+    data = request.get_json()
+    emp_id = data.get('employeeId')
+    device_fingerprint = data.get('deviceFingerprint')
+    
+    if not device_fingerprint:
+        return jsonify({
+            'success': False,
+            'message': 'Device fingerprint is required'
+        }), 400
+    
+    # Generate device ID
+    device_id = f"Device-{emp_id}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    
+    # Store registration request
+    reg_id = f"REG-{emp_id}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    request_date = datetime.now().isoformat()
+    
+    employee_name = insert_registration(reg_id, emp_id, device_id, device_fingerprint, request_date)
+    broadcaster.publish('registration', {
+        'id': reg_id,
+        'employeeId': emp_id,
+        'employeeName': employee_name,
+        'deviceId': device_id,
+        'requestDate': request_date
+    })
     
     return jsonify({
         'success': True,
@@ -470,38 +1470,20 @@ def employee_register_device():
         'registrationId': reg_id
     })
 
+def attendance_access_error(authorization, emp_id):
+    """(response body, HTTP status) if the request may not read emp_id's attendance, else None"""
+    _, _, error = authorize_punch(authorization, emp_id)
+    return error
+
 @app.route('/employee/attendance/<emp_id>')
 def employee_attendance(emp_id):
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    with closing(get_db()) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT check_in, check_in_lat, check_in_lon, check_out, check_out_lat, check_out_lon
-            FROM attendance_records
-            WHERE emp_id = ? AND date = ?
-        ''', (emp_id, today))
-        record = cursor.fetchone()
-        
-        if record and record['check_in']:
-            attendance = {
-                'checkIn': record['check_in'],
-                'checkInLat': record['check_in_lat'],
-                'checkInLon': record['check_in_lon']
-            }
-            if record['check_out']:
-                attendance['checkOut'] = record['check_out']
-                attendance['checkOutLat'] = record['check_out_lat']
-                attendance['checkOutLon'] = record['check_out_lon']
-            return jsonify({
-                'success': True,
-                'attendance': attendance
-            })
-        else:
-            return jsonify({
-                'success': True,
-                'attendance': None
-            })
+    error = attendance_access_error(request.headers.get('Authorization'), emp_id)
+    if error:
+        return jsonify(error[0]), error[1]
+    return jsonify({
+        'success': True,
+        'attendance': today_attendance(emp_id)
+    })
 
 # Admin Routes
 @app.route('/admin/login', methods=['GET'])
@@ -519,49 +1501,67 @@ def admin_login_post():
         cursor = conn.cursor()
         cursor.execute('SELECT admin_id, name, password FROM admins WHERE admin_id = ?', (admin_id,))
         admin = cursor.fetchone()
-        
-        if admin and admin['password'] == password:
-            session['admin_id'] = admin_id
-            session['admin_name'] = admin['name']
-            return jsonify({
-                'success': True,
-                'adminId': admin_id,
-                'adminName': admin['name']
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Invalid credentials'
-            }), 401
+    
+    # Hashing runs on the password pool, without holding a database connection
+    try:
+        matches, new_hash = password_hasher.verify(admin['password'] if admin else None, password)
+    except passwords.Busy:
+        return password_hashing_busy()
+    
+    if not matches:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid credentials'
+        }), 401
+    
+    if new_hash:
+        upgrade_password('admins', 'admin_id', admin_id, admin['password'], new_hash)
+    session['admin_id'] = admin_id
+    session['admin_name'] = admin['name']
+    return jsonify({
+        'success': True,
+        'adminId': admin_id,
+        'adminName': admin['name']
+    })
 
 @app.route('/admin/signup', methods=['GET'])
 def admin_signup():
     return render_template('admin_signup.html')
 
-@app.route('/admin/signup', methods=['POST'])
-def admin_signup_post():
-    data = request.get_json()
-    admin_id = data.get('adminId')
-    admin_name = data.get('adminName')
-    admin_email = data.get('adminEmail')
-    password = data.get('password')
-    
-    # Check if admin already exists
+@retry_on_locked()
+def insert_admin(admin_id, name, email, password_hash):
+    """Create an admin in its own transaction (retried alone); returns False if the ID is taken"""
     with closing(get_db()) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT admin_id FROM admins WHERE admin_id = ?', (admin_id,))
         if cursor.fetchone():
-            return jsonify({
-                'success': False,
-                'message': 'Admin ID already exists'
-            }), 400
-        
-        # Create new admin
+            return False
         cursor.execute('''
             INSERT INTO admins (admin_id, name, email, password)
             VALUES (?, ?, ?, ?)
-        ''', (admin_id, admin_name, admin_email, password))
+        ''', (admin_id, name, email, password_hash))
         conn.commit()
+    return True
+
+@app.route('/admin/signup', methods=['POST'])
+def admin_signup_post():
+    data = request.get_json()
+    admin_id = data.get('adminId')
+    admin_name = data.get('adminName')
+    admin_email = data.get('adminEmail')
+    password = data.get('password')
+    
+    try:
+        password_hash = password_hasher.hash(password)
+    except passwords.Busy:
+        return password_hashing_busy()
+    
+    # Create the admin unless the ID already exists
+    if not insert_admin(admin_id, admin_name, admin_email, password_hash):
+        return jsonify({
+            'success': False,
+            'message': 'Admin ID already exists'
+        }), 400
     
     return jsonify({
         'success': True,
@@ -577,15 +1577,15 @@ def admin_dashboard():
 
 @app.route('/admin/employees')
 def admin_employees():
-    # Get all employees with their data
+    # Get all employees with their data (one summary row per employee, no history scan)
+    today = datetime.now().strftime('%Y-%m-%d')
     with closing(get_db()) as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT e.emp_id, e.name, e.email, e.device_id,
-                   MAX(a.check_in) as last_checkin
+                   s.last_check_in as last_checkin, s.last_check_out, s.status_date, s.status
             FROM employees e
-            LEFT JOIN attendance_records a ON e.emp_id = a.emp_id
-            GROUP BY e.emp_id, e.name, e.email, e.device_id
+            LEFT JOIN employee_status s ON e.emp_id = s.emp_id
             ORDER BY e.emp_id
         ''')
         employees_data = cursor.fetchall()
@@ -605,7 +1605,9 @@ def admin_employees():
                 'name': emp['name'],
                 'email': emp['email'],
                 'deviceId': emp['device_id'] if emp['device_id'] else 'Not Registered',
-                'lastCheckIn': last_checkin
+                'lastCheckIn': last_checkin,
+                'lastCheckOut': emp['last_check_out'],
+                'todayStatus': emp['status'] if emp['status_date'] == today else 'absent'
             })
     
     return jsonify({
@@ -613,20 +1615,91 @@ def admin_employees():
         'employees': employees_list
     })
 
+def encode_cursor(values):
+    """Opaque pagination cursor for a (date, check_in, emp_id) position"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; returns None for a malformed cursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != 3 or not all(isinstance(v, str) for v in values):
+        return None
+    return values
+
 @app.route('/admin/attendance-records')
 def admin_attendance_records():
-    """Get all attendance records with photos"""
-    with closing(get_db()) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
+    """Get attendance records with photos, newest first, one keyset page at a time.
+    
+    Query parameters: limit, cursor (from a previous nextCursor), from/to (YYYY-MM-DD),
+    empId and siteId.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', RECORDS_PAGE_SIZE)), 1), RECORDS_MAX_PAGE_SIZE)
+        site_id = int(request.args['siteId']) if request.args.get('siteId') else None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'limit and siteId must be integers'
+        }), 400
+    
+    # Build filters; every combination is served by one of the covering indexes
+    conditions = ['a.check_in IS NOT NULL']
+    params = []
+    if request.args.get('from'):
+        conditions.append('a.date >= ?')
+        params.append(request.args['from'])
+    if request.args.get('to'):
+        conditions.append('a.date <= ?')
+        params.append(request.args['to'])
+    if request.args.get('empId'):
+        conditions.append('a.emp_id = ?')
+        params.append(request.args['empId'])
+    if site_id is not None:
+        conditions.append('a.site_id = ?')
+        params.append(site_id)
+    if request.args.get('cursor'):
+        position = decode_cursor(request.args['cursor'])
+        if position is None:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid cursor'
+            }), 400
+        # Seek past the last row of the previous page instead of using OFFSET
+        conditions.append('(a.date, a.check_in, a.emp_id) < (?, ?, ?)')
+        params.extend(position)
+    
+    def fetch(conn, source, count):
+        return conn.execute(f'''
             SELECT a.emp_id, e.name, a.date, a.check_in, a.check_in_lat, a.check_in_lon, a.check_in_photo
-            FROM attendance_records a
+            FROM {source} a
             JOIN employees e ON a.emp_id = e.emp_id
-            WHERE a.check_in IS NOT NULL
-            ORDER BY a.date DESC, a.check_in DESC
-            LIMIT 100
-        ''')
-        records = cursor.fetchall()
+            WHERE {' AND '.join(conditions)}
+            ORDER BY a.date DESC, a.check_in DESC, a.emp_id DESC
+            LIMIT ?
+        ''', params + [count]).fetchall()
+    
+    with closing(get_db()) as conn:
+        records = fetch(conn, 'attendance_records', limit + 1)
+        
+        # Archived months are all older than attendance_records, so a page that runs
+        # past the hot table continues into them, newest first
+        if len(records) <= limit:
+            newest = position[0] if request.args.get('cursor') else request.args.get('to')
+            for month in reversed(archive.archived_months(conn, request.args.get('from'), newest)):
+                with archive.attached(conn, ARCHIVE_DIR, month) as schema:
+                    records += fetch(conn, f'{schema}.attendance_records', limit + 1 - len(records))
+                if len(records) > limit:
+                    break
+        
+        # One extra row tells us whether another page exists
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            last = records[-1]
+            next_cursor = encode_cursor([last['date'], last['check_in'], last['emp_id']])
         
         attendance_list = []
         for record in records:
@@ -648,12 +1721,239 @@ def admin_attendance_records():
                 'date': record['date'],
                 'checkInTime': check_in_time,
                 'location': location,
-                'photo': record['check_in_photo'] if record['check_in_photo'] else None
+                'photo': record['check_in_photo'] if record['check_in_photo'] else None,
+                'thumbnail': photos.variant_name(record['check_in_photo'], 'thumb') if record['check_in_photo'] else None
             })
     
     return jsonify({
         'success': True,
-        'records': attendance_list
+        'records': attendance_list,
+        'nextCursor': next_cursor
+    })
+
+def parse_export_range(date_from, date_to):
+    """Validate an export date range; defaults to the current month. Returns (from, to) or None"""
+    today = datetime.now()
+    date_from = date_from or today.strftime('%Y-%m-01')
+    date_to = date_to or today.strftime('%Y-%m-%d')
+    try:
+        datetime.strptime(date_from, '%Y-%m-%d')
+        datetime.strptime(date_to, '%Y-%m-%d')
+    except ValueError:
+        return None
+    return date_from, date_to
+
+def iter_export_batches(date_from, date_to, emp_id=None):
+    """Stream export batches on a pooled connection held only while iterating.
+    
+    Archived months in the range are read from their archive files, oldest first,
+    before the rest of the range is read from attendance_records.
+    """
+    with closing(get_db()) as conn:
+        for month in archive.archived_months(conn, date_from, date_to):
+            first, last = rollups.month_bounds(month)
+            with archive.attached(conn, ARCHIVE_DIR, month) as schema:
+                yield from export.iter_batches(conn, max(first, date_from), min(last, date_to), emp_id,
+                                               EXPORT_BATCH_SIZE, f'{schema}.attendance_records')
+        yield from export.iter_batches(conn, date_from, date_to, emp_id, EXPORT_BATCH_SIZE)
+
+@app.route('/admin/export')
+def admin_export():
+    """Stream attendance joined with employees for a date range as CSV, NDJSON, Arrow or Parquet"""
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.available_formats():
+        return jsonify({
+            'success': False,
+            'message': f'Unsupported format. Available: {", ".join(export.available_formats())}'
+        }), 400
+    
+    date_range = parse_export_range(request.args.get('from'), request.args.get('to'))
+    if not date_range:
+        return jsonify({
+            'success': False,
+            'message': 'Dates must be in YYYY-MM-DD format'
+        }), 400
+    date_from, date_to = date_range
+    batches = iter_export_batches(date_from, date_to, request.args.get('empId'))
+    filename = f'attendance_{date_from}_{date_to}.{fmt}'
+    
+    if fmt == 'parquet':
+        # Parquet needs its footer written last, so spool to a temporary file on disk
+        spool = tempfile.TemporaryFile()
+        export.write_parquet(batches, spool)
+        spool.seek(0)
+        return send_file(spool, mimetype=export.MIMETYPES[fmt], as_attachment=True, download_name=filename)
+    
+    encoders = {'csv': export.iter_csv, 'ndjson': export.iter_ndjson, 'arrow': export.iter_arrow}
+    return Response(
+        stream_with_context(encoders[fmt](batches)),
+        mimetype=export.MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.cli.command('export-attendance')
+@click.option('--from', 'date_from', help='First date (YYYY-MM-DD), default start of this month')
+@click.option('--to', 'date_to', help='Last date (YYYY-MM-DD), default today')
+@click.option('--emp-id', help='Only export this employee')
+@click.option('--format', 'fmt', default='csv', type=click.Choice(['csv', 'ndjson', 'arrow', 'parquet']))
+@click.option('--output', '-o', default='-', help='Output file, "-" for stdout')
+def export_attendance_command(date_from, date_to, emp_id, fmt, output):
+    """Export attendance records for a date range without loading them into memory."""
+    if fmt not in export.available_formats():
+        raise click.UsageError(f'{fmt} export needs pyarrow installed')
+    date_range = parse_export_range(date_from, date_to)
+    if not date_range:
+        raise click.UsageError('Dates must be in YYYY-MM-DD format')
+    
+    batches = iter_export_batches(date_range[0], date_range[1], emp_id)
+    if output == '-':
+        if fmt == 'parquet':
+            raise click.UsageError('Parquet export needs --output')
+        export.write_export(batches, fmt, sys.stdout.buffer)
+    else:
+        with open(output, 'wb') as target:
+            export.write_export(batches, fmt, target)
+        click.echo(f'Wrote {output}', err=True)
+
+@app.route('/admin/analytics/daily')
+def admin_analytics_daily():
+    """Hours worked and on-time flags per employee per day, read from the daily rollup"""
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    date_range = parse_export_range(request.args.get('from'), request.args.get('to'))
+    if not date_range:
+        return jsonify({
+            'success': False,
+            'message': 'Dates must be in YYYY-MM-DD format'
+        }), 400
+    date_from, date_to = date_range
+    span = (datetime.strptime(date_to, '%Y-%m-%d') - datetime.strptime(date_from, '%Y-%m-%d')).days
+    if span < 0 or span >= ANALYTICS_MAX_DAYS:
+        return jsonify({
+            'success': False,
+            'message': f'Date range must be between 1 and {ANALYTICS_MAX_DAYS} days'
+        }), 400
+    
+    with closing(get_db()) as conn:
+        days = rollups.daily_rows(conn, date_from, date_to, request.args.get('empId'))
+    
+    return jsonify({
+        'success': True,
+        'from': date_from,
+        'to': date_to,
+        'onTimeCutoff': ON_TIME_CUTOFF,
+        'days': days
+    })
+
+@app.route('/admin/analytics/monthly')
+def admin_analytics_monthly():
+    """Monthly totals (present, absent, late, hours) per employee, read from the monthly rollup"""
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    month = request.args.get('month') or datetime.now().strftime('%Y-%m')
+    try:
+        datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Month must be in YYYY-MM format'
+        }), 400
+    
+    with closing(get_db()) as conn:
+        summary = rollups.monthly_summary(conn, month, request.args.get('empId'), datetime.now().date())
+    
+    return jsonify({
+        'success': True,
+        'month': month,
+        'onTimeCutoff': ON_TIME_CUTOFF,
+        'employees': summary
+    })
+
+@app.cli.command('rollup-attendance')
+@click.option('--from', 'date_from', help='First date to rebuild (YYYY-MM-DD), default all history')
+@click.option('--to', 'date_to', help='Last date to rebuild (YYYY-MM-DD), default all history')
+def rollup_attendance_command(date_from, date_to):
+    """Rebuild the daily and monthly attendance rollups (run nightly)."""
+    for value in (date_from, date_to):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise click.UsageError('Dates must be in YYYY-MM-DD format')
+    with closing(get_db()) as conn:
+        result = retry_on_locked()(rebuild_rollups)(conn, date_from, date_to)
+    click.echo(f"Rebuilt {result['dailyRows']} daily and {result['monthlyRows']} monthly rows "
+               f"in {result['seconds']}s")
+
+@app.cli.command('archive-attendance')
+@click.option('--month', help='Archive only this closed month (YYYY-MM)')
+@click.option('--restore', help='Move this archived month (the newest one) back into attendance_records')
+def archive_attendance_command(month, restore):
+    """Move closed months out of attendance_records into compressed per-month archives (run monthly)."""
+    for value in (month, restore):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m')
+            except ValueError:
+                raise click.UsageError('Months must be in YYYY-MM format')
+    
+    with closing(get_db()) as conn:
+        if restore:
+            try:
+                rows = archive.restore_month(conn, restore, ARCHIVE_DIR)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+            click.echo(f'Restored {rows} rows of {restore} into attendance_records')
+            return
+        
+        # Keep recent months hot, and never archive a month offline punches may still sync into
+        now = datetime.now()
+        before = min(archive.shift_month(now.strftime('%Y-%m'), -ARCHIVE_KEEP_MONTHS),
+                     (now - timedelta(hours=SYNC_MAX_AGE_HOURS)).strftime('%Y-%m'))
+        if month and month >= before:
+            raise click.UsageError(f'Only months before {before} are closed')
+        try:
+            if month:
+                results = [archive.archive_month(conn, month, ARCHIVE_DIR)]
+            else:
+                results = archive.archive_before(conn, before, ARCHIVE_DIR)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    for result in results:
+        click.echo(f"Archived {result['rows']} rows of {result['month']} "
+                   f"({result['bytes']} bytes compressed) in {result['seconds']}s")
+    if not results:
+        click.echo(f'Nothing to archive before {before}')
+
+@app.route('/admin/archives')
+def admin_archives():
+    """Rows kept in attendance_records and in each monthly archive"""
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    with closing(get_db()) as conn:
+        stats = archive.stats(conn, ARCHIVE_DIR)
+    return jsonify({
+        'success': True,
+        'keepMonths': ARCHIVE_KEEP_MONTHS,
+        **stats
     })
 
 @app.route('/uploads/<path:filename>')
@@ -661,13 +1961,40 @@ def serve_photo(filename):
     """Serve uploaded photos from static/uploads directory"""
     try:
         # Handle subdirectory paths like 'checkin_photos/filename.jpg'
-        upload_dir = os.path.join('static', 'uploads')
+        upload_dir = UPLOAD_ROOT
         # Normalize the path and ensure it's safe
         safe_path = os.path.normpath(filename).replace('\\', '/')
         # Prevent directory traversal
         if '..' in safe_path or safe_path.startswith('/'):
             return jsonify({'error': 'Invalid path'}), 400
-        return send_from_directory(upload_dir, safe_path)
+        # Variants may not exist yet (still queued, or Pillow missing) - fall back to the original
+        fallback = False
+        if not os.path.exists(os.path.join(upload_dir, safe_path)):
+            original = photos.original_name(safe_path)
+            if original:
+                safe_path = original
+                fallback = True
+        
+        # Content-addressed photos are immutable: strong ETag and a long cache lifetime
+        if photo_store.owns(safe_path):
+            path = photo_store.local_path(safe_path)
+            if not os.path.isfile(path):
+                return jsonify({'error': 'Photo not found'}), 404
+            if fallback:
+                # Stand-in for a variant that will exist later - don't let it be cached under the variant's URL
+                response = send_file(path, mimetype='image/jpeg', etag=False, max_age=0, conditional=False)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+            response = send_file(path, mimetype='image/jpeg', etag=photo_store.etag(safe_path),
+                                 max_age=PHOTO_CACHE_MAX_AGE, conditional=True)
+            response.headers['Cache-Control'] = f'private, max-age={PHOTO_CACHE_MAX_AGE}, immutable'
+            return response
+        
+        # Legacy flat checkin_photos/ files
+        response = send_from_directory(upload_dir, safe_path)
+        if fallback:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         app.logger.error(f'Error serving photo {filename}: {str(e)}')
         return jsonify({'error': 'Photo not found', 'message': str(e)}), 404
@@ -700,8 +2027,9 @@ def admin_pending_registrations():
         'registrations': pending
     })
 
-@app.route('/admin/approve-device/<reg_id>', methods=['POST'])
-def admin_approve_device(reg_id):
+@retry_on_locked()
+def approve_registration(reg_id):
+    """Approve a device registration in its own transaction (retried alone); returns (emp_id, device_id), or None if unknown"""
     with closing(get_db()) as conn:
         cursor = conn.cursor()
         # Check if registration exists and get fingerprint
@@ -709,10 +2037,7 @@ def admin_approve_device(reg_id):
         reg_data = cursor.fetchone()
         
         if not reg_data:
-            return jsonify({
-                'success': False,
-                'message': 'Registration not found'
-            }), 404
+            return None
         
         emp_id = reg_data['employee_id']
         device_id = reg_data['device_id']
@@ -733,63 +2058,220 @@ def admin_approve_device(reg_id):
         ''', (reg_id,))
         
         conn.commit()
+    return emp_id, device_id
+
+@app.route('/admin/approve-device/<reg_id>', methods=['POST'])
+def admin_approve_device(reg_id):
+    approved = approve_registration(reg_id)
+    if approved is None:
+        return jsonify({
+            'success': False,
+            'message': 'Registration not found'
+        }), 404
+    emp_id, device_id = approved
+    
+    # Device state changed - force the next lookup to hit the database
+    employee_cache.invalidate(emp_id)
+    broadcaster.publish('registrations_decided', {
+        'status': 'approved',
+        'regIds': [reg_id],
+        'devices': {emp_id: device_id}
+    })
+    
+    return jsonify({
+        'success': True,
+        'message': 'Device approved successfully'
+    })
+
+@retry_on_locked()
+def reject_registration(reg_id):
+    """Reject a device registration in its own transaction (retried alone); returns the employee ID, or None if unknown"""
+    with closing(get_db()) as conn:
+        cursor = conn.cursor()
+        # Check if registration exists
+        cursor.execute('SELECT employee_id FROM device_registrations WHERE reg_id = ?', (reg_id,))
+        reg_data = cursor.fetchone()
+        if not reg_data:
+            return None
+        
+        # Update registration status
+        cursor.execute('''
+            UPDATE device_registrations 
+            SET status = 'rejected'
+            WHERE reg_id = ?
+        ''', (reg_id,))
+        conn.commit()
+    return reg_data['employee_id']
+
+@app.route('/admin/reject-device/<reg_id>', methods=['POST'])
+def admin_reject_device(reg_id):
+    emp_id = reject_registration(reg_id)
+    if emp_id is None:
+        return jsonify({
+            'success': False,
+            'message': 'Registration not found'
+        }), 404
+    
+    employee_cache.invalidate(emp_id)
+    broadcaster.publish('registrations_decided', {
+        'status': 'rejected',
+        'regIds': [reg_id],
+        'devices': {}
+    })
+    
+    return jsonify({
+        'success': True,
+        'message': 'Device registration rejected'
+    })
+
+# Bulk admin routes
+@app.route('/admin/employees/import', methods=['POST'])
+def admin_import_employees():
+    """Import many employees from a JSON body or an uploaded CSV/JSON file"""
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    if 'file' in request.files:
+        upload = request.files['file']
+        try:
+            records = bulk.read_employee_file(upload.stream, upload.filename or '')
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({
+                'success': False,
+                'message': f'Could not parse file: {e}'
+            }), 400
+    else:
+        data = request.get_json(silent=True)
+        records = data.get('employees') if isinstance(data, dict) else data
+    
+    if not isinstance(records, list):
+        return jsonify({
+            'success': False,
+            'message': 'Expected a list of employees'
+        }), 400
+    if len(records) > BULK_UPLOAD_MAX_ROWS:
+        return jsonify({
+            'success': False,
+            'message': f'At most {BULK_UPLOAD_MAX_ROWS} employees per upload; '
+                       'import larger files with `flask import-employees`'
+        }), 413
+    
+    with closing(get_db()) as conn:
+        result = bulk.import_employees(conn, records, BULK_CHUNK_SIZE, password_hasher.hash_many)
+    
+    # Drop any cached "employee not found" entries
+    emp_ids = result.pop('empIds')
+    for emp_id in emp_ids:
+        employee_cache.invalidate(emp_id)
+    if emp_ids:
+        broadcaster.publish('employees_imported', {'count': len(emp_ids)})
+    
+    result['success'] = True
+    return jsonify(result)
+
+@app.route('/admin/registrations/batch', methods=['POST'])
+def admin_batch_registrations():
+    """Approve or reject many device registrations in one call"""
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    data = request.get_json() or {}
+    action = data.get('action')
+    reg_ids = data.get('regIds')
+    if action not in ('approve', 'reject'):
+        return jsonify({
+            'success': False,
+            'message': "action must be 'approve' or 'reject'"
+        }), 400
     
-    return jsonify({
-        'success': True,
-        'message': 'Device approved successfully'
-    })
-
-@app.route('/admin/reject-device/<reg_id>', methods=['POST'])
-def admin_reject_device(reg_id):
     with closing(get_db()) as conn:
-        cursor = conn.cursor()
-        # Check if registration exists
-        cursor.execute('SELECT reg_id FROM device_registrations WHERE reg_id = ?', (reg_id,))
-        if not cursor.fetchone():
+        if reg_ids == 'all-pending':
+            reg_ids = [r['reg_id'] for r in conn.execute("SELECT reg_id FROM device_registrations WHERE status = 'pending'")]
+        if not isinstance(reg_ids, list):
             return jsonify({
                 'success': False,
-                'message': 'Registration not found'
-            }), 404
-        
-        # Update registration status
-        cursor.execute('''
-            UPDATE device_registrations 
-            SET status = 'rejected'
-            WHERE reg_id = ?
-        ''', (reg_id,))
-        conn.commit()
+                'message': "regIds must be a list or 'all-pending'"
+            }), 400
+        result = bulk.decide_registrations(conn, [str(r) for r in reg_ids], action == 'approve', BULK_CHUNK_SIZE)
     
-    return jsonify({
-        'success': True,
-        'message': 'Device registration rejected'
-    })
+    # Device state changed - force the next lookups to hit the database
+    emp_ids = result.pop('empIds')
+    device_ids = result.pop('deviceIds')
+    for emp_id in set(emp_ids):
+        employee_cache.invalidate(emp_id)
+    if result['regIds']:
+        broadcaster.publish('registrations_decided', {
+            'status': 'approved' if action == 'approve' else 'rejected',
+            'regIds': result['regIds'],
+            'devices': dict(zip(emp_ids, device_ids)) if action == 'approve' else {}
+        })
+    
+    result['success'] = True
+    return jsonify(result)
+
+@app.cli.command('import-employees')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_employees_command(path):
+    """Import employees from a CSV (emp_id,name,email,password) or JSON file."""
+    with open(path, 'rb') as f:
+        records = bulk.read_employee_file(f, path)
+    with closing(get_db()) as conn:
+        result = bulk.import_employees(conn, records, BULK_CHUNK_SIZE, password_hasher.hash_many)
+    for error in result['errors']:
+        click.echo(f"row {error['row']}: {error.get('empId', '')} {error['message']}", err=True)
+    click.echo(f"Imported {result['imported']}, failed {result['failed']} "
+               f"in {result['seconds']}s ({result['rowsPerSecond']} rows/s)")
+
+@app.cli.command('decide-devices')
+@click.argument('action', type=click.Choice(['approve', 'reject']))
+@click.argument('reg_ids', nargs=-1)
+@click.option('--all-pending', is_flag=True, help='Apply to every pending registration')
+def decide_devices_command(action, reg_ids, all_pending):
+    """Approve or reject device registrations in bulk."""
+    with closing(get_db()) as conn:
+        if all_pending:
+            reg_ids = [r['reg_id'] for r in conn.execute("SELECT reg_id FROM device_registrations WHERE status = 'pending'")]
+        result = bulk.decide_registrations(conn, list(reg_ids), action == 'approve', BULK_CHUNK_SIZE)
+    for error in result['errors']:
+        click.echo(f"{error['regId']}: {error['message']}", err=True)
+    done = result['approved' if action == 'approve' else 'rejected']
+    click.echo(f"{action.capitalize()}d {done}, failed {result['failed']} in {result['seconds']}s")
 
 # Geofence configuration routes
 @app.route('/admin/geofence-config', methods=['GET'])
 def get_geofence_config():
+    # Admins always revalidate so they see their own edits immediately
+    return geofence_config_response('no-cache')
+
+@retry_on_locked()
+def save_geofence_config(latitude, longitude, radius):
+    """Write the single-circle geofence in its own transaction (retried alone)"""
     with closing(get_db()) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT latitude, longitude, radius FROM geofence_config ORDER BY id DESC LIMIT 1')
-        config = cursor.fetchone()
+        # Check if config exists
+        cursor.execute('SELECT id FROM geofence_config ORDER BY id DESC LIMIT 1')
+        existing = cursor.fetchone()
         
-        if config:
-            return jsonify({
-                'success': True,
-                'config': {
-                    'latitude': config['latitude'],
-                    'longitude': config['longitude'],
-                    'radius': config['radius']
-                }
-            })
+        if existing:
+            # Update existing config
+            cursor.execute('''
+                UPDATE geofence_config 
+                SET latitude = ?, longitude = ?, radius = ?
+                WHERE id = ?
+            ''', (latitude, longitude, radius, existing['id']))
         else:
-            return jsonify({
-                'success': True,
-                'config': {
-                    'latitude': GEOFENCE_CONFIG['latitude'],
-                    'longitude': GEOFENCE_CONFIG['longitude'],
-                    'radius': GEOFENCE_CONFIG['radius']
-                }
-            })
+            # Insert new config
+            cursor.execute('''
+                INSERT INTO geofence_config (latitude, longitude, radius)
+                VALUES (?, ?, ?)
+            ''', (latitude, longitude, radius))
+        conn.commit()
 
 @app.route('/admin/geofence-config', methods=['POST'])
 def update_geofence_config():
@@ -833,30 +2315,218 @@ def update_geofence_config():
             'message': 'Invalid number format'
         }), 400
     
+    save_geofence_config(latitude, longitude, radius)
+    
+    # Refresh the in-memory copy (and its ETag) from what was just written
+    load_geofence_config()
+    
+    return jsonify({
+        'success': True,
+        'message': 'Geofence configuration updated successfully'
+    })
+
+@app.route('/admin/geofence/validate', methods=['POST'])
+def admin_validate_points():
+    """Validate many coordinates against the active geofence in one vectorized call"""
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    data = request.get_json() or {}
+    points = data.get('points') or []
+    try:
+        lats = [float(point['latitude']) for point in points]
+        lons = [float(point['longitude']) for point in points]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'message': 'Each point needs numeric latitude and longitude'
+        }), 400
+    
+    config, _ = get_active_geofence()
+    inside, distances = geofence.check_points(config, lats, lons)
+    results = [{'inside': bool(ok), 'distance': round(float(d), 1)} for ok, d in zip(inside, distances)]
+    
+    return jsonify({
+        'success': True,
+        'total': len(results),
+        'inside': sum(1 for r in results if r['inside']),
+        'results': results
+    })
+
+# Multi-site geofence routes
+@app.route('/admin/sites', methods=['GET'])
+def admin_sites():
+    index, _ = get_site_index()
+    return jsonify({
+        'success': True,
+        'sites': [index.fences[site_id].to_dict() for site_id in sorted(index.fences)]
+    })
+
+@retry_on_locked()
+def insert_site(name, latitude, longitude, radius, polygon):
+    """Create a site in its own transaction (retried alone); returns its ID, or None if the name is taken"""
+    with closing(get_db()) as conn:
+        try:
+            row = conn.execute('''
+                INSERT INTO geofence_sites (name, latitude, longitude, radius, polygon)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING site_id
+            ''', (name, latitude, longitude, radius, polygon)).fetchone()
+        except sqlite3.IntegrityError:
+            return None
+        conn.commit()
+    return row['site_id']
+
+@app.route('/admin/sites', methods=['POST'])
+def admin_create_site():
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    data = request.get_json() or {}
+    name = (data.get('name') or '').strip()
+    polygon = data.get('polygon')
+    if not name:
+        return jsonify({
+            'success': False,
+            'message': 'Site name is required'
+        }), 400
+    
+    # Validate inputs: either a polygon, or a circle (center + radius)
+    latitude = longitude = radius = None
+    if polygon:
+        try:
+            polygon = [[float(lat), float(lon)] for lat, lon in polygon]
+        except (TypeError, ValueError):
+            polygon = None
+        if not polygon or len(polygon) < 3 or any(geofence.parse_coordinates(*p) is None for p in polygon):
+            return jsonify({
+                'success': False,
+                'message': 'Polygon needs at least 3 valid [latitude, longitude] points'
+            }), 400
+        polygon = json.dumps(polygon)
+    else:
+        location = geofence.parse_coordinates(data.get('latitude'), data.get('longitude'))
+        try:
+            radius = float(data.get('radius'))
+        except (TypeError, ValueError):
+            radius = None
+        if location is None or radius is None or radius <= 0:
+            return jsonify({
+                'success': False,
+                'message': 'Circle sites need valid latitude, longitude and a radius greater than 0'
+            }), 400
+        latitude, longitude = location
+        polygon = None
+    
+    site_id = insert_site(name, latitude, longitude, radius, polygon)
+    if site_id is None:
+        return jsonify({
+            'success': False,
+            'message': 'A site with this name already exists'
+        }), 400
+    
+    load_site_index()
+    
+    return jsonify({
+        'success': True,
+        'message': 'Site created successfully',
+        'siteId': site_id
+    })
+
+@retry_on_locked()
+def deactivate_site(site_id):
+    """Deactivate a site in its own transaction (retried alone); returns False if it isn't active"""
+    # Sites are deactivated rather than deleted so old records keep their site_id
     with closing(get_db()) as conn:
         cursor = conn.cursor()
-        # Check if config exists
-        cursor.execute('SELECT id FROM geofence_config ORDER BY id DESC LIMIT 1')
-        existing = cursor.fetchone()
+        cursor.execute('UPDATE geofence_sites SET active = 0 WHERE site_id = ? AND active = 1', (site_id,))
+        if cursor.rowcount == 0:
+            return False
+        conn.commit()
+    return True
+
+@app.route('/admin/sites/<int:site_id>', methods=['DELETE'])
+def admin_delete_site(site_id):
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    if not deactivate_site(site_id):
+        return jsonify({
+            'success': False,
+            'message': 'Site not found'
+        }), 404
+    
+    load_site_index()
+    
+    return jsonify({
+        'success': True,
+        'message': 'Site removed successfully'
+    })
+
+@retry_on_locked()
+def replace_employee_sites(emp_id, site_ids):
+    """Replace an employee's site assignments in its own transaction (retried alone); returns False if unknown"""
+    with closing(get_db()) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT emp_id FROM employees WHERE emp_id = ?', (emp_id,))
+        if not cursor.fetchone():
+            return False
         
-        if existing:
-            # Update existing config
-            cursor.execute('''
-                UPDATE geofence_config 
-                SET latitude = ?, longitude = ?, radius = ?
-                WHERE id = ?
-            ''', (latitude, longitude, radius, existing['id']))
-        else:
-            # Insert new config
-            cursor.execute('''
-                INSERT INTO geofence_config (latitude, longitude, radius)
-                VALUES (?, ?, ?)
-            ''', (latitude, longitude, radius))
+        # Replace the employee's assignments (an empty list means "any site")
+        cursor.execute('DELETE FROM employee_sites WHERE emp_id = ?', (emp_id,))
+        cursor.executemany(
+            'INSERT INTO employee_sites (emp_id, site_id) VALUES (?, ?)',
+            [(emp_id, site_id) for site_id in site_ids]
+        )
         conn.commit()
+    return True
+
+@app.route('/admin/employees/<emp_id>/sites', methods=['PUT'])
+def admin_assign_sites(emp_id):
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    data = request.get_json() or {}
+    try:
+        site_ids = sorted({int(site_id) for site_id in data.get('siteIds') or []})
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'message': 'siteIds must be a list of site ids'
+        }), 400
+    
+    index, _ = get_site_index()
+    unknown = [site_id for site_id in site_ids if site_id not in index.fences]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'message': f'Unknown site ids: {unknown}'
+        }), 400
+    
+    if not replace_employee_sites(emp_id, site_ids):
+        return jsonify({
+            'success': False,
+            'message': 'Employee not found'
+        }), 404
+    
+    employee_cache.invalidate(emp_id)
     
     return jsonify({
         'success': True,
-        'message': 'Geofence configuration updated successfully'
+        'message': 'Employee sites updated successfully',
+        'siteIds': site_ids
     })
 
 # Employee device status route
@@ -890,29 +2560,219 @@ def employee_device_status():
 # Get geofence config for employee
 @app.route('/employee/geofence-config')
 def employee_geofence_config():
+    return geofence_config_response(
+        f'private, max-age={GEOFENCE_CONFIG_MAX_AGE}, must-revalidate',
+        session.get('employee_id')
+    )
+
+# Admin live updates
+@app.route('/admin/events')
+def admin_events():
+    """Server-Sent Events stream of check-ins, check-outs and device registration changes"""
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    subscriber = broadcaster.subscribe()
+    if subscriber is None:
+        return jsonify({
+            'success': False,
+            'message': 'Too many live connections, please use Refresh'
+        }), 503
+    
+    # EventSource resends the last id it saw when reconnecting
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    
+    response = Response(
+        broadcaster.stream(subscriber, last_event_id, EVENTS_HEARTBEAT),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Also covers clients that disconnect before the stream starts
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscriber))
+    return response
+
+# Expected location-poll cost per employee under the adaptive schedule
+@app.route('/admin/poll-stats')
+def admin_poll_stats():
+    """Estimate location fixes per day per employee, versus the old fixed 30-second poll.
+
+    Checked-out employees use the checked-out rate, checked-in employees the band of
+    today's check-in point, and everyone else the farthest band. All figures assume
+    the dashboard stays open all day.
+    """
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    cost = geofence.daily_poll_cost(POLL_SCHEDULE)
+    config, _ = get_active_geofence()
+    index, _ = get_site_index()
+    default_fence = geofence.Fence(None, 'default', config['latitude'], config['longitude'], config['radius'])
+    far_band = len(POLL_SCHEDULE['bands']) - 1
+    today = datetime.now().strftime('%Y-%m-%d')
+    
     with closing(get_db()) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT latitude, longitude, radius FROM geofence_config ORDER BY id DESC LIMIT 1')
-        config = cursor.fetchone()
-        
-        if config:
-            return jsonify({
-                'success': True,
-                'config': {
-                    'latitude': config['latitude'],
-                    'longitude': config['longitude'],
-                    'radius': config['radius']
-                }
-            })
+        rows = conn.execute('''
+            SELECT e.emp_id, s.status, a.check_in_lat, a.check_in_lon, a.site_id
+            FROM employees e
+            LEFT JOIN employee_status s ON s.emp_id = e.emp_id AND s.status_date = ?
+            LEFT JOIN attendance_records a ON a.emp_id = e.emp_id AND a.date = ?
+            ORDER BY e.emp_id
+        ''', (today, today)).fetchall()
+    
+    employees = []
+    for row in rows:
+        state = row['status'] or 'absent'
+        band = None
+        if state == 'checked_out':
+            fixes = cost['checkedOut']
+        elif state == 'checked_in' and row['check_in_lat'] is not None:
+            fence = index.fences.get(row['site_id'], default_fence)
+            distance = geofence.boundary_distance(fence, row['check_in_lat'], row['check_in_lon'])
+            band = geofence.band_index(POLL_SCHEDULE, distance)
+            fixes = cost['bands'][band]
         else:
-            return jsonify({
-                'success': True,
-                'config': {
-                    'latitude': GEOFENCE_CONFIG['latitude'],
-                    'longitude': GEOFENCE_CONFIG['longitude'],
-                    'radius': GEOFENCE_CONFIG['radius']
-                }
-            })
+            band = far_band
+            fixes = cost['bands'][band]
+        employees.append({
+            'empId': row['emp_id'],
+            'state': state,
+            'band': band,
+            'expectedFixesPerDay': fixes
+        })
+    
+    adaptive = sum(e['expectedFixesPerDay'] for e in employees)
+    fixed = cost['fixed'] * len(employees)
+    return jsonify({
+        'success': True,
+        'pollSchedule': POLL_SCHEDULE,
+        'costPerDay': cost,
+        'employees': employees,
+        'totals': {
+            'adaptiveFixesPerDay': round(adaptive, 1),
+            'fixedFixesPerDay': fixed,
+            'savedPercent': round(100 * (1 - adaptive / fixed), 1) if fixed else None
+        }
+    })
+
+# Database pool statistics
+@app.route('/admin/db-stats')
+def admin_db_stats():
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    with closing(get_db()) as conn:
+        version = schema_version(conn)
+    return jsonify({
+        'success': True,
+        'pool': db_pool.stats(),
+        'ingest': punch_queue.stats() if punch_queue else None,
+        'schemaVersion': version
+    })
+
+# Employee cache statistics
+@app.route('/admin/cache-stats')
+def admin_cache_stats():
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    return jsonify({
+        'success': True,
+        'employees': employee_cache.stats(),
+        'thumbnails': thumbnail_worker.stats()
+    })
+
+# Prometheus metrics
+@app.route('/metrics')
+def prometheus_metrics():
+    token = request.headers.get('Authorization', '')
+    authorized = 'admin_id' in session or (
+        METRICS_TOKEN and hmac.compare_digest(token.encode(), f'Bearer {METRICS_TOKEN}'.encode())
+    )
+    if not authorized:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    
+    # Component counters are read at scrape time
+    pool = db_pool.stats()
+    cache = employee_cache.stats()
+    thumbnails = thumbnail_worker.stats()
+    stored = photo_store.stats()
+    events = broadcaster.stats()
+    ingest_stats = punch_queue.stats() if punch_queue else None
+    hashing = password_hasher.stats()
+    body = metrics.render([
+        ('db_pool_open_connections', 'gauge', 'Open pooled SQLite connections', pool['open']),
+        ('db_pool_in_use_connections', 'gauge', 'Pooled connections checked out', pool['in_use']),
+        ('db_pool_waits_total', 'counter', 'Connection checkouts that had to wait', pool['waits']),
+        ('employee_cache_hits_total', 'counter', 'Employee auth cache hits', cache['hits']),
+        ('employee_cache_misses_total', 'counter', 'Employee auth cache misses', cache['misses']),
+        ('employee_cache_entries', 'gauge', 'Employee auth cache size', cache['size']),
+        ('photos_stored_total', 'counter', 'Check-in photos stored', stored['stored']),
+        ('photos_duplicate_total', 'counter', 'Check-in photo uploads skipped as duplicates', stored['duplicates']),
+        ('photo_bytes_written_total', 'counter', 'Check-in photo bytes written to the store', stored['bytesWritten']),
+        ('thumbnails_pending', 'gauge', 'Thumbnail jobs queued or running', thumbnails['pending']),
+        ('thumbnails_failed_total', 'counter', 'Thumbnail jobs that failed', thumbnails['failed']),
+        ('sse_subscribers', 'gauge', 'Connected admin event streams', events['subscribers']),
+        ('sse_events_dropped_total', 'counter', 'Events dropped for lagging subscribers', events['dropped']),
+        ('profiler_samples_total', 'counter', 'Stack samples taken by the opt-in profiler', profiler.samples),
+        ('password_hashes_total', 'counter', 'Passwords hashed (signups, imports, rehashes)', hashing['hashed']),
+        ('password_rehashes_total', 'counter', 'Passwords rehashed at login (plaintext or old cost)', hashing['rehashed']),
+        ('password_busy_total', 'counter', 'Logins and signups refused because hashing was saturated',
+         hashing['rejected'] + hashing['timeouts']),
+    ] + ([
+        ('ingest_pending_punches', 'gauge', 'Write-behind punches not yet committed', ingest_stats['pending']),
+        ('ingest_batches_total', 'counter', 'Write-behind group commits', ingest_stats['batches']),
+        ('ingest_fsyncs_total', 'counter', 'Punch log fsyncs', ingest_stats['fsyncs']),
+        ('ingest_dead_lettered_total', 'counter', 'Write-behind punches moved to the dead-letter file',
+         ingest_stats['deadLettered']),
+    ] if punch_queue else []))
+    return Response(body, content_type=EXPOSITION_CONTENT_TYPE)
+
+# Sampling profiler output (collapsed stacks for flamegraph.pl / speedscope)
+@app.route('/admin/profile', methods=['GET'])
+def admin_profile():
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'success': True,
+            'routes': sorted(PROFILE_ROUTES),
+            'profiler': profiler.stats()
+        })
+    return Response(profiler.collapsed(), mimetype='text/plain')
+
+@app.route('/admin/profile', methods=['DELETE'])
+def admin_reset_profile():
+    if 'admin_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+    profiler.reset()
+    return jsonify({
+        'success': True,
+        'message': 'Profile samples cleared'
+    })
 
 # Logout routes
 @app.route('/logout')
@@ -920,6 +2780,13 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({
+        'success': False,
+        'message': f'Upload exceeds the {PHOTO_MAX_BYTES // 1024} KB limit'
+    }), 413
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0')
 
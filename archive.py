@@ -0,0 +1,254 @@
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+
+import rollups
+
+# Columns copied into a month archive, in attendance_records order
+COLUMNS = ('id, emp_id, date, check_in, check_in_lat, check_in_lon, check_in_photo, '
+           'check_out, check_out_lat, check_out_lon, site_id')
+
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE attendance_records (
+        id INTEGER PRIMARY KEY,
+        emp_id TEXT NOT NULL,
+        date TEXT NOT NULL,
+        check_in TEXT,
+        check_in_lat REAL,
+        check_in_lon REAL,
+        check_in_photo TEXT,
+        check_out TEXT,
+        check_out_lat REAL,
+        check_out_lon REAL,
+        site_id INTEGER,
+        UNIQUE(emp_id, date)
+    )
+'''
+
+COPY_BATCH_SIZE = 5000
+
+
+def create_table(cursor):
+    """Create the manifest of months moved out of attendance_records"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_archives (
+            month TEXT PRIMARY KEY,
+            file TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    ''')
+
+
+def shift_month(month, delta):
+    """'YYYY-MM' moved by delta months, e.g. ('2024-01', -1) -> '2023-12'"""
+    year, mon = (int(part) for part in month.split('-'))
+    index = year * 12 + mon - 1 + delta
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def archive_path(archive_dir, month):
+    return os.path.join(archive_dir, f'attendance-{month}.db.gz')
+
+
+def cache_path(archive_dir, month):
+    return os.path.join(archive_dir, 'cache', f'attendance-{month}.db')
+
+
+def archived_months(conn, date_from=None, date_to=None):
+    """Archived 'YYYY-MM' months overlapping an optional date range, oldest first"""
+    sql = 'SELECT month FROM attendance_archives WHERE 1 = 1'
+    params = []
+    if date_from:
+        sql += ' AND month >= ?'
+        params.append(date_from[:7])
+    if date_to:
+        sql += ' AND month <= ?'
+        params.append(date_to[:7])
+    return [row[0] for row in conn.execute(sql + ' ORDER BY month', params)]
+
+
+def hot_since(conn):
+    """First date still held in attendance_records after archiving, or None if nothing is archived.
+
+    Months are archived oldest first and restored newest first, so every archived
+    date is before this one and every row in attendance_records is on or after it.
+    """
+    row = conn.execute('SELECT MAX(month) FROM attendance_archives').fetchone()
+    if not row or not row[0]:
+        return None
+    return rollups.month_bounds(shift_month(row[0], 1))[0]
+
+
+def archive_month(conn, month, archive_dir):
+    """Move one closed month out of attendance_records into a compressed archive file.
+
+    The month's rows are copied into a fresh SQLite database (written densely, so
+    it needs no VACUUM), which is gzipped next to the manifest. The rows are then
+    deleted from attendance_records in the same transaction that records the
+    archive. The uncompressed copy is kept as the read cache. Returns a summary.
+    """
+    started = time.perf_counter()
+    if conn.execute('SELECT 1 FROM attendance_archives WHERE month = ?', (month,)).fetchone():
+        raise ValueError(f'{month} is already archived')
+    first, last = rollups.month_bounds(month)
+    older = conn.execute('SELECT MIN(date) FROM attendance_records').fetchone()[0]
+    if older and older < first:
+        raise ValueError(f'Archive {older[:7]} first; months are archived oldest first')
+
+    os.makedirs(os.path.dirname(cache_path(archive_dir, month)), exist_ok=True)
+    staging = os.path.join(archive_dir, f'.attendance-{month}.{os.getpid()}.db')
+    if os.path.exists(staging):
+        os.remove(staging)
+    copied = 0
+    with closing(sqlite3.connect(staging)) as target:
+        target.execute('PRAGMA journal_mode = OFF')
+        target.execute('PRAGMA synchronous = OFF')
+        target.execute(ARCHIVE_SCHEMA)
+        cursor = conn.execute(f'''
+            SELECT {COLUMNS} FROM attendance_records
+            WHERE date >= ? AND date <= ?
+            ORDER BY date, emp_id
+        ''', (first, last))
+        while True:
+            rows = cursor.fetchmany(COPY_BATCH_SIZE)
+            if not rows:
+                break
+            target.executemany(f'INSERT INTO attendance_records ({COLUMNS}) VALUES ({", ".join("?" * 11)})',
+                               [tuple(row) for row in rows])
+            copied += len(rows)
+        target.commit()
+
+    path = archive_path(archive_dir, month)
+    digest = hashlib.sha256()
+    with open(staging, 'rb') as src, open(path + '.tmp', 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as dst:
+            shutil.copyfileobj(src, dst)
+        raw.flush()
+        os.fsync(raw.fileno())
+    with open(path + '.tmp', 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    os.replace(path + '.tmp', path)
+    size = os.path.getsize(path)
+
+    try:
+        deleted = conn.execute('DELETE FROM attendance_records WHERE date >= ? AND date <= ?',
+                               (first, last)).rowcount
+        if deleted != copied:
+            raise RuntimeError(f'{month} changed while archiving ({copied} copied, {deleted} deleted)')
+        conn.execute('''
+            INSERT INTO attendance_archives (month, file, rows, bytes, sha256, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (month, os.path.basename(path), copied, size, digest.hexdigest(), time.strftime('%Y-%m-%dT%H:%M:%S')))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        os.remove(path)
+        os.remove(staging)
+        raise
+    os.chmod(staging, 0o444)
+    os.replace(staging, cache_path(archive_dir, month))
+    return {
+        'month': month,
+        'rows': copied,
+        'bytes': size,
+        'seconds': round(time.perf_counter() - started, 4)
+    }
+
+
+def archive_before(conn, month, archive_dir):
+    """Archive every month before 'YYYY-MM' that still has rows, oldest first; returns summaries"""
+    first = rollups.month_bounds(month)[0]
+    months = [row[0] for row in conn.execute('''
+        SELECT DISTINCT substr(date, 1, 7) FROM attendance_records
+        WHERE date < ? ORDER BY 1
+    ''', (first,))]
+    return [archive_month(conn, m, archive_dir) for m in months]
+
+
+def ensure_cached(conn, archive_dir, month):
+    """Path of the month's uncompressed archive, decompressing and verifying it on first use"""
+    path = cache_path(archive_dir, month)
+    if os.path.exists(path):
+        return path
+    row = conn.execute('SELECT file, sha256 FROM attendance_archives WHERE month = ?', (month,)).fetchone()
+    if not row:
+        raise ValueError(f'{month} is not archived')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging = f'{path}.{os.getpid()}.tmp'
+    digest = hashlib.sha256()
+    with open(os.path.join(archive_dir, row[0]), 'rb') as raw:
+        for chunk in iter(lambda: raw.read(1024 * 1024), b''):
+            digest.update(chunk)
+        if digest.hexdigest() != row[1]:
+            raise RuntimeError(f'Archive for {month} is corrupt (checksum mismatch)')
+        raw.seek(0)
+        with gzip.GzipFile(fileobj=raw) as src, open(staging, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    os.chmod(staging, 0o444)
+    os.replace(staging, path)  # concurrent readers may both decompress; the rename is atomic
+    return path
+
+
+@contextmanager
+def attached(conn, archive_dir, month):
+    """ATTACH one archived month for reading; yields the schema name to qualify attendance_records with.
+
+    Must be entered outside a transaction. Detached on exit, so the pooled
+    connection goes back to the pool as it came out.
+    """
+    path = ensure_cached(conn, archive_dir, month)
+    schema = 'archive_' + month.replace('-', '_')
+    conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+    try:
+        yield schema
+    finally:
+        conn.execute(f'DETACH DATABASE {schema}')
+
+
+def restore_month(conn, month, archive_dir):
+    """Move the newest archived month back into attendance_records; returns the number of rows"""
+    newest = conn.execute('SELECT MAX(month) FROM attendance_archives').fetchone()[0]
+    if newest != month:
+        raise ValueError(f'Only the newest archived month ({newest}) can be restored')
+    file = conn.execute('SELECT file FROM attendance_archives WHERE month = ?', (month,)).fetchone()[0]
+    with attached(conn, archive_dir, month) as schema:
+        try:
+            restored = conn.execute(f'''
+                INSERT INTO attendance_records ({COLUMNS})
+                SELECT {COLUMNS} FROM {schema}.attendance_records
+            ''').rowcount
+            conn.execute('DELETE FROM attendance_archives WHERE month = ?', (month,))
+            conn.commit()
+        except Exception:
+            conn.rollback()  # an open transaction would keep the archive from detaching
+            raise
+    for path in (os.path.join(archive_dir, file), cache_path(archive_dir, month)):
+        if os.path.exists(path):
+            os.remove(path)
+    return restored
+
+
+def stats(conn, archive_dir):
+    """Row counts of the hot table and each archive, with archive and cache sizes on disk"""
+    hot = conn.execute('SELECT COUNT(*), MIN(date), MAX(date) FROM attendance_records').fetchone()
+    archives = [{
+        'month': row['month'],
+        'rows': row['rows'],
+        'bytes': row['bytes'],
+        'cached': os.path.exists(cache_path(archive_dir, row['month'])),
+        'archivedAt': row['archived_at']
+    } for row in conn.execute('SELECT month, rows, bytes, archived_at FROM attendance_archives ORDER BY month')]
+    return {
+        'hot': {'rows': hot[0], 'from': hot[1], 'to': hot[2]},
+        'archives': archives,
+        'archivedRows': sum(a['rows'] for a in archives),
+        'archiveBytes': sum(a['bytes'] for a in archives)
+    }
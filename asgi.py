@@ -0,0 +1,464 @@
+"""ASGI entry point for production serving.
+
+The punch hot paths (check-in with or without a photo, check-out and today's
+attendance) and the admin live-update stream run natively on the event loop,
+so an open dashboard waits for events without holding a thread. Request
+bodies and photo uploads are read asynchronously, photo bytes are hashed and
+written on a small file pool, and SQLite work runs on a worker pool no larger
+than the connection pool, so a slow disk never ties up one thread per waiting
+client. Every other route is served by the Flask app through a bounded WSGI
+bridge.
+
+Run with any ASGI server, e.g.:
+
+    uvicorn asgi:application --workers 4
+
+With WRITE_BEHIND=1, run a single worker: queued punches are only visible
+to the process that queued them, and a second worker refuses to start.
+"""
+import asyncio
+import functools
+import hashlib
+import io
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+import app as attendance
+import photos
+
+logger = logging.getLogger(__name__)
+
+# Blocking work runs on bounded pools; the DB pool matches the connection pool
+# so worker threads never queue for a connection
+DB_WORKERS = attendance.DB_POOL_SIZE
+FILE_WORKERS = int(os.environ.get('ASGI_FILE_WORKERS', 4))
+WSGI_WORKERS = int(os.environ.get('ASGI_WSGI_WORKERS', 16))
+MAX_BODY_BYTES = attendance.app.config['MAX_CONTENT_LENGTH']
+FORM_FIELD_MAX_BYTES = 64 * 1024
+DECODER_FEED_BYTES = 16 * 1024
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='asgi-db')
+file_executor = ThreadPoolExecutor(max_workers=FILE_WORKERS, thread_name_prefix='asgi-file')
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_WORKERS, thread_name_prefix='asgi-wsgi')
+
+_DONE = object()
+_PHOTO = object()  # marks multipart data belonging to the photo upload
+
+
+class BodyTooLarge(Exception):
+    """Raised when a request body exceeds MAX_BODY_BYTES"""
+
+
+class Rejected(Exception):
+    """A request refused part-way through its body; args are (response body, HTTP status)"""
+
+
+async def run_in(executor, fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+async def read_body(receive, limit=MAX_BODY_BYTES):
+    """Read a whole request body, raising BodyTooLarge past limit"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+async def send_json(send, body, status=200):
+    payload = attendance.app.json.dumps(body, separators=(',', ':')).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+def too_large_body():
+    # Same message as the Flask 413 handler
+    return {
+        'success': False,
+        'message': f'Upload exceeds the {attendance.PHOTO_MAX_BYTES // 1024} KB limit'
+    }
+
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+class PhotoSpool:
+    """Upload part written to the photo store's incoming area and hashed as it arrives"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.path = attendance.photo_store.incoming_path()
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.file = open(self.path, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise photos.PhotoTooLarge(f'Photo exceeds the {self.max_bytes // 1024} KB limit')
+        self.hasher.update(data)
+        self.file.write(data)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def read_json_object(receive):
+    """A JSON object request body; anything else raises ValueError"""
+    data = attendance.app.json.loads(await read_body(receive) or b'{}')
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    return data
+
+
+async def read_multipart(receive, boundary, check_photo=None):
+    """Stream a multipart body: small fields into memory, the 'photo' file into a PhotoSpool.
+
+    check_photo, if given, is awaited with the fields read so far when the photo
+    part starts, and returns a (response body, HTTP status) rejection or None;
+    a rejection raises Rejected before any of the photo is read or spooled.
+    Returns (fields, spool); spool is None when no photo was sent.
+    """
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=FORM_FIELD_MAX_BYTES)
+    fields = {}
+    spool = None
+    current = None
+    buffer = []
+    pending = b''
+    received = 0
+    more_body = True
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                if not pending and more_body:
+                    message = await receive()
+                    pending = memoryview(message.get('body', b''))  # zero-copy slicing
+                    more_body = message.get('more_body', False) and message['type'] != 'http.disconnect'
+                    received += len(pending)
+                    if received > MAX_BODY_BYTES:
+                        raise BodyTooLarge()
+                if pending:
+                    # Feed in slices: the decoder buffers at most max_form_memory_size
+                    decoder.receive_data(pending[:DECODER_FEED_BYTES])
+                    pending = pending[DECODER_FEED_BYTES:]
+                elif decoder.complete:
+                    break
+                else:
+                    decoder.receive_data(None)
+            elif isinstance(event, Epilogue):
+                break
+            elif isinstance(event, File):
+                # Only the first 'photo' file is kept; other files are skipped
+                current = None
+                if event.name == 'photo' and spool is None:
+                    if check_photo is not None:
+                        rejection = await check_photo(fields)
+                        if rejection:
+                            raise Rejected(*rejection)
+                    spool = await run_in(file_executor, PhotoSpool, attendance.PHOTO_MAX_BYTES)
+                    current = _PHOTO
+            elif isinstance(event, Field):
+                current = event.name
+                buffer = []
+            elif isinstance(event, Data):
+                if current is _PHOTO:
+                    await run_in(file_executor, spool.write, event.data)
+                    if not event.more_data:
+                        await run_in(file_executor, spool.close)
+                elif current is not None and current not in fields:
+                    buffer.append(event.data)
+                    if not event.more_data:
+                        fields[current] = b''.join(buffer).decode('utf-8', 'replace')
+    except BaseException:
+        if spool is not None:
+            await run_in(file_executor, spool.discard)
+        raise
+    return fields, spool
+
+
+async def employee_checkin(scope, receive, send):
+    content_type, options = parse_options_header(header(scope, b'content-type') or '')
+    if content_type == 'multipart/form-data' and options.get('boundary'):
+        authorization = header(scope, b'authorization')
+
+        async def check_photo(fields):
+            # Refuse a punch that will fail its device or geofence check before
+            # spooling its photo (the dashboard sends the fields first)
+            _, error = await run_in(
+                db_executor, attendance.validate_check_in,
+                fields.get('employeeId'), fields.get('deviceFingerprint'),
+                fields.get('latitude'), fields.get('longitude'), authorization
+            )
+            return error
+
+        try:
+            fields, spool = await read_multipart(receive, options['boundary'], check_photo)
+        except photos.PhotoTooLarge as e:
+            return await send_json(send, {'success': False, 'message': str(e)}, 413)
+        except Rejected as e:
+            return await send_json(send, *e.args)
+        save_photo = None
+        if spool is not None:
+            save_photo = functools.partial(attendance.photo_store.put_file, spool.path, spool.hasher.hexdigest())
+        try:
+            body, status = await run_in(
+                db_executor, attendance.punch_check_in,
+                fields.get('employeeId'), fields.get('deviceFingerprint'),
+                fields.get('latitude'), fields.get('longitude'),
+                save_photo=save_photo, authorization=authorization
+            )
+        finally:
+            if spool is not None:
+                # Still there only if the punch was rejected before the photo was stored
+                await run_in(file_executor, spool.discard)
+        return await send_json(send, body, status)
+
+    try:
+        data = await read_json_object(receive)
+    except ValueError:
+        # Malformed or non-object JSON body
+        return await send_json(send, {'success': False, 'message': 'Invalid request body'}, 400)
+    body, status = await run_in(
+        db_executor, attendance.punch_check_in,
+        data.get('employeeId'), data.get('deviceFingerprint'), data.get('latitude'), data.get('longitude'),
+        authorization=header(scope, b'authorization')
+    )
+    await send_json(send, body, status)
+
+
+async def employee_checkout(scope, receive, send):
+    try:
+        data = await read_json_object(receive)
+    except ValueError:
+        # Malformed or non-object JSON body
+        return await send_json(send, {'success': False, 'message': 'Invalid request body'}, 400)
+    body, status = await run_in(
+        db_executor, attendance.punch_check_out,
+        data.get('employeeId'), data.get('deviceFingerprint'), data.get('latitude'), data.get('longitude'),
+        authorization=header(scope, b'authorization')
+    )
+    await send_json(send, body, status)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def admin_events(scope, receive, send):
+    """Admin live-update stream, served on the event loop so an idle dashboard holds no thread"""
+    # Same session cookie check as the Flask route; CPU-only, so it runs on the event loop
+    request = attendance.app.request_class(build_environ(scope, b''))
+    session = attendance.app.session_interface.open_session(attendance.app, request)
+    if session is None or 'admin_id' not in session:
+        return await send_json(send, {'success': False, 'message': 'Unauthorized'}, 401)
+
+    broadcaster = attendance.broadcaster
+    subscriber = broadcaster.subscribe()
+    if subscriber is None:
+        return await send_json(send, {'success': False, 'message': 'Too many live connections, please use Refresh'}, 503)
+    try:
+        last_event_id = int(header(scope, b'last-event-id') or '')
+    except ValueError:
+        last_event_id = None
+
+    stream = broadcaster.astream(subscriber, last_event_id, attendance.EVENTS_HEARTBEAT)
+
+    async def pump():
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        async for message in stream:
+            await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+
+    pumping = asyncio.ensure_future(pump())
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait((pumping, watcher), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (pumping, watcher):
+            task.cancel()
+        await asyncio.gather(pumping, watcher, return_exceptions=True)
+        await stream.aclose()
+        # Also covers clients that disconnect before the stream starts
+        broadcaster.unsubscribe(subscriber)
+
+
+async def employee_attendance(scope, receive, send, emp_id):
+    # Token checks are CPU-only, so they run on the event loop
+    error = attendance.attendance_access_error(header(scope, b'authorization'), emp_id)
+    if error:
+        return await send_json(send, *error)
+    record = await run_in(db_executor, attendance.today_attendance, emp_id)
+    await send_json(send, {'success': True, 'attendance': record})
+
+
+def native_handler(scope):
+    """(async handler, route rule) for a hot-path request, or (None, None) to use the Flask app"""
+    method = scope['method']
+    path = scope['path']
+    if method == 'POST' and path == '/employee/checkin':
+        return employee_checkin, '/employee/checkin'
+    if method == 'POST' and path == '/employee/checkout':
+        return employee_checkout, '/employee/checkout'
+    prefix = '/employee/attendance/'
+    if method == 'GET' and path.startswith(prefix) and '/' not in path[len(prefix):] and path[len(prefix):]:
+        return functools.partial(employee_attendance, emp_id=path[len(prefix):]), '/employee/attendance/<emp_id>'
+    if method == 'GET' and path == '/admin/events':
+        return admin_events, '/admin/events'
+    return None, None
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope with an already-read body"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.input_terminated': True,  # the whole body is buffered, even if it arrived chunked
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    environ.setdefault('CONTENT_LENGTH', str(len(body)))
+    return environ
+
+
+async def call_flask(scope, receive, send):
+    """Serve a request with the Flask app on the WSGI pool, streaming the response back"""
+    try:
+        body = await read_body(receive)
+    except BodyTooLarge:
+        return await send_json(send, too_large_body(), 413)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+        return lambda data: None
+
+    result = await run_in(wsgi_executor, attendance.app, build_environ(scope, body), start_response)
+
+    # Watch for the client going away so a long response releases its thread
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        iterator = iter(result)
+        while not watcher.done():
+            chunk = await run_in(wsgi_executor, next, iterator, _DONE)
+            if chunk is _DONE:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        if hasattr(result, 'close'):
+            await run_in(wsgi_executor, result.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for executor in (db_executor, file_executor, wsgi_executor):
+                executor.shutdown(wait=False)
+            if attendance.punch_queue:
+                attendance.punch_queue.close()
+            attendance.thumbnail_worker.shutdown(wait=True)
+            attendance.password_hasher.shutdown(wait=False)
+            attendance.db_pool.close_all()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    handler, route = native_handler(scope)
+    if handler is None:
+        return await call_flask(scope, receive, send)
+
+    # Native routes bypass the Flask request hooks, so record their latency here -
+    # up to the response start, as after_request does, so streams aren't timed whole
+    started = time.perf_counter()
+    status = []
+
+    async def send_recording(message):
+        if message['type'] == 'http.response.start':
+            status.append((message['status'], time.perf_counter() - started))
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_recording)
+    except (BodyTooLarge, RequestEntityTooLarge):
+        await send_json(send_recording, too_large_body(), 413)
+    except Exception:
+        if status:
+            # The response has already started; let the server drop the connection
+            raise
+        logger.exception('Unhandled error serving %s %s', scope['method'], scope['path'])
+        await send_json(send_recording, {'success': False, 'message': 'Internal server error'}, 500)
+    finally:
+        if status:
+            attendance.metrics.observe_request(scope['method'], route, *status[0])
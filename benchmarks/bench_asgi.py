@@ -0,0 +1,157 @@
+"""Compare concurrent punch throughput and latency: synchronous Flask path vs ASGI fast path
+
+Each simulated employee checks in (JSON, or multipart with --photo) and then checks
+out. The synchronous path runs the Flask app on a thread per in-flight request,
+as the threaded dev server does; the ASGI path drives asgi.application on one
+event loop. Both run in-process against a fresh database in a temporary directory.
+
+Usage: python benchmarks/bench_asgi.py [--employees 400] [--concurrency 32] [--photo]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+BOUNDARY = 'benchboundary'
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def report(name, latencies, elapsed, errors):
+    print(f'{name:>6}: {len(latencies) / elapsed:8.1f} req/s  '
+          f'p50 {percentile(latencies, 50) * 1000:7.2f} ms  '
+          f'p99 {percentile(latencies, 99) * 1000:7.2f} ms  '
+          f'errors {errors}')
+
+
+def checkin_body(emp_id, latitude, longitude, photo):
+    """(body bytes, content type) for a check-in request"""
+    if photo is None:
+        return json.dumps({'employeeId': emp_id, 'latitude': latitude, 'longitude': longitude}).encode(), 'application/json'
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in (('employeeId', emp_id), ('latitude', latitude), ('longitude', longitude))
+    ]
+    parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="photo"; filename="checkin_photo.jpg"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n'.encode() + photo + b'\r\n')
+    parts.append(f'--{BOUNDARY}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={BOUNDARY}'
+
+
+def run_sync(attendance, emp_ids, concurrency, latitude, longitude, photo):
+    client = attendance.app.test_client()
+    latencies = []
+    errors = []
+
+    def punch(emp_id):
+        # Unique photo bytes per employee so deduplication doesn't skip the write
+        body, content_type = checkin_body(emp_id, latitude, longitude, photo and photo + emp_id.encode())
+        checkout = json.dumps({'employeeId': emp_id, 'latitude': latitude, 'longitude': longitude})
+        for path, data, kind in (('/employee/checkin', body, content_type), ('/employee/checkout', checkout, 'application/json')):
+            started = time.perf_counter()
+            response = client.post(path, data=data, content_type=kind)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(punch, emp_ids))
+    return latencies, time.perf_counter() - started, len(errors)
+
+
+def run_async(asgi, emp_ids, concurrency, latitude, longitude, photo):
+    latencies = []
+    errors = []
+
+    async def request(path, body, content_type):
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        scope = {
+            'type': 'http', 'method': 'POST', 'path': path, 'query_string': b'',
+            'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())],
+            'http_version': '1.1', 'scheme': 'http', 'server': ('bench', 80), 'client': ('127.0.0.1', 0),
+        }
+        started = time.perf_counter()
+        await asgi.application(scope, receive, send)
+        latencies.append(time.perf_counter() - started)
+        if status[0] != 200:
+            errors.append(status[0])
+
+    async def punch(emp_id, limit):
+        async with limit:
+            body, content_type = checkin_body(emp_id, latitude, longitude, photo and photo + emp_id.encode())
+            await request('/employee/checkin', body, content_type)
+            checkout = json.dumps({'employeeId': emp_id, 'latitude': latitude, 'longitude': longitude}).encode()
+            await request('/employee/checkout', checkout, 'application/json')
+
+    async def main():
+        limit = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(punch(emp_id, limit) for emp_id in emp_ids))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return latencies, time.perf_counter() - started, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--employees', type=int, default=400, help='employees per path (each checks in and out)')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--photo', action='store_true', help='check in with a photo upload')
+    parser.add_argument('--photo-kb', type=int, default=200)
+    args = parser.parse_args()
+
+    # app.py keeps its database and uploads relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='bench_asgi_')
+    os.chdir(workdir)
+    logging.disable(logging.WARNING)  # random photo bytes make thumbnailing log warnings
+
+    import app as attendance
+    import asgi
+    import bulk
+    from contextlib import closing
+
+    records = [{'empId': f'{path}{i:06d}', 'empName': f'Employee {i}', 'empEmail': f'e{i}@example.com', 'password': 'pw'}
+               for path in ('S', 'A') for i in range(args.employees)]
+    with closing(attendance.get_db()) as conn:
+        bulk.import_employees(conn, records)
+    config, _ = attendance.get_active_geofence()
+    photo = os.urandom(args.photo_kb * 1024) if args.photo else None
+
+    print(f'{args.employees} employees x (check-in{" + photo" if photo else ""}, check-out), '
+          f'concurrency {args.concurrency}')
+    sync_ids = [r['empId'] for r in records[:args.employees]]
+    async_ids = [r['empId'] for r in records[args.employees:]]
+    report('sync', *run_sync(attendance, sync_ids, args.concurrency, config['latitude'], config['longitude'], photo))
+    report('asgi', *run_async(asgi, async_ids, args.concurrency, config['latitude'], config['longitude'], photo))
+    attendance.thumbnail_worker.shutdown()
+    attendance.db_pool.close_all()
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
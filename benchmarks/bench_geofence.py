@@ -0,0 +1,43 @@
+"""Micro-benchmark for server-side geofence checks (points per second)
+
+Usage: python benchmarks/bench_geofence.py [--points 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geofence
+
+CONFIG = {'latitude': 28.7041, 'longitude': 77.1025, 'radius': 100}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    lats = [CONFIG['latitude'] + rng.uniform(-0.01, 0.01) for _ in range(args.points)]
+    lons = [CONFIG['longitude'] + rng.uniform(-0.01, 0.01) for _ in range(args.points)]
+
+    # Scalar path (what a single check-in uses), on a capped sample
+    sample = min(args.points, 200000)
+    start = time.perf_counter()
+    for lat, lon in zip(lats[:sample], lons[:sample]):
+        geofence.check_point(CONFIG, lat, lon)
+    scalar = sample / (time.perf_counter() - start)
+    print(f'scalar:  {scalar:14,.0f} points/s')
+
+    start = time.perf_counter()
+    inside, _ = geofence.check_points(CONFIG, lats, lons)
+    batch = args.points / (time.perf_counter() - start)
+    backend = 'numpy' if geofence.np is not None else 'pure python'
+    print(f'batch:   {batch:14,.0f} points/s ({backend}, {sum(bool(x) for x in inside)} inside)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""Load test the punch hot paths and check for regressions against a stored baseline
+
+Seeds a fresh attendance.db in a temporary directory with --employees employees,
+each with an approved device and --days days of attendance history (weekdays).
+Every employee then logs in, checks in (a photo upload for --photo-ratio of them,
+JSON otherwise) and checks out with the login's bearer token, spread over
+--concurrency workers, while --admins workers keep loading /admin/employees and
+two pages of /admin/attendance-records until the punches are done. Passwords are hashed at --scrypt-n, far below the
+production cost, so logins measure the request path rather than the key
+derivation (benchmarks/bench_login.py measures that at each cost).
+
+Requests go through Flask's test client, or with --server over HTTP to a threaded
+Werkzeug server on a loopback port. The workload runs --rounds times, each with its
+own set of employees, and the per-endpoint median of throughput and latency
+percentiles is reported and compared with benchmarks/baseline.json: an endpoint regresses when
+its req/s falls or its p95 rises by more than --tolerance, and the exit status is 1.
+--save-baseline records the current run as the new baseline instead. Only runs with
+the same parameters are compared, and a baseline is only meaningful on the machine
+that recorded it - re-record it after moving hardware.
+
+Usage: python benchmarks/bench_load.py [--employees 500] [--days 30] [--rounds 3] [--concurrency 16]
+       [--admins 2] [--photo-ratio 0.2] [--scrypt-n 256] [--server] [--save-baseline] [--tolerance 0.3]
+"""
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import date, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+BASELINE = os.path.join(REPO_ROOT, 'benchmarks', 'baseline.json')
+BOUNDARY = 'benchboundary'
+PASSWORD = 'bench-password'
+ADMIN_ID = 'bench-admin'
+NOISE_FLOOR_MS = 1.0  # p95 changes smaller than this are never a regression
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def fingerprint(emp_id):
+    return f'fp-{emp_id}'
+
+
+def make_photo(kb):
+    """A JPEG of roughly kb kilobytes (noise compresses poorly); random bytes without Pillow"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return os.urandom(kb * 1024)
+    side = 64
+    while True:
+        buffer = io.BytesIO()
+        Image.effect_noise((side, side), 64).convert('RGB').save(buffer, 'JPEG', quality=90)
+        if buffer.tell() >= kb * 1024 or side >= 4096:
+            return buffer.getvalue()
+        side = int(side * 1.25)
+
+
+def multipart(fields, photo):
+    """(body bytes, content type) for a check-in with a photo"""
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    ]
+    parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="photo"; filename="checkin_photo.jpg"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n'.encode() + photo + b'\r\n')
+    parts.append(f'--{BOUNDARY}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={BOUNDARY}'
+
+
+def seed(attendance, employees, days, rng):
+    """Employees with approved devices, an admin, and closed-out history for past weekdays"""
+    import bulk
+
+    emp_ids = [f'B{i:06d}' for i in range(employees)]
+    config, _ = attendance.get_active_geofence()
+    today = date.today()
+    history_dates = [today - timedelta(days=n) for n in range(days, 0, -1)]
+    history_dates = [d.isoformat() for d in history_dates if d.weekday() < 5]
+
+    history = []
+    for emp_id in emp_ids:
+        for day in history_dates:
+            check_in = f'{day}T{rng.randint(8, 10):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}'
+            check_out = f'{day}T{rng.randint(17, 19):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}'
+            history.append((emp_id, day, check_in, config['latitude'], config['longitude'],
+                            check_out, config['latitude'], config['longitude']))
+
+    # Passwords hashed at the run's cost, so every login is one scrypt verification;
+    # one hash shared by every account keeps seeding fast
+    stored = attendance.password_hasher.hash(PASSWORD)
+    with closing(attendance.get_db()) as conn:
+        bulk.import_employees(conn, [
+            {'empId': emp_id, 'empName': f'Employee {emp_id}', 'empEmail': f'{emp_id}@example.com', 'password': PASSWORD}
+            for emp_id in emp_ids
+        ], prepare_passwords=lambda batch: [stored] * len(batch))
+        conn.executemany('''
+            UPDATE employees SET device_id = ?, device_approved = 1, device_fingerprint = ?
+            WHERE emp_id = ?
+        ''', [(f'Device-{emp_id}', fingerprint(emp_id), emp_id) for emp_id in emp_ids])
+        conn.executemany('''
+            INSERT INTO attendance_records
+                (emp_id, date, check_in, check_in_lat, check_in_lon, check_out, check_out_lat, check_out_lon)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', history)
+        conn.execute('INSERT INTO admins (admin_id, name, email, password) VALUES (?, ?, ?, ?)',
+                     (ADMIN_ID, 'Bench Admin', 'admin@example.com', stored))
+        # The migrations creating the derived tables backfill them from history
+        for table in ('employee_status', 'attendance_daily', 'attendance_monthly'):
+            conn.execute(f'DROP TABLE {table}')
+        conn.commit()
+        attendance.migrate_employee_status(conn)
+        attendance.migrate_rollups(conn)
+        conn.commit()
+    return emp_ids, config, len(history)
+
+
+class TestClientTransport:
+    """Requests through Flask's test client (no sockets)"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, content_type=None, headers=None):
+        response = self.client.open(path, method=method, data=body, content_type=content_type, headers=headers)
+        return response.status_code, response.get_data()
+
+
+class HttpTransport:
+    """Requests over HTTP to the local server, keeping the session cookie"""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port)
+        self.cookie = None
+
+    def request(self, method, path, body=None, content_type=None, headers=None):
+        headers = dict(headers or {})
+        if content_type:
+            headers['Content-Type'] = content_type
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        if response.getheader('Set-Cookie'):
+            self.cookie = response.getheader('Set-Cookie').split(';', 1)[0]
+        return response.status, data
+
+
+class Recorder:
+    """Per-endpoint latencies and error counts, shared by all workers"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def call(self, transport, name, method, path, body=None, content_type=None, headers=None):
+        started = time.perf_counter()
+        status, data = transport.request(method, path, body, content_type, headers)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if status != 200:
+                self.errors[name] += 1
+        return status, data
+
+    def results(self, elapsed):
+        return {name: {
+            'requests': len(values),
+            'rps': round(len(values) / elapsed, 1),
+            'p50': round(percentile(values, 50) * 1000, 2),
+            'p95': round(percentile(values, 95) * 1000, 2),
+            'p99': round(percentile(values, 99) * 1000, 2),
+            'errors': self.errors[name]
+        } for name, values in sorted(self.latencies.items())}
+
+
+def run(new_transport, emp_ids, config, args, photo):
+    recorder = Recorder()
+    local = threading.local()
+    done = threading.Event()
+    rng = random.Random(args.seed)
+    with_photo = {emp_id for emp_id in emp_ids if rng.random() < args.photo_ratio}
+
+    def transport():
+        if not hasattr(local, 'transport'):
+            local.transport = new_transport()
+        return local.transport
+
+    def punch(emp_id):
+        client = transport()
+        # Punches carry the login's bearer token, as the dashboard sends them
+        fields = {'deviceFingerprint': fingerprint(emp_id),
+                  'latitude': config['latitude'], 'longitude': config['longitude']}
+        status, data = recorder.call(client, 'POST /employee/login', 'POST', '/employee/login', json.dumps(
+            {'empId': emp_id, 'password': PASSWORD, 'deviceFingerprint': fingerprint(emp_id)}
+        ), 'application/json')
+        headers = {'Authorization': f'Bearer {json.loads(data)["token"]}'} if status == 200 else None
+        if emp_id in with_photo:
+            # Unique bytes per employee so deduplication doesn't skip the write
+            body, content_type = multipart(fields, photo + emp_id.encode())
+            recorder.call(client, 'POST /employee/checkin (photo)', 'POST', '/employee/checkin', body, content_type,
+                          headers)
+        else:
+            recorder.call(client, 'POST /employee/checkin (json)', 'POST', '/employee/checkin',
+                          json.dumps(fields), 'application/json', headers)
+        recorder.call(client, 'POST /employee/checkout', 'POST', '/employee/checkout',
+                      json.dumps(fields), 'application/json', headers)
+
+    def browse():
+        client = new_transport()
+        client.request('POST', '/admin/login', json.dumps({'adminId': ADMIN_ID, 'password': PASSWORD}),
+                       'application/json')
+        while not done.is_set():
+            recorder.call(client, 'GET /admin/employees', 'GET', '/admin/employees')
+            status, data = recorder.call(client, 'GET /admin/attendance-records', 'GET',
+                                         '/admin/attendance-records?limit=100')
+            next_cursor = json.loads(data).get('nextCursor') if status == 200 else None
+            if next_cursor:
+                recorder.call(client, 'GET /admin/attendance-records', 'GET',
+                              f'/admin/attendance-records?limit=100&cursor={next_cursor}')
+
+    admins = [threading.Thread(target=browse) for _ in range(args.admins)]
+    started = time.perf_counter()
+    for thread in admins:
+        thread.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(punch, emp_ids))
+    done.set()
+    for thread in admins:
+        thread.join()
+    return recorder.results(time.perf_counter() - started)
+
+
+def compare(results, baseline, tolerance):
+    """Per-endpoint verdicts against the baseline; returns (lines, regressed)"""
+    lines = []
+    regressed = False
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            lines.append((name, 'new'))
+            continue
+        problems = []
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            problems.append(f"req/s {base['rps']} -> {current['rps']}")
+        if current['p95'] - base['p95'] > max(base['p95'] * tolerance, NOISE_FLOOR_MS):
+            problems.append(f"p95 {base['p95']} -> {current['p95']} ms")
+        if current['errors'] > base['errors']:
+            problems.append(f"errors {base['errors']} -> {current['errors']}")
+        regressed = regressed or bool(problems)
+        lines.append((name, 'REGRESSION: ' + ', '.join(problems) if problems else 'ok'))
+    return lines, regressed
+
+
+def median_results(rounds):
+    """Per-endpoint medians over several runs (errors are summed)"""
+    merged = {}
+    for name in sorted({name for results in rounds for name in results}):
+        runs = [results[name] for results in rounds if name in results]
+        merged[name] = {key: statistics.median(r[key] for r in runs) for key in ('requests', 'rps', 'p50', 'p95', 'p99')}
+        merged[name]['errors'] = sum(r['errors'] for r in runs)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--employees', type=int, default=500, help='employees per round')
+    parser.add_argument('--days', type=int, default=30, help='days of history to seed (weekdays only)')
+    parser.add_argument('--rounds', type=int, default=3, help='repetitions, each with fresh employees')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent employee sessions')
+    parser.add_argument('--admins', type=int, default=2, help='concurrent admin dashboard readers')
+    parser.add_argument('--photo-ratio', type=float, default=0.2, help='share of check-ins with a photo')
+    parser.add_argument('--photo-kb', type=int, default=200)
+    parser.add_argument('--server', action='store_true', help='drive a local HTTP server instead of the test client')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scrypt-n', type=int, default=256,
+                        help='password hashing cost for the run; bench_login.py measures production costs')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed relative slowdown per endpoint')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--keep', action='store_true', help='keep the seeded working directory')
+    args = parser.parse_args()
+
+    # app.py keeps its database and uploads relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    os.chdir(workdir)
+    logging.disable(logging.WARNING)  # no per-request server log lines
+    # Punches carry bearer tokens, which are only issued with a signing key configured
+    os.environ.setdefault('PUNCH_TOKEN_SECRET', 'bench-load')
+
+    import app as attendance
+    import passwords
+
+    attendance.password_hasher = passwords.PasswordHasher(
+        passwords.scrypt_method(args.scrypt_n, 8, 1), max_workers=attendance.PASSWORD_HASH_WORKERS,
+        max_pending=attendance.PASSWORD_HASH_QUEUE, timeout=attendance.PASSWORD_HASH_TIMEOUT
+    )
+
+    started = time.perf_counter()
+    emp_ids, config, history = seed(attendance, args.employees * args.rounds, args.days, random.Random(args.seed))
+    print(f'seeded {len(emp_ids)} employees, {history} history rows in {time.perf_counter() - started:.1f}s')
+    photo = make_photo(args.photo_kb)
+
+    server = None
+    if args.server:
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, attendance.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        new_transport = lambda: HttpTransport(server.server_port)
+    else:
+        new_transport = lambda: TestClientTransport(attendance.app)
+
+    results = median_results([
+        run(new_transport, emp_ids[i * args.employees:(i + 1) * args.employees], config, args, photo)
+        for i in range(args.rounds)
+    ])
+
+    if server:
+        server.shutdown()
+    if attendance.punch_queue:
+        attendance.punch_queue.close()  # WRITE_BEHIND=1: commit what was acknowledged
+    attendance.thumbnail_worker.shutdown()
+    attendance.password_hasher.shutdown()
+    attendance.db_pool.close_all()
+    os.chdir(REPO_ROOT)
+    if args.keep:
+        print(f'seeded database and photos kept in {workdir}')
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    params = {name: getattr(args, name) for name in
+              ('employees', 'days', 'rounds', 'concurrency', 'admins', 'photo_ratio', 'photo_kb', 'server', 'seed',
+               'scrypt_n')}
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['params'] != params:
+            print(f'baseline {args.baseline} was recorded with {baseline["params"]}; not comparing')
+            baseline = None
+    verdicts, regressed = compare(results, baseline['endpoints'], args.tolerance) if baseline else ({}, False)
+    verdicts = dict(verdicts)
+
+    print(f'{"endpoint":<34}{"reqs":>7}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}  baseline')
+    for name, r in results.items():
+        print(f'{name:<34}{r["requests"]:>7}{r["rps"]:>9}{r["p50"]:>9}{r["p95"]:>9}{r["p99"]:>9}{r["errors"]:>8}  '
+              f'{verdicts.get(name, "-")}')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'params': params, 'endpoints': results}, f, indent=2)
+            f.write('\n')
+        print(f'baseline saved to {args.baseline}')
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Measure employee logins per second at each scrypt cost setting
+
+For every cost (log2 of scrypt's n), employees are given passwords hashed at
+that cost and log in concurrently through the Flask app, so each login is one
+scrypt verification on the bounded password pool. Logins refused with 503
+(pool saturated) are counted separately. A final run logs in employees whose
+passwords are still legacy plaintext, which verifies and rehashes them.
+
+Usage: python benchmarks/bench_login.py [--costs 14,15,16] [--logins 200] [--concurrency 16] [--workers N]
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+PASSWORD = 'bench-password'
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(attendance, emp_ids, concurrency):
+    client = attendance.app.test_client()
+    latencies = []
+    statuses = []
+
+    def login(emp_id):
+        started = time.perf_counter()
+        response = client.post('/employee/login', json={'empId': emp_id, 'password': PASSWORD})
+        latencies.append(time.perf_counter() - started)
+        statuses.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(login, emp_ids))
+    elapsed = time.perf_counter() - started
+    ok = statuses.count(200)
+    return {
+        'ok': ok,
+        'busy': statuses.count(503),
+        'failed': len(statuses) - ok - statuses.count(503),
+        'rate': ok / elapsed,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000
+    }
+
+
+def report(name, result):
+    print(f'{name:>22}: {result["rate"]:8.1f} logins/s  p50 {result["p50"]:8.1f} ms  p95 {result["p95"]:8.1f} ms  '
+          f'busy {result["busy"]}  failed {result["failed"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--costs', default='14,15,16', help='comma-separated log2(n) values, r=8 p=1')
+    parser.add_argument('--logins', type=int, default=200, help='logins per cost setting')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, help='password pool threads (default PASSWORD_HASH_WORKERS)')
+    args = parser.parse_args()
+
+    # app.py keeps its database relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='bench_login_')
+    os.chdir(workdir)
+    logging.disable(logging.WARNING)
+
+    import app as attendance
+    import bulk
+    import passwords
+    from contextlib import closing
+
+    workers = args.workers or attendance.PASSWORD_HASH_WORKERS
+    print(f'{args.logins} logins per setting, concurrency {args.concurrency}, {workers} hashing workers, '
+          f'queue {attendance.PASSWORD_HASH_QUEUE}')
+    costs = [int(cost) for cost in args.costs.split(',')]
+    for cost in costs + [None]:
+        # A pool at the target cost, so the plaintext run rehashes at the last cost measured
+        method = passwords.scrypt_method(2 ** (cost if cost is not None else costs[-1]), 8, 1)
+        attendance.password_hasher.shutdown()
+        attendance.password_hasher = passwords.PasswordHasher(
+            method, max_workers=workers, max_pending=attendance.PASSWORD_HASH_QUEUE,
+            timeout=attendance.PASSWORD_HASH_TIMEOUT
+        )
+        # One hash shared by every employee keeps seeding fast; verifying costs the same
+        stored = attendance.password_hasher.hash(PASSWORD) if cost is not None else PASSWORD
+        prefix = f'C{cost}-' if cost is not None else 'PLAIN-'
+        records = [{'empId': f'{prefix}{i:06d}', 'empName': f'Employee {i}', 'empEmail': f'e{i}@example.com',
+                    'password': PASSWORD} for i in range(args.logins)]
+        with closing(attendance.get_db()) as conn:
+            bulk.import_employees(conn, records, prepare_passwords=lambda batch: [stored] * len(batch))
+        name = f'{method}' if cost is not None else 'plaintext -> rehash'
+        report(name, run(attendance, [r['empId'] for r in records], args.concurrency))
+
+    attendance.password_hasher.shutdown()
+    attendance.thumbnail_worker.shutdown()
+    attendance.db_pool.close_all()
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
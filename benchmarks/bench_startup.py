@@ -0,0 +1,78 @@
+"""Measure worker startup: importing app.py on a new and on an up-to-date database, and init_db() alone
+
+Every worker process imports app.py, which brings the schema up to date before
+serving. Each start runs in a fresh interpreter in a temporary directory; the
+first start creates the database, later starts find its schema current.
+
+Usage: python benchmarks/bench_startup.py [--starts 10] [--calls 200]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prints the import app.py time, then medians of init_db() and of a bare query, each on a new
+# pooled connection as in a freshly started worker (connecting included), all in milliseconds
+PROBE = '''
+import time
+from contextlib import closing
+started = time.perf_counter()
+import app
+
+
+def fresh(func):
+    timings = []
+    for _ in range({calls}):
+        app.db_pool.close_all()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+def bare_query():
+    with closing(app.get_db()) as conn:
+        conn.execute('SELECT 1').fetchone()
+
+
+imported = (time.perf_counter() - started) * 1000
+print(imported, fresh(app.init_db), fresh(bare_query))
+app.thumbnail_worker.shutdown()
+'''
+
+
+def start(workdir, calls):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    output = subprocess.run([sys.executable, '-c', PROBE.format(calls=calls)], cwd=workdir, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return [float(value) for value in output.split()[-3:]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--starts', type=int, default=10, help='restarts on the up-to-date database')
+    parser.add_argument('--calls', type=int, default=200, help='init_db() calls timed per start')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')
+    try:
+        first = start(workdir, args.calls)
+        restarts = [start(workdir, args.calls) for _ in range(args.starts)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'first start (creates schema): import app {first[0]:8.2f} ms')
+    print(f'restart (schema current):     import app {statistics.median(r[0] for r in restarts):8.2f} ms  '
+          f'(median of {args.starts})')
+    print(f'init_db() on a current schema:           {statistics.median(r[1] for r in restarts):8.3f} ms  '
+          f'(median of {args.starts} x {args.calls} calls, new connection each)')
+    print(f'  of which connecting (bare SELECT 1):    {statistics.median(r[2] for r in restarts):8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import csv
+import io
+import json
+import time
+
+from db import retry_on_locked
+
+# Accepted spellings for each employee field (API camelCase and CSV snake_case)
+EMPLOYEE_FIELDS = {
+    'emp_id': ('empId', 'emp_id', 'employeeId'),
+    'name': ('empName', 'name'),
+    'email': ('empEmail', 'email'),
+    'password': ('password',),
+}
+
+
+def read_employee_file(stream, filename):
+    """Parse an uploaded CSV or JSON employee file into a list of dicts"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    if filename.lower().endswith('.json'):
+        data = json.load(text)
+        return data.get('employees', []) if isinstance(data, dict) else data
+    return list(csv.DictReader(text))
+
+
+def normalize_employee(record):
+    """Map one input record to (emp_id, name, email, password); raises ValueError if invalid"""
+    if not isinstance(record, dict):
+        raise ValueError('Row must be an object')
+    values = {}
+    for field, keys in EMPLOYEE_FIELDS.items():
+        value = next((record[k] for k in keys if record.get(k) not in (None, '')), None)
+        if value is None:
+            raise ValueError(f'Missing {field}')
+        values[field] = str(value).strip()
+    return values['emp_id'], values['name'], values['email'], values['password']
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+
+def throughput(count, started):
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': round(elapsed, 4),
+        'rowsPerSecond': round(count / elapsed, 1) if elapsed > 0 else None
+    }
+
+
+@retry_on_locked()
+def insert_employees(conn, rows):
+    """Insert one chunk of employee rows in its own transaction, retried alone on lock errors.
+
+    Returns one flag per row: False if the ID was taken by the time the row was written.
+    """
+    try:
+        inserted = [conn.execute('''
+            INSERT INTO employees (emp_id, name, email, password, device_id, device_approved)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(emp_id) DO NOTHING
+        ''', row).rowcount == 1 for row in rows]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return inserted
+
+
+def import_employees(conn, records, chunk_size=500, prepare_passwords=None):
+    """Insert employees in chunked executemany transactions.
+
+    Invalid rows, duplicates within the input and IDs that already exist are
+    skipped and reported per row; every other row is inserted. One commit per
+    chunk keeps transactions short, and a lock error retries only the chunk
+    being written, never chunks already committed. prepare_passwords, if given, maps a chunk's
+    list of passwords to the values stored (e.g. hashes them in parallel).
+    """
+    started = time.perf_counter()
+    imported = []
+    errors = []
+    seen = set()
+
+    for offset, chunk in chunked(records, chunk_size):
+        rows = []
+        for i, record in enumerate(chunk, start=offset):
+            try:
+                row = normalize_employee(record)
+            except ValueError as e:
+                errors.append({'row': i, 'message': str(e)})
+                continue
+            if row[0] in seen:
+                errors.append({'row': i, 'empId': row[0], 'message': 'Duplicate employee ID in input'})
+                continue
+            seen.add(row[0])
+            rows.append((i, row))
+
+        if not rows:
+            continue
+        placeholders = ','.join('?' * len(rows))
+        existing = {r[0] for r in conn.execute(
+            f'SELECT emp_id FROM employees WHERE emp_id IN ({placeholders})',
+            [row[0] for _, row in rows]
+        )}
+
+        # Skip known IDs before hashing; the insert itself still catches IDs taken since
+        to_insert = []
+        for i, (emp_id, name, email, password) in rows:
+            if emp_id in existing:
+                errors.append({'row': i, 'empId': emp_id, 'message': 'Employee ID already exists'})
+                continue
+            to_insert.append((i, (emp_id, name, email, password, None, 0)))
+        if prepare_passwords and to_insert:
+            stored = prepare_passwords([row[3] for _, row in to_insert])
+            to_insert = [(i, row[:3] + (password,) + row[4:]) for (i, row), password in zip(to_insert, stored)]
+
+        inserted = insert_employees(conn, [row for _, row in to_insert])
+        for (i, row), ok in zip(to_insert, inserted):
+            if ok:
+                imported.append(row[0])
+            else:
+                errors.append({'row': i, 'empId': row[0], 'message': 'Employee ID already exists'})
+
+    result = {'imported': len(imported), 'failed': len(errors), 'errors': errors, 'empIds': imported}
+    result.update(throughput(len(records), started))
+    return result
+
+
+@retry_on_locked()
+def decide_chunk(conn, chunk, approve, offset=0):
+    """Approve or reject one chunk of registrations in its own transaction, retried alone on lock errors.
+
+    Returns (decided registration rows, per-row errors).
+    """
+    status = 'approved' if approve else 'rejected'
+    try:
+        placeholders = ','.join('?' * len(chunk))
+        found = {r['reg_id']: r for r in conn.execute(f'''
+            SELECT reg_id, employee_id, device_id, device_fingerprint, status
+            FROM device_registrations
+            WHERE reg_id IN ({placeholders})
+        ''', chunk)}
+
+        rows = []
+        errors = []
+        for i, reg_id in enumerate(chunk, start=offset):
+            reg = found.get(reg_id)
+            if not reg:
+                errors.append({'row': i, 'regId': reg_id, 'message': 'Registration not found'})
+            elif reg['status'] != 'pending':
+                errors.append({'row': i, 'regId': reg_id, 'message': f"Registration already {reg['status']}"})
+            else:
+                rows.append(reg)
+
+        if approve:
+            conn.executemany('''
+                UPDATE employees
+                SET device_id = ?, device_approved = 1, device_fingerprint = ?
+                WHERE emp_id = ?
+            ''', [(r['device_id'], r['device_fingerprint'], r['employee_id']) for r in rows])
+        conn.executemany(
+            'UPDATE device_registrations SET status = ? WHERE reg_id = ?',
+            [(status, r['reg_id']) for r in rows]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows, errors
+
+
+def decide_registrations(conn, reg_ids, approve, chunk_size=500):
+    """Approve or reject many pending device registrations, one transaction per chunk.
+
+    A lock error retries only the chunk being decided, never chunks already
+    committed. Returns a result dict; result['empIds'] lists employees whose device state changed
+    and result['deviceIds'] the matching device ids.
+    """
+    started = time.perf_counter()
+    status = 'approved' if approve else 'rejected'
+    decided = []
+    emp_ids = []
+    device_ids = []
+    errors = []
+    reg_ids = list(dict.fromkeys(reg_ids))  # drop duplicates, keep order
+
+    for offset, chunk in chunked(reg_ids, chunk_size):
+        rows, chunk_errors = decide_chunk(conn, chunk, approve, offset)
+        errors.extend(chunk_errors)
+        decided.extend(r['reg_id'] for r in rows)
+        emp_ids.extend(r['employee_id'] for r in rows)
+        device_ids.extend(r['device_id'] for r in rows)
+
+    result = {status: len(decided), 'failed': len(errors), 'errors': errors,
+              'regIds': decided, 'empIds': emp_ids, 'deviceIds': device_ids}
+    result.update(throughput(len(reg_ids), started))
+    return result
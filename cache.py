@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU cache with optional TTL and hit/miss counters"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> [generation, loads in flight]; invalidate() bumps the generation so a
+        # load that started before it doesn't store what it read
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        entry = self._data.get(key, _MISSING)
+        if entry is not _MISSING:
+            value, expires = entry
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return _MISSING
+
+    def _store(self, key, value):
+        # Caller holds the lock
+        self._data[key] = (value, time.monotonic() + self.ttl if self.ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        """Return the cached value (refreshing its recency) or default"""
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_load(self, key, loader):
+        """Return the cached value, calling loader(key) to fill it on a miss.
+
+        The loader runs outside the lock. Its result is returned but not cached
+        if the key was invalidated while it ran, since it may predate the change.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            loading = self._loading.setdefault(key, [0, 0])
+            loading[1] += 1
+            generation = loading[0]
+        try:
+            value = loader(key)
+        except BaseException:
+            with self._lock:
+                self._end_load(key)
+            raise
+        with self._lock:
+            if self._end_load(key) == generation:
+                self._store(key, value)
+        return value
+
+    def _end_load(self, key):
+        # Caller holds the lock; returns the key's generation as the load finishes
+        loading = self._loading[key]
+        loading[1] -= 1
+        if loading[1] == 0:
+            del self._loading[key]
+        return loading[0]
+
+    def invalidate(self, key):
+        """Drop a single entry, and keep loads already in flight for it from storing"""
+        with self._lock:
+            if key in self._loading:
+                self._loading[key][0] += 1
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry, and keep loads already in flight from storing"""
+        with self._lock:
+            for loading in self._loading.values():
+                loading[0] += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,239 @@
+import functools
+import queue
+import random
+import sqlite3
+import threading
+import time
+
+
+# Default storage profile applied to every new connection
+DEFAULT_STORAGE_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,       # negative = KiB, so ~16 MB page cache
+    'mmap_size': 268435456,     # 256 MB memory-mapped I/O
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,       # milliseconds
+}
+
+
+def apply_storage_profile(conn, profile=None):
+    """Apply journal mode, sync level, cache and busy timeout pragmas"""
+    profile = profile or DEFAULT_STORAGE_PROFILE
+    for pragma in ('busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store'):
+        value = profile.get(pragma)
+        if value is None:
+            continue
+        # Pragmas cannot take bound parameters; values come from trusted config
+        conn.execute(f'PRAGMA {pragma} = {value}')
+
+
+def is_locked_error(exc):
+    """True for SQLite 'database is locked' / 'busy' errors"""
+    message = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def retry_on_locked(retries=5, base_delay=0.01, max_delay=0.5):
+    """Retry the wrapped function with jittered exponential backoff on lock errors"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            attempt = 0
+            while True:
+                try:
+                    return func(*args, **kwargs)
+                except sqlite3.OperationalError as exc:
+                    if not is_locked_error(exc) or attempt >= retries:
+                        raise
+                    delay = min(max_delay, base_delay * (2 ** attempt))
+                    time.sleep(delay * (0.5 + random.random() / 2))
+                    attempt += 1
+        return wrapper
+    return decorator
+
+
+def schema_version(conn):
+    """The schema version recorded in the database header (PRAGMA user_version)"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def add_column(conn, table, column, declaration):
+    """ALTER TABLE ... ADD COLUMN unless the table already has the column"""
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+
+def migrate(conn, migrations):
+    """Apply the migrations newer than the database's PRAGMA user_version, in order.
+
+    migrations is a list of (version, description, function(conn)) with increasing
+    versions. An up-to-date database costs one PRAGMA read. Otherwise each pending
+    migration runs in its own IMMEDIATE transaction that also bumps user_version;
+    the version is re-read under the write lock, so workers starting together apply
+    each migration once. Migrations must not commit, or that guarantee is lost;
+    they should still be idempotent, for databases from before versioning.
+    Returns the (version, description) pairs applied.
+    """
+    if schema_version(conn) >= migrations[-1][0]:
+        return []
+    applied = []
+    for version, description, step in migrations:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            step(conn)
+            # Pragmas cannot take bound parameters; versions are integers from code
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((version, description))
+    return applied
+
+
+class PooledConnection:
+    """Pooled SQLite connection; close() hands it back to the pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Same semantics as sqlite3.Connection used as a context manager
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        return False
+
+    def close(self):
+        """Return the connection to the pool instead of closing it"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections"""
+
+    def __init__(self, database, size=8, timeout=5.0, statement_cache=256, on_connect=None,
+                 busy_timeout=5.0):
+        self.database = database
+        self.busy_timeout = busy_timeout
+        self.size = size
+        self.timeout = timeout
+        self.statement_cache = statement_cache
+        self.on_connect = on_connect
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {
+            'acquired': 0,
+            'released': 0,
+            'reused': 0,
+            'created': 0,
+            'discarded': 0,
+            'waits': 0,
+        }
+
+    def _connect(self):
+        # cached_statements keeps compiled statements around per connection,
+        # so the same SQL text is only prepared once per pooled connection
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+        )
+        conn.row_factory = sqlite3.Row
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    def acquire(self):
+        """Check out a connection, opening a new one while under the size limit"""
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    self._stats['created'] += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+                reused = False
+            else:
+                with self._lock:
+                    self._stats['waits'] += 1
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError('Timed out waiting for a database connection')
+                reused = True
+
+        with self._lock:
+            self._stats['acquired'] += 1
+            if reused:
+                self._stats['reused'] += 1
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Roll back anything left uncommitted and put the connection back"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except Exception:
+            # Broken connection or pool already full - drop it
+            with self._lock:
+                self._created -= 1
+                self._stats['discarded'] += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        with self._lock:
+            self._stats['released'] += 1
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        """Snapshot of pool counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._created
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        return stats
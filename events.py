@@ -0,0 +1,171 @@
+import asyncio
+import json
+import queue
+import threading
+from collections import deque
+
+
+def format_sse(event_id, event_type, data):
+    """Encode one Server-Sent Events message"""
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n'
+
+
+class Subscriber:
+    """One connected client: a bounded queue of (id, type, data) events"""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lagged = False
+        self.notify = None  # called after each publish, to wake an async stream
+
+
+class EventBroadcaster:
+    """In-process fan-out of change events to every connected admin stream.
+
+    publish() never blocks: a subscriber whose queue is full is marked as lagged
+    and told to resync instead of stalling the write path. Recent events are
+    kept in a ring buffer so a reconnecting client (Last-Event-ID) can replay
+    what it missed.
+    """
+
+    def __init__(self, max_queue=256, history=500, max_subscribers=100):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = (self._next_id, event_type, data)
+            self._next_id += 1
+            self.published += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                subscriber.lagged = True
+                with self._lock:
+                    self.dropped += 1
+            if subscriber.notify is not None:
+                subscriber.notify()
+        return event[0]
+
+    def subscribe(self):
+        """Register a new subscriber; returns None when the subscriber limit is reached"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(self.max_queue)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def replay(self, last_event_id):
+        """(events after last_event_id, latest id); events is None if some were discarded.
+
+        An id newer than anything published means the process restarted, which
+        also requires a resync.
+        """
+        with self._lock:
+            history = list(self._history)
+            latest = self._next_id - 1
+        if last_event_id == latest:
+            return [], latest
+        if last_event_id > latest or not history or last_event_id < history[0][0] - 1:
+            return None, latest
+        return [event for event in history if event[0] > last_event_id], latest
+
+    def _opening(self, last_event_id):
+        """(SSE text that starts a stream, last event id it covers)"""
+        messages = ['retry: 3000\n\n']
+        last_sent = 0
+        if last_event_id is not None:
+            missed, latest = self.replay(last_event_id)
+            if missed is None:
+                messages.append(format_sse(latest, 'resync', {}))
+                missed = []
+            last_sent = latest
+            messages.extend(format_sse(*event) for event in missed)
+        return messages, last_sent
+
+    def _message(self, subscriber, event, last_sent):
+        """(SSE text or None, last event id sent) for an event taken off a subscriber's queue"""
+        if subscriber.lagged:
+            # Events were dropped - the client must reload its views
+            subscriber.lagged = False
+            while not subscriber.queue.empty():
+                event = subscriber.queue.get_nowait()
+            return format_sse(event[0], 'resync', {}), event[0]
+        if event[0] <= last_sent:
+            return None, last_sent  # already sent during replay
+        return format_sse(*event), event[0]
+
+    def stream(self, subscriber, last_event_id=None, heartbeat=15):
+        """Yield SSE text for a subscriber until the client disconnects"""
+        try:
+            messages, last_sent = self._opening(last_event_id)
+            yield from messages
+            while True:
+                try:
+                    event = subscriber.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                message, last_sent = self._message(subscriber, event, last_sent)
+                if message:
+                    yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def astream(self, subscriber, last_event_id=None, heartbeat=15):
+        """stream() for an event loop: waits for events without holding a thread"""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass  # loop already closed during shutdown
+
+        subscriber.notify = notify
+        try:
+            messages, last_sent = self._opening(last_event_id)
+            for message in messages:
+                yield message
+            while True:
+                try:
+                    event = subscriber.queue.get_nowait()
+                except queue.Empty:
+                    wakeup.clear()
+                    if not subscriber.queue.empty():
+                        continue  # published between the get and the clear
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        yield ': keep-alive\n\n'
+                    continue
+                message, last_sent = self._message(subscriber, event, last_sent)
+                if message:
+                    yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'dropped': self.dropped,
+                'lastEventId': self._next_id - 1
+            }
@@ -0,0 +1,143 @@
+import csv
+import io
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; only CSV and NDJSON are available without it
+    pa = None
+    pq = None
+
+# Exported columns, in order
+COLUMNS = [
+    'emp_id', 'name', 'email', 'date',
+    'check_in', 'check_in_lat', 'check_in_lon',
+    'check_out', 'check_out_lat', 'check_out_lon',
+    'site_id', 'check_in_photo'
+]
+
+FLOAT_COLUMNS = {'check_in_lat', 'check_in_lon', 'check_out_lat', 'check_out_lon'}
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def available_formats():
+    """Export formats usable with the installed packages"""
+    if pa is None:
+        return ['csv', 'ndjson']
+    return ['csv', 'ndjson', 'arrow', 'parquet']
+
+
+def iter_batches(conn, date_from, date_to, emp_id=None, batch_size=1000, source='attendance_records'):
+    """Yield lists of row tuples for a date range, never holding more than one batch.
+
+    source is the table read, e.g. an attached month archive's attendance_records.
+    """
+    conditions = ['a.check_in IS NOT NULL', 'a.date >= ?', 'a.date <= ?']
+    params = [date_from, date_to]
+    if emp_id:
+        conditions.append('a.emp_id = ?')
+        params.append(emp_id)
+
+    cursor = conn.cursor()
+    cursor.arraysize = batch_size
+    cursor.execute(f'''
+        SELECT a.emp_id, e.name, e.email, a.date,
+               a.check_in, a.check_in_lat, a.check_in_lon,
+               a.check_out, a.check_out_lat, a.check_out_lon,
+               a.site_id, a.check_in_photo
+        FROM {source} a
+        JOIN employees e ON a.emp_id = e.emp_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY a.date, a.check_in, a.emp_id
+    ''', params)
+    try:
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+    finally:
+        cursor.close()  # an unfinished statement would keep an attached archive from detaching
+
+
+def iter_csv(batches):
+    """Encode batches as CSV text chunks (header first)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(batches):
+    """Encode batches as newline-delimited JSON chunks"""
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in rows)
+
+
+def arrow_schema():
+    return pa.schema([
+        (name, pa.float64() if name in FLOAT_COLUMNS else pa.int64() if name == 'site_id' else pa.string())
+        for name in COLUMNS
+    ])
+
+
+def to_record_batch(rows, schema):
+    """Convert one batch of row tuples into an Arrow RecordBatch"""
+    columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_floating(field.type):
+            values = [float(v) if v not in (None, '') else None for v in values]
+        elif pa.types.is_integer(field.type):
+            values = [int(v) if v not in (None, '') else None for v in values]
+        else:
+            values = [str(v) if v is not None else None for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iter_arrow(batches):
+    """Encode batches as an Arrow IPC stream, yielding bytes after each batch"""
+    schema = arrow_schema()
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in batches:
+            writer.write_batch(to_record_batch(rows, schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+def write_parquet(batches, target):
+    """Write batches to a Parquet file (path or binary file object), one row group per batch"""
+    schema = arrow_schema()
+    rows_written = 0
+    with pq.ParquetWriter(target, schema, compression='zstd') as writer:
+        for rows in batches:
+            writer.write_batch(to_record_batch(rows, schema))
+            rows_written += len(rows)
+    return rows_written
+
+
+def write_export(batches, fmt, target):
+    """Write an export to a binary file object in the given format"""
+    if fmt == 'parquet':
+        return write_parquet(batches, target)
+    encoders = {'csv': iter_csv, 'ndjson': iter_ndjson, 'arrow': iter_arrow}
+    for chunk in encoders[fmt](batches):
+        target.write(chunk.encode() if isinstance(chunk, str) else chunk)
+    return None
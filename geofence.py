@@ -0,0 +1,255 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; batch checks fall back to pure Python
+    np = None
+
+EARTH_RADIUS_M = 6371000  # Earth's radius in meters (same as the dashboard JS)
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Distance in meters between two coordinates using the Haversine formula"""
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(d_lon / 2) ** 2)
+    return EARTH_RADIUS_M * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def haversine_distances(center_lat, center_lon, lats, lons):
+    """Distances in meters from one center to many points in a single vectorized pass"""
+    if np is None:
+        return [haversine_distance(center_lat, center_lon, lat, lon) for lat, lon in zip(lats, lons)]
+
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    c_lat = math.radians(center_lat)
+    c_lon = math.radians(center_lon)
+    a = (np.sin((lats - c_lat) / 2) ** 2 +
+         math.cos(c_lat) * np.cos(lats) * np.sin((lons - c_lon) / 2) ** 2)
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def parse_coordinates(latitude, longitude):
+    """Convert client-supplied coordinates to floats; returns None if missing or invalid"""
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def check_point(config, latitude, longitude):
+    """Check one coordinate against a geofence config; returns (inside, distance)"""
+    distance = haversine_distance(config['latitude'], config['longitude'], latitude, longitude)
+    return distance <= config['radius'], distance
+
+
+def check_points(config, lats, lons):
+    """Check many coordinates against a geofence config; returns (inside, distances) sequences"""
+    distances = haversine_distances(config['latitude'], config['longitude'], lats, lons)
+    if np is None:
+        return [d <= config['radius'] for d in distances], distances
+    return distances <= config['radius'], distances
+
+
+METERS_PER_DEGREE = 111320.0  # length of one degree of latitude
+
+
+def point_in_polygon(latitude, longitude, polygon):
+    """Ray-casting point-in-polygon test; polygon is a list of [lat, lon] vertices"""
+    inside = False
+    n = len(polygon)
+    j = n - 1
+    for i in range(n):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > latitude) != (lat_j > latitude):
+            cross = (lon_j - lon_i) * (latitude - lat_i) / (lat_j - lat_i) + lon_i
+            if longitude < cross:
+                inside = not inside
+        j = i
+    return inside
+
+
+class Fence:
+    """A named geofence site: a circle (center + radius) or a polygon"""
+
+    def __init__(self, site_id, name, latitude=None, longitude=None, radius=None, polygon=None):
+        self.site_id = site_id
+        self.name = name
+        self.polygon = [(float(lat), float(lon)) for lat, lon in polygon] if polygon else None
+        if self.polygon:
+            # Polygons are reported by their vertex centroid
+            latitude = sum(p[0] for p in self.polygon) / len(self.polygon)
+            longitude = sum(p[1] for p in self.polygon) / len(self.polygon)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+
+    @property
+    def shape(self):
+        return 'polygon' if self.polygon else 'circle'
+
+    def bbox(self):
+        """(min_lat, min_lon, max_lat, max_lon) enclosing the fence"""
+        if self.polygon:
+            lats = [p[0] for p in self.polygon]
+            lons = [p[1] for p in self.polygon]
+            return min(lats), min(lons), max(lats), max(lons)
+        d_lat = self.radius / METERS_PER_DEGREE
+        d_lon = self.radius / (METERS_PER_DEGREE * max(math.cos(math.radians(self.latitude)), 1e-6))
+        return self.latitude - d_lat, self.longitude - d_lon, self.latitude + d_lat, self.longitude + d_lon
+
+    def contains(self, latitude, longitude):
+        """Returns (inside, distance from the fence center in meters)"""
+        distance = haversine_distance(self.latitude, self.longitude, latitude, longitude)
+        if self.polygon:
+            return point_in_polygon(latitude, longitude, self.polygon), distance
+        return distance <= self.radius, distance
+
+    def to_dict(self):
+        data = {
+            'siteId': self.site_id,
+            'name': self.name,
+            'shape': self.shape,
+            'latitude': self.latitude,
+            'longitude': self.longitude
+        }
+        if self.polygon:
+            data['polygon'] = [list(p) for p in self.polygon]
+        else:
+            data['radius'] = self.radius
+        return data
+
+
+class GridIndex:
+    """Uniform lat/lon grid over fence bounding boxes for sub-linear candidate lookup"""
+
+    def __init__(self, fences, cell_size=0.05):
+        self.cell_size = cell_size
+        self.fences = {fence.site_id: fence for fence in fences}
+        self._cells = {}
+        for fence in fences:
+            min_lat, min_lon, max_lat, max_lon = fence.bbox()
+            row0, col0 = self._cell(min_lat, min_lon)
+            row1, col1 = self._cell(max_lat, max_lon)
+            for row in range(row0, row1 + 1):
+                for col in range(col0, col1 + 1):
+                    self._cells.setdefault((row, col), []).append(fence)
+
+    def __len__(self):
+        return len(self.fences)
+
+    def _cell(self, latitude, longitude):
+        return int(math.floor(latitude / self.cell_size)), int(math.floor(longitude / self.cell_size))
+
+    def candidates(self, latitude, longitude):
+        """Fences whose bounding box shares the point's grid cell"""
+        return self._cells.get(self._cell(latitude, longitude), [])
+
+    def match(self, latitude, longitude, allowed=None):
+        """Fences containing the point, nearest center first; allowed limits the site ids"""
+        matches = []
+        for fence in self.candidates(latitude, longitude):
+            if allowed is not None and fence.site_id not in allowed:
+                continue
+            inside, distance = fence.contains(latitude, longitude)
+            if inside:
+                matches.append((distance, fence))
+        matches.sort(key=lambda m: m[0])
+        return [fence for _, fence in matches]
+
+
+# Adaptive location-poll schedule sent to employee dashboards. Distances are to
+# the nearest fence boundary, so devices far away (inside or outside) poll rarely
+# and devices near an edge poll often; intervals shrink during peak windows
+# (shift start/end) and checked-out devices poll at a flat slow rate.
+DEFAULT_POLL_SCHEDULE = {
+    'bands': [
+        {'maxDistance': 50, 'interval': 15},
+        {'maxDistance': 250, 'interval': 30},
+        {'maxDistance': 1000, 'interval': 60},
+        {'maxDistance': 5000, 'interval': 180},
+        {'maxDistance': None, 'interval': 600},
+    ],
+    'peakWindows': [
+        {'start': '08:30', 'end': '10:00'},
+        {'start': '17:00', 'end': '19:00'},
+    ],
+    'peakFactor': 0.5,
+    'checkedOutInterval': 1800,
+    'minInterval': 10,
+    'maxInterval': 1800,
+    'highAccuracyWithin': 250,  # beyond this a coarse (network) fix is good enough
+}
+
+FIXED_POLL_INTERVAL = 30  # seconds between fixes before the adaptive schedule
+
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def boundary_distance(fence, latitude, longitude):
+    """Meters from a point to the nearest edge of a fence (inside or outside)"""
+    if not fence.polygon:
+        distance = haversine_distance(fence.latitude, fence.longitude, latitude, longitude)
+        return abs(distance - fence.radius)
+    # Local equirectangular projection is accurate enough at fence scale
+    scale = METERS_PER_DEGREE * math.cos(math.radians(latitude))
+    best = None
+    n = len(fence.polygon)
+    for i in range(n):
+        (lat_a, lon_a), (lat_b, lon_b) = fence.polygon[i], fence.polygon[(i + 1) % n]
+        ax, ay = (lon_a - longitude) * scale, (lat_a - latitude) * METERS_PER_DEGREE
+        bx, by = (lon_b - longitude) * scale, (lat_b - latitude) * METERS_PER_DEGREE
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        t = max(0.0, min(1.0, -(ax * dx + ay * dy) / length)) if length else 0.0
+        distance = math.hypot(ax + t * dx, ay + t * dy)
+        best = distance if best is None else min(best, distance)
+    return best
+
+
+def band_index(schedule, distance):
+    """Index of the schedule band covering a boundary distance"""
+    for i, band in enumerate(schedule['bands']):
+        if band['maxDistance'] is None or distance <= band['maxDistance']:
+            return i
+    return len(schedule['bands']) - 1
+
+
+def poll_interval(schedule, distance, minute_of_day, checked_out=False):
+    """Seconds until the next location fix (mirrors pollInterval in employee_dashboard.js)"""
+    if checked_out:
+        return schedule['checkedOutInterval']
+    interval = schedule['bands'][band_index(schedule, distance)]['interval']
+    for window in schedule['peakWindows']:
+        if _minutes(window['start']) <= minute_of_day < _minutes(window['end']):
+            interval *= schedule['peakFactor']
+            break
+    return max(schedule['minInterval'], min(schedule['maxInterval'], interval))
+
+
+def daily_poll_cost(schedule):
+    """Expected location fixes per day for a dashboard left open all day, per band.
+
+    Returns {'bands': [fixes per day for each band], 'checkedOut': ..., 'fixed': ...}
+    where 'fixed' is the cost of the old constant 30-second interval.
+    """
+    bands = []
+    for band in schedule['bands']:
+        distance = band['maxDistance'] if band['maxDistance'] is not None else float('inf')
+        bands.append(round(sum(60 / poll_interval(schedule, distance, minute) for minute in range(1440)), 1))
+    return {
+        'bands': bands,
+        'checkedOut': round(86400 / schedule['checkedOutInterval'], 1),
+        'fixed': 86400 / FIXED_POLL_INTERVAL
+    }
@@ -0,0 +1,397 @@
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import closing
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks: assume a single process per log directory
+    fcntl = None
+
+from db import is_locked_error
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+WRITER_LOCK_NAME = 'writer.lock'  # held by the one process allowed to queue punches
+DEAD_LETTER_NAME = 'dead-letter.log'  # punches that could not be committed, one JSON object per line
+
+
+def create_table(cursor):
+    """Create the table holding, per punch log, the last sequence number committed"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            log_name TEXT PRIMARY KEY,
+            applied_seq INTEGER NOT NULL
+        )
+    ''')
+
+
+def applied_seq(conn, log_name):
+    row = conn.execute('SELECT applied_seq FROM ingest_state WHERE log_name = ?', (log_name,)).fetchone()
+    return row[0] if row else 0
+
+
+def save_applied_seq(conn, log_name, seq):
+    conn.execute('''
+        INSERT INTO ingest_state (log_name, applied_seq) VALUES (?, ?)
+        ON CONFLICT(log_name) DO UPDATE SET applied_seq = excluded.applied_seq
+    ''', (log_name, seq))
+
+
+def read_log(path):
+    """(seq, punch) entries of a log file; a torn final line from a crash is skipped"""
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries.append((entry.pop('seq'), entry))
+    return entries
+
+
+def lock_file(f):
+    """Take an exclusive lock on an open log; False if another live process holds it"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def database_durable(conn):
+    """Checkpoint the WAL; True once every committed transaction is in the synced database file"""
+    busy, log_frames, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    return busy == 0 and log_frames == checkpointed
+
+
+def write_punches(get_db, apply, log_name, punches, seq):
+    """Apply punches and record seq as log_name's committed sequence number, in one transaction.
+
+    Retried for as long as the database is locked or busy; any other error is raised.
+    """
+    delay = 0.05
+    while True:
+        try:
+            with closing(get_db()) as conn:
+                apply(conn, punches)
+                save_applied_seq(conn, log_name, seq)
+                conn.commit()
+            return
+        except Exception as exc:
+            if not is_locked_error(exc):
+                raise
+            logger.warning('Committing %d punches from %s: database busy, retrying', len(punches), log_name)
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+
+def dead_letter(path, log_name, seq, punch, error):
+    """Append a punch that can't be committed to the dead-letter file, on disk before returning"""
+    line = json.dumps(dict(punch, log=log_name, seq=seq, error=str(error)), separators=(',', ':'))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def commit_entries(get_db, apply, log_name, entries, dead_letter_path, attempts=3):
+    """Commit a log's (seq, punch) entries in order; returns the seqs moved to the dead-letter file.
+
+    The entries go in one transaction. If that fails with anything but a lock
+    error they are committed one at a time, and a punch that still fails after
+    attempts tries is appended to dead_letter_path and skipped, so one bad
+    punch can't hold up the rest. Raises only if the database itself can't be
+    written (the entries then stay in the log).
+    """
+    try:
+        write_punches(get_db, apply, log_name, [punch for _, punch in entries], entries[-1][0])
+        return set()
+    except Exception:
+        logger.exception('Committing %d punches from %s failed; retrying them one at a time', len(entries), log_name)
+    dead = set()
+    for seq, punch in entries:
+        for attempt in range(attempts):
+            try:
+                write_punches(get_db, apply, log_name, [punch], seq)
+                break
+            except Exception as exc:
+                error = exc
+                if attempt + 1 < attempts:
+                    time.sleep(0.05 * 2 ** attempt)
+        else:
+            logger.error('Punch %d from %s failed %d times (%s); moved to %s',
+                         seq, log_name, attempts, error, dead_letter_path)
+            dead_letter(dead_letter_path, log_name, seq, punch, error)
+            write_punches(get_db, apply, log_name, [], seq)
+            dead.add(seq)
+    return dead
+
+
+def replay_orphans(log_dir, get_db, apply, exclude=None):
+    """Commit punches left in logs of processes that exited or crashed; returns the number replayed.
+
+    Entries past the log's committed sequence number are applied in order (see
+    commit_entries()), then the log is removed. Logs still locked by a running
+    process are left alone.
+    """
+    replayed = 0
+    for path in sorted(glob.glob(os.path.join(log_dir, 'punches-*.log'))):
+        if exclude and os.path.abspath(path) == os.path.abspath(exclude):
+            continue
+        with open(path, 'a+', encoding='utf-8') as f:
+            if not lock_file(f):
+                continue
+            log_name = os.path.basename(path)
+            entries = read_log(path)
+            with closing(get_db()) as conn:
+                done = applied_seq(conn, log_name)
+            pending = [(seq, punch) for seq, punch in entries if seq > done]
+            if pending:
+                dead = commit_entries(get_db, apply, log_name, pending, os.path.join(log_dir, DEAD_LETTER_NAME))
+                replayed += len(pending) - len(dead)
+                logger.warning('Replayed %d punches from %s', len(pending) - len(dead), path)
+            with closing(get_db()) as conn:
+                if not database_durable(conn):
+                    continue  # keep the log until the commits are on disk
+                os.remove(path)
+                conn.execute('DELETE FROM ingest_state WHERE log_name = ?', (log_name,))
+                conn.commit()
+    return replayed
+
+
+class PunchQueue:
+    """Write-behind ingestion for punches.
+
+    submit() appends a punch to this process's append-only log and returns once
+    the log is on disk; concurrent submitters share one fsync (group commit).
+    A writer thread drains the queue in batches of up to batch_size, waiting up
+    to interval seconds to fill one, and commits each batch in one transaction
+    together with the log's sequence number, so replaying a log after a crash
+    applies every punch exactly once. A punch that keeps failing for any reason
+    but a locked database is moved to the dead-letter file in log_dir instead
+    of stalling the queue.
+
+    Punches not yet committed are kept in a per (emp_id, date) overlay so reads
+    of an employee's own attendance see their writes immediately. The overlay is
+    in-process, so only one process may queue punches per log directory: a
+    second one would not see the first one's queued check-ins and could wrongly
+    reject a check-out. Constructing a second queue raises RuntimeError.
+    """
+
+    def __init__(self, log_dir, get_db, apply, on_commit=None, batch_size=500, interval=0.005,
+                 fsync=True, rotate_bytes=4 * 1024 * 1024):
+        self.get_db = get_db
+        self.apply = apply
+        self.on_commit = on_commit
+        self.batch_size = batch_size
+        self.interval = interval
+        self.fsync = fsync
+        self.rotate_bytes = rotate_bytes
+        os.makedirs(log_dir, exist_ok=True)
+        self._writer_lock = open(os.path.join(log_dir, WRITER_LOCK_NAME), 'a')
+        if not lock_file(self._writer_lock):
+            self._writer_lock.close()
+            raise RuntimeError(f'Another process is already queueing punches in {log_dir}; '
+                               'write-behind needs a single server process')
+        self.log_name = f'punches-{int(time.time() * 1000)}-{os.getpid()}.log'
+        self.log_path = os.path.join(log_dir, self.log_name)
+        self.dead_letter_path = os.path.join(log_dir, DEAD_LETTER_NAME)
+        self._log = open(self.log_path, 'ab')
+        lock_file(self._log)
+        self._queue = queue.Queue()
+        self._pending = {}  # (emp_id, date) -> attendance fields not yet committed, plus 'seq'
+        self._lock = threading.Lock()
+        self._sync_cond = threading.Condition()
+        self._applied_cond = threading.Condition()
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+        self._applied = 0
+        self._commits = 0  # batches taken out of _pending; lets submit() spot one committed mid-read
+        self._stats = {'batches': 0, 'committed': 0, 'fsyncs': 0, 'rotations': 0, 'errors': 0,
+                       'deadLettered': 0}
+        self._writer = threading.Thread(target=self._run, name='punch-writer', daemon=True)
+        self._writer.start()
+
+    def submit(self, punch, event=None, check=None, read=None):
+        """Log and enqueue a punch; returns an error message instead if check rejects it.
+
+        punch holds action ('checkin' / 'checkout'), empId, date, timestamp,
+        latitude, longitude and optionally photo and siteId. read, if given, loads
+        the stored state for the punch (e.g. its attendance row) without the lock
+        held; check is then called with that and the overlay entry for the punch's
+        employee and date (or None) while no other punch can be submitted. event
+        is handed to on_commit.
+        """
+        key = (punch['empId'], punch['date'])
+        while True:
+            commits = self._commits
+            stored = read() if read else None
+            with self._lock:
+                if read and self._commits != commits:
+                    continue  # a batch left the overlay during the read; read again
+                if check:
+                    error = check(stored, self._pending.get(key))
+                    if error:
+                        return error
+                self._appended += 1
+                seq = self._appended
+                self._log.write(json.dumps(dict(punch, seq=seq), separators=(',', ':')).encode() + b'\n')
+                self._log.flush()
+                entry = self._pending.setdefault(key, {})
+                prefix = 'checkIn' if punch['action'] == 'checkin' else 'checkOut'
+                entry[prefix] = punch['timestamp']
+                entry[f'{prefix}Lat'] = punch['latitude']
+                entry[f'{prefix}Lon'] = punch['longitude']
+                entry['seq'] = seq
+                self._queue.put((seq, punch, event))
+            break
+        if self.fsync:
+            self._wait_synced(seq)
+        return None
+
+    def _wait_synced(self, seq):
+        # The first waiter fsyncs everything appended so far; the rest ride along
+        while True:
+            with self._sync_cond:
+                while self._syncing and self._synced < seq:
+                    self._sync_cond.wait()
+                if self._synced >= seq:
+                    return
+                self._syncing = True
+            with self._lock:
+                target = self._appended  # every punch up to here is written and flushed
+            try:
+                os.fsync(self._log.fileno())
+            finally:
+                with self._sync_cond:
+                    self._synced = max(self._synced, target)
+                    self._syncing = False
+                    self._stats['fsyncs'] += 1
+                    self._sync_cond.notify_all()
+
+    def pending(self, emp_id, date):
+        """Uncommitted attendance fields for an employee and date, or None"""
+        with self._lock:
+            entry = self._pending.get((emp_id, date))
+            return {k: v for k, v in entry.items() if k != 'seq'} if entry else None
+
+    def flush(self, timeout=None):
+        """Wait until every punch submitted so far is committed; False on timeout"""
+        target = self._appended
+        with self._applied_cond:
+            return self._applied_cond.wait_for(lambda: self._applied >= target, timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        last_seq = batch[-1][0]
+        # Acknowledged punches are never dropped: while the database can't be
+        # written at all, keep retrying (they are in the log regardless)
+        delay = 0.05
+        while True:
+            try:
+                dead = commit_entries(self.get_db, self.apply, self.log_name,
+                                      [(seq, punch) for seq, punch, _ in batch], self.dead_letter_path)
+                break
+            except Exception:
+                self._stats['errors'] += 1
+                logger.exception('Committing %d queued punches failed; retrying', len(batch))
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+        with self._lock:
+            for _, punch, _ in batch:
+                key = (punch['empId'], punch['date'])
+                if key in self._pending and self._pending[key]['seq'] <= last_seq:
+                    del self._pending[key]
+            self._commits += 1
+            self._stats['batches'] += 1
+            self._stats['committed'] += len(batch) - len(dead)
+            self._stats['deadLettered'] += len(dead)
+        with self._applied_cond:
+            self._applied = last_seq
+            self._applied_cond.notify_all()
+        if self.on_commit:
+            try:
+                self.on_commit([event for seq, _, event in batch if event and seq not in dead])
+            except Exception:
+                logger.exception('Post-commit hook failed')
+        self._maybe_rotate(last_seq)
+
+    def _maybe_rotate(self, last_seq):
+        """Empty the log once it is large, fully committed and the database is on disk"""
+        with self._lock:
+            if self._log.tell() < self.rotate_bytes:
+                return
+        try:
+            with closing(self.get_db()) as conn:
+                durable = database_durable(conn)
+        except Exception:
+            logger.exception('Checkpoint before log rotation failed')
+            return
+        if not durable:
+            return
+        with self._lock:
+            if self._appended != last_seq:
+                return  # newer punches are only in the log
+            self._log.truncate(0)
+            self._log.seek(0)
+            os.fsync(self._log.fileno())
+            self._stats['rotations'] += 1
+
+    def close(self, timeout=30):
+        """Commit everything queued, stop the writer and remove the log if it is no longer needed.
+
+        If the writer cannot finish within timeout (e.g. the database is unavailable),
+        the remaining punches stay in the log for the next start to replay.
+        """
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            logger.error('%d punches not committed; left in %s for replay', self._appended - self._applied,
+                         self.log_path)
+            return
+        if self._log.closed:
+            return
+        self._log.close()
+        self._writer_lock.close()
+        # Replaying our own (now unlocked) log is a no-op apart from removing it
+        replay_orphans(os.path.dirname(self.log_path) or '.', self.get_db, self.apply)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['appended'] = self._appended
+            stats['pending'] = self._appended - self._applied
+            stats['logBytes'] = self._log.tell() if not self._log.closed else 0
+        stats['synced'] = self._synced
+        stats['averageBatch'] = round(stats['committed'] / stats['batches'], 1) if stats['batches'] else None
+        return stats
@@ -0,0 +1,321 @@
+import bisect
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from db import is_locked_error
+
+# Latency buckets in seconds, shared by request, SQL and punch-phase histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Distinct statement labels kept before further statements are counted as 'other'
+MAX_STATEMENTS = 500
+
+EXPOSITION_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def statement_label(sql):
+    """Normalized SQL: whitespace collapsed, placeholder lists of any length folded to '?, ...'"""
+    return _PLACEHOLDER_LIST.sub('?, ...', _WHITESPACE.sub(' ', sql).strip())
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def lines(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f'{self.name}{format_labels(self.labels, labels)} {format_value(value)}'
+
+
+class Histogram:
+    """Histogram per label set, exposed with cumulative buckets (Prometheus semantics)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> per-bucket counts (last one is +Inf) followed by the sum
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def lines(self):
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                yield f'{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {format_value(series[-1])}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {cumulative}'
+
+
+class Metrics:
+    """Process-wide request, SQL and punch-phase instrumentation in Prometheus text format"""
+
+    def __init__(self, prefix='attendance', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.requests = Histogram(f'{prefix}_http_request_duration_seconds',
+                                  'HTTP request latency by route', ('method', 'route', 'status'), buckets)
+        self.queries = Histogram(f'{prefix}_sql_query_duration_seconds',
+                                 'SQL statement execution latency by operation', ('operation',), buckets)
+        self.statements = Counter(f'{prefix}_sql_statements_total',
+                                  'Executions per normalized SQL statement', ('statement',))
+        self.statement_seconds = Counter(f'{prefix}_sql_statement_seconds_total',
+                                         'Execution time per normalized SQL statement', ('statement',))
+        self.lock_errors = Counter(f'{prefix}_sql_lock_errors_total',
+                                   'Statements that failed with database is locked / busy')
+        self.phases = Histogram(f'{prefix}_punch_phase_duration_seconds',
+                                'Time spent in each step of a punch', ('action', 'phase'), buckets)
+        self._labels = {}  # raw SQL text -> (statement label, operation)
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def observe_request(self, method, route, status, seconds):
+        self.requests.observe((method, route, str(status)), seconds)
+
+    def _classify(self, sql):
+        labels = self._labels.get(sql)
+        if labels is not None:
+            return labels
+        label = statement_label(sql)
+        operation = label.split(' ', 1)[0].upper() or 'OTHER'
+        with self._lock:
+            if label not in self._known:
+                if len(self._known) >= MAX_STATEMENTS:
+                    label = 'other'
+                else:
+                    self._known.add(label)
+            labels = (label, operation)
+            # Dynamically built SQL (IN lists) maps many texts onto one label; bound the map
+            if len(self._labels) < MAX_STATEMENTS * 4:
+                self._labels[sql] = labels
+        return labels
+
+    def observe_query(self, sql, seconds):
+        label, operation = self._classify(sql)
+        self.queries.observe((operation,), seconds)
+        self.statements.inc((label,))
+        self.statement_seconds.inc((label,), seconds)
+
+    @contextmanager
+    def phase(self, action, name):
+        """Time one step of a punch, e.g. with metrics.phase('check-in', 'device'): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.observe((action, name), time.perf_counter() - started)
+
+    def render(self, gauges=()):
+        """Exposition text; gauges are extra (name, type, help, value) samples read at scrape time"""
+        lines = []
+        for metric in (self.requests, self.queries, self.statements, self.statement_seconds,
+                       self.lock_errors, self.phases):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.lines())
+        for name, kind, help, value in gauges:
+            name = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times execute / executemany"""
+
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, parameters=()):
+        timed(self._metrics, self._cursor.execute, sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        timed(self._metrics, self._cursor.executemany, sql, seq_of_parameters)
+        return self
+
+
+class InstrumentedConnection:
+    """Connection proxy (around a pooled connection) that times every statement.
+
+    Timings cover executing a statement, which for a SELECT includes finding
+    the first row but not fetching the rest.
+    """
+
+    def __init__(self, conn, metrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor(), self._metrics)
+
+    def execute(self, sql, parameters=()):
+        return timed(self._metrics, self._conn.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return timed(self._metrics, self._conn.executemany, sql, seq_of_parameters)
+
+
+def timed(metrics, execute, sql, parameters):
+    started = time.perf_counter()
+    try:
+        return execute(sql, parameters)
+    except Exception as exc:
+        if is_locked_error(exc):
+            metrics.lock_errors.inc()
+        raise
+    finally:
+        metrics.observe_query(sql, time.perf_counter() - started)
+
+
+class StackSampler:
+    """Opt-in statistical profiler for selected requests.
+
+    A background thread wakes every interval seconds and records the Python
+    stack of each thread that is currently serving a tracked request. Samples
+    are aggregated as collapsed stacks ('label;file:function;... count'), the
+    input format of flamegraph.pl and speedscope. Untracked threads are never
+    sampled, so the overhead is limited to the profiled routes.
+    """
+
+    def __init__(self, interval=0.005, max_stacks=10000, max_depth=64):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self._active = {}  # thread ident -> label
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.samples = 0
+        self.dropped = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def track(self, label):
+        """Sample the calling thread under label until untrack()"""
+        self._active[threading.get_ident()] = label
+
+    def untrack(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            active = self._active.copy()
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, label in active.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                key = ';'.join([label] + stack[::-1])
+                with self._lock:
+                    self.samples += 1
+                    if key in self._counts or len(self._counts) < self.max_stacks:
+                        self._counts[key] += 1
+                    else:
+                        self.dropped += 1
+
+    def collapsed(self):
+        """Collapsed-stack text, one 'stack count' line per distinct stack"""
+        with self._lock:
+            items = sorted(self._counts.items())
+        return ''.join(f'{stack} {count}\n' for stack, count in items)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self.samples = 0
+            self.dropped = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self._thread is not None,
+                'tracked': len(self._active),
+                'samples': self.samples,
+                'dropped': self.dropped,
+                'stacks': len(self._counts),
+                'interval': self.interval
+            }
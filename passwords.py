@@ -0,0 +1,144 @@
+import hmac
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Stored hashes look like 'scrypt:<n>:<r>:<p>$<salt>$<hex digest>' (werkzeug's format);
+# anything else in a password column is a legacy plaintext password
+_HASH_FORMAT = re.compile(r'^(scrypt:\d+:\d+:\d+|pbkdf2:\w+:\d+)\$[^$]+\$[0-9a-f]+$')
+
+
+class Busy(Exception):
+    """Every hashing worker and queue slot is taken; the caller should retry later"""
+
+
+def scrypt_method(n, r, p):
+    return f'scrypt:{n}:{r}:{p}'
+
+
+def is_hashed(stored):
+    return bool(stored) and _HASH_FORMAT.match(stored) is not None
+
+
+def needs_rehash(stored, method):
+    """True for plaintext and for hashes made with a different algorithm or cost"""
+    return not is_hashed(stored) or stored.split('$', 1)[0] != method
+
+
+def check(stored, password):
+    """True if password matches the stored hash or legacy plaintext value"""
+    if not stored or not isinstance(password, str):
+        return False
+    if is_hashed(stored):
+        return check_password_hash(stored, password)
+    return hmac.compare_digest(stored.encode(), password.encode())
+
+
+class PasswordHasher:
+    """Bounded worker pool for salted scrypt password hashing.
+
+    scrypt is deliberately slow and memory-hard (about 128 * n * r bytes per
+    hash), and releases the GIL, so hashes run on max_workers threads of their
+    own. At most max_pending more calls wait for a worker; beyond that, and
+    after waiting timeout seconds, callers get Busy instead of piling up
+    request threads behind a login storm. Bulk imports hash on a separate
+    pool of import_workers threads, so a large import never queues ahead of
+    logins.
+    """
+
+    def __init__(self, method, max_workers=2, max_pending=32, timeout=10.0, import_workers=1):
+        self.method = method
+        self.max_workers = max_workers
+        self.import_workers = import_workers
+        self.timeout = timeout
+        self._executor = None
+        self._import_executor = None
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._dummy = None
+        self._stats = {'hashed': 0, 'verified': 0, 'rehashed': 0, 'rejected': 0, 'timeouts': 0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='password')
+            return self._executor
+
+    def _get_import_executor(self):
+        with self._lock:
+            if self._import_executor is None:
+                self._import_executor = ThreadPoolExecutor(max_workers=self.import_workers,
+                                                           thread_name_prefix='password-import')
+            return self._import_executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise Busy()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is held until the work finishes, even if this caller stops waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise Busy()
+
+    def _hash(self, password):
+        hashed = generate_password_hash(password, method=self.method)
+        with self._lock:
+            self._stats['hashed'] += 1
+        return hashed
+
+    def _verify(self, stored, password):
+        ok = check(stored, password)
+        with self._lock:
+            self._stats['verified'] += 1
+        if ok and needs_rehash(stored, self.method):
+            with self._lock:
+                self._stats['rehashed'] += 1
+            return ok, self._hash(password)
+        return ok, None
+
+    def hash(self, password):
+        """Hash a new password on the pool; raises Busy"""
+        return self._run(self._hash, password)
+
+    def hash_many(self, passwords):
+        """Hash a batch (e.g. a bulk import chunk) on the import pool, leaving the login workers free"""
+        return list(self._get_import_executor().map(self._hash, passwords))
+
+    def verify(self, stored, password):
+        """(matches, new_hash) on the pool; new_hash is set when a matching password should be
+        stored again because it is plaintext or was hashed at another cost. Raises Busy.
+
+        A missing account (stored None) is checked against a dummy hash, so it takes as
+        long as a wrong password and doesn't reveal which IDs exist.
+        """
+        if stored is None:
+            if self._dummy is None:
+                self._dummy = self.hash('dummy-password')
+            self._run(check, self._dummy, password or '')
+            return False, None
+        return self._run(self._verify, stored, password)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['method'] = self.method
+        stats['workers'] = self.max_workers
+        stats['importWorkers'] = self.import_workers
+        return stats
+
+    def shutdown(self, wait=True):
+        for executor in (self._executor, self._import_executor):
+            if executor is not None:
+                executor.shutdown(wait=wait)
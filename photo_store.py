@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime
+
+import photos
+
+
+class PhotoStore:
+    """Interface for check-in photo storage backends.
+
+    Keys are opaque, '/'-separated strings stored in attendance_records.check_in_photo.
+    """
+
+    def put(self, stream, max_bytes, chunk_size=64 * 1024, date=None):
+        """Store an upload stream; returns (key, created) where created is False for duplicates"""
+        raise NotImplementedError
+
+    def put_file(self, path, digest, date=None):
+        """Move an already written file with a known SHA-256 digest into the store; returns (key, created)"""
+        raise NotImplementedError
+
+    def owns(self, key):
+        """True if the key belongs to this store"""
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Filesystem path for a key, or None if the backend is not local"""
+        raise NotImplementedError
+
+    def etag(self, key):
+        """Strong ETag for a key's content"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Counters: photos stored, duplicates skipped and bytes written"""
+        raise NotImplementedError
+
+
+class LocalPhotoStore(PhotoStore):
+    """Content-addressed store on local disk, sharded by date and hash prefix.
+
+    Files are laid out as <root>/<prefix>/<YYYY-MM-DD>/<ab>/<sha256>.jpg, so an
+    identical upload on the same day maps to the same key and is kept once.
+    The layout mirrors object-storage keys, making this a drop-in stand-in.
+    """
+
+    def __init__(self, root, prefix='photos'):
+        self.root = root
+        self.prefix = prefix
+        self._incoming = os.path.join(root, prefix, '.incoming')
+        self._lock = threading.Lock()
+        self._stats = {'stored': 0, 'duplicates': 0, 'bytesWritten': 0}
+
+    def put(self, stream, max_bytes, chunk_size=64 * 1024, date=None):
+        tmp_path = self.incoming_path()
+        hasher = hashlib.sha256()
+        photos.save_stream(stream, tmp_path, max_bytes, chunk_size, hasher)
+        return self.put_file(tmp_path, hasher.hexdigest(), date)
+
+    def incoming_path(self):
+        """Fresh temporary path on the store's filesystem (so put_file can rename it into place)"""
+        os.makedirs(self._incoming, exist_ok=True)
+        return os.path.join(self._incoming, uuid.uuid4().hex)
+
+    def put_file(self, path, digest, date=None):
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        key = f'{self.prefix}/{date}/{digest[:2]}/{digest}.jpg'
+        target = self.local_path(key)
+        if os.path.exists(target):
+            # Duplicate content - keep the existing copy
+            os.remove(path)
+            with self._lock:
+                self._stats['duplicates'] += 1
+            return key, False
+        size = os.path.getsize(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        with self._lock:
+            self._stats['stored'] += 1
+            self._stats['bytesWritten'] += size
+        return key, True
+
+    def owns(self, key):
+        return key.startswith(f'{self.prefix}/')
+
+    def local_path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def etag(self, key):
+        # The file name is the content hash (plus the variant suffix for thumbnails)
+        return os.path.splitext(key.rsplit('/', 1)[-1])[0]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
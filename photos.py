@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only originals are stored
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Size-normalized variants generated in the background: name -> max edge in pixels
+VARIANTS = {
+    'thumb': 160,
+    'medium': 640,
+}
+
+
+class PhotoTooLarge(Exception):
+    """Raised when an upload exceeds the configured maximum size"""
+
+
+def save_stream(stream, path, max_bytes, chunk_size=64 * 1024, hasher=None):
+    """Copy an upload stream to disk in fixed-size chunks, enforcing max_bytes.
+
+    Data goes to a temporary file that is renamed into place once complete,
+    so readers never see a partial photo. If a hashlib object is passed as
+    hasher it is fed every chunk. Returns the number of bytes written.
+    """
+    tmp_path = f'{path}.part'
+    written = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise PhotoTooLarge(f'Photo exceeds the {max_bytes // 1024} KB limit')
+                if hasher is not None:
+                    hasher.update(chunk)
+                out.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written
+
+
+def variant_name(relative_path, variant):
+    """Relative path of a size variant, e.g. a/b.jpg -> a/b_thumb.jpg"""
+    root, ext = os.path.splitext(relative_path)
+    return f'{root}_{variant}{ext or ".jpg"}'
+
+
+def original_name(relative_path):
+    """Strip a variant suffix, returning the original photo path (or None if not a variant)"""
+    root, ext = os.path.splitext(relative_path)
+    for variant in VARIANTS:
+        if root.endswith(f'_{variant}'):
+            return root[:-len(variant) - 1] + ext
+    return None
+
+
+def make_variants(path):
+    """Write every size variant next to the original photo"""
+    if Image is None:
+        return []
+    created = []
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for variant, size in VARIANTS.items():
+            copy = image.copy()
+            copy.thumbnail((size, size))
+            target = variant_name(path, variant)
+            tmp_path = f'{target}.part'
+            copy.save(tmp_path, 'JPEG', quality=80, optimize=True)
+            os.replace(tmp_path, target)
+            created.append(target)
+    return created
+
+
+class ThumbnailWorker:
+    """Background thread pool that generates photo variants off the request thread"""
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def _run(self, path):
+        try:
+            make_variants(path)
+            with self._lock:
+                self.completed += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.warning('Thumbnail generation failed for %s: %s', path, e)
+
+    def submit(self, path):
+        """Queue variant generation for a saved photo; no-op without Pillow"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='thumbnail')
+            self.submitted += 1
+        return self._executor.submit(self._run, path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'pending': self.submitted - self.completed - self.failed
+            }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
@@ -0,0 +1,255 @@
+import calendar
+import time
+from datetime import datetime, timedelta
+
+# Per-day figures for attendance_records rows, computed in SQL so the same
+# expression serves the incremental write path and the nightly rebuild
+# ({source} is attendance_records, or an attached month archive's copy of it).
+# A check-in again after checking out replaces check_in, so minutes are only
+# counted while check_out is not before it
+DAILY_SELECT_FROM = '''
+    SELECT emp_id, date, check_in, check_out,
+           CASE WHEN check_out >= check_in
+                THEN ROUND((julianday(check_out) - julianday(check_in)) * 1440, 1)
+           END,
+           time(check_in) <= ?,
+           site_id
+    FROM {source}
+    WHERE check_in IS NOT NULL
+'''
+
+DAILY_SELECT = DAILY_SELECT_FROM.format(source='attendance_records')
+
+DAILY_COLUMNS = 'emp_id, date, first_in, last_out, minutes_worked, on_time, site_id'
+
+MONTHLY_SELECT = '''
+    SELECT emp_id, substr(date, 1, 7), COUNT(*), COUNT(last_out),
+           COALESCE(SUM(minutes_worked), 0), SUM(on_time), COUNT(*) - SUM(on_time),
+           SUM(strftime('%w', date) NOT IN ('0', '6'))
+    FROM attendance_daily
+'''
+
+MONTHLY_COLUMNS = ('emp_id, month, days_present, days_complete, minutes_worked, on_time_days, late_days, '
+                   'weekdays_present')
+
+
+def create_tables(cursor):
+    """Create the rollup tables"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            emp_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            first_in TEXT NOT NULL,
+            last_out TEXT,
+            minutes_worked REAL,
+            on_time INTEGER NOT NULL,
+            site_id INTEGER,
+            PRIMARY KEY (emp_id, date)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_daily_date ON attendance_daily (date)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_monthly (
+            emp_id TEXT NOT NULL,
+            month TEXT NOT NULL,
+            days_present INTEGER NOT NULL,
+            days_complete INTEGER NOT NULL,
+            minutes_worked REAL NOT NULL,
+            on_time_days INTEGER NOT NULL,
+            late_days INTEGER NOT NULL,
+            weekdays_present INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (emp_id, month)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_monthly_month ON attendance_monthly (month)')
+
+
+def fill_weekdays_present(conn):
+    """Recount attendance_monthly.weekdays_present from the daily rows (caller commits)"""
+    conn.execute('''
+        UPDATE attendance_monthly
+        SET weekdays_present = (
+            SELECT COUNT(*) FROM attendance_daily d
+            WHERE d.emp_id = attendance_monthly.emp_id
+              AND d.date >= attendance_monthly.month || '-01'
+              AND d.date <= attendance_monthly.month || '-31'
+              AND strftime('%w', d.date) NOT IN ('0', '6')
+        )
+    ''')
+
+
+def cutoff_time(workday_start, grace_minutes):
+    """Latest on-time check-in as 'HH:MM:SS', e.g. ('09:30', 10) -> '09:40:00'"""
+    start = datetime.strptime(workday_start, '%H:%M')
+    return (start + timedelta(minutes=grace_minutes)).strftime('%H:%M:%S')
+
+
+def month_bounds(month):
+    """First and last date strings of a 'YYYY-MM' month"""
+    year, mon = (int(part) for part in month.split('-'))
+    return f'{month}-01', f'{month}-{calendar.monthrange(year, mon)[1]:02d}'
+
+
+def working_days(month, today=None):
+    """Weekdays in a month up to and including today (all of them for past months)"""
+    first, last = month_bounds(month)
+    day = datetime.strptime(first, '%Y-%m-%d').date()
+    end = datetime.strptime(last, '%Y-%m-%d').date()
+    if today is not None:
+        end = min(end, today)
+    count = 0
+    while day <= end:
+        if day.weekday() < 5:
+            count += 1
+        day += timedelta(days=1)
+    return count
+
+
+def refresh_month(conn, emp_id, month):
+    """Recompute one employee's monthly row from at most ~31 daily rows"""
+    first, last = month_bounds(month)
+    conn.execute(f'''
+        INSERT INTO attendance_monthly ({MONTHLY_COLUMNS})
+        {MONTHLY_SELECT}
+        WHERE emp_id = ? AND date >= ? AND date <= ?
+        GROUP BY emp_id
+        ON CONFLICT(emp_id, month) DO UPDATE
+        SET days_present = excluded.days_present, days_complete = excluded.days_complete,
+            minutes_worked = excluded.minutes_worked, on_time_days = excluded.on_time_days,
+            late_days = excluded.late_days, weekdays_present = excluded.weekdays_present
+    ''', (emp_id, first, last))
+
+
+def refresh(conn, emp_id, date, on_time_cutoff):
+    """Roll one punch up into the daily and monthly tables (caller commits).
+
+    The day keeps its earliest check-in, and the on-time flag and minutes that go
+    with it, even when a later check-in replaces check_in in attendance_records.
+    """
+    conn.execute(f'''
+        INSERT INTO attendance_daily ({DAILY_COLUMNS})
+        {DAILY_SELECT} AND emp_id = ? AND date = ?
+        ON CONFLICT(emp_id, date) DO UPDATE
+        SET first_in = MIN(attendance_daily.first_in, excluded.first_in),
+            last_out = excluded.last_out,
+            minutes_worked = CASE
+                WHEN excluded.last_out >= MIN(attendance_daily.first_in, excluded.first_in)
+                THEN ROUND((julianday(excluded.last_out)
+                            - julianday(MIN(attendance_daily.first_in, excluded.first_in))) * 1440, 1)
+            END,
+            on_time = MAX(attendance_daily.on_time, excluded.on_time),
+            site_id = excluded.site_id
+    ''', (on_time_cutoff, emp_id, date))
+    refresh_month(conn, emp_id, date[:7])
+
+
+def rebuild(conn, on_time_cutoff, date_from=None, date_to=None, source='attendance_records', commit=True):
+    """Rebuild the rollups from attendance_records, optionally for a date range only.
+
+    Daily rows in the range are replaced in one set-based pass; monthly rows are
+    then recomputed for every month the range touches. Runs as one transaction,
+    committed unless commit is False (the caller's transaction then owns it).
+    """
+    started = time.perf_counter()
+    daily_where = ''
+    params = []
+    if date_from:
+        daily_where += ' AND date >= ?'
+        params.append(date_from)
+    if date_to:
+        daily_where += ' AND date <= ?'
+        params.append(date_to)
+
+    conn.execute(f'DELETE FROM attendance_daily WHERE 1 = 1{daily_where}', params)
+    daily = conn.execute(f'''
+        INSERT INTO attendance_daily ({DAILY_COLUMNS})
+        {DAILY_SELECT_FROM.format(source=source)}{daily_where}
+    ''', [on_time_cutoff] + params).rowcount
+
+    # Whole months, so rows outside the range but in the same month still count
+    month_where = ''
+    date_where = ''
+    month_params = []
+    date_params = []
+    if date_from:
+        month_where += ' AND month >= ?'
+        date_where += ' AND date >= ?'
+        month_params.append(date_from[:7])
+        date_params.append(month_bounds(date_from[:7])[0])
+    if date_to:
+        month_where += ' AND month <= ?'
+        date_where += ' AND date <= ?'
+        month_params.append(date_to[:7])
+        date_params.append(month_bounds(date_to[:7])[1])
+    conn.execute(f'DELETE FROM attendance_monthly WHERE 1 = 1{month_where}', month_params)
+    monthly = conn.execute(f'''
+        INSERT INTO attendance_monthly ({MONTHLY_COLUMNS})
+        {MONTHLY_SELECT}
+        WHERE 1 = 1{date_where}
+        GROUP BY emp_id, substr(date, 1, 7)
+    ''', date_params).rowcount
+    if commit:
+        conn.commit()
+    return {
+        'dailyRows': daily,
+        'monthlyRows': monthly,
+        'seconds': round(time.perf_counter() - started, 4)
+    }
+
+
+def daily_rows(conn, date_from, date_to, emp_id=None):
+    """Daily rollups for a date range, newest first"""
+    sql = '''
+        SELECT d.emp_id, e.name, d.date, d.first_in, d.last_out, d.minutes_worked, d.on_time, d.site_id
+        FROM attendance_daily d
+        JOIN employees e ON d.emp_id = e.emp_id
+        WHERE d.date >= ? AND d.date <= ?
+    '''
+    params = [date_from, date_to]
+    if emp_id:
+        sql += ' AND d.emp_id = ?'
+        params.append(emp_id)
+    sql += ' ORDER BY d.date DESC, d.emp_id'
+    return [{
+        'empId': row['emp_id'],
+        'name': row['name'],
+        'date': row['date'],
+        'firstIn': row['first_in'],
+        'lastOut': row['last_out'],
+        'hoursWorked': round(row['minutes_worked'] / 60, 2) if row['minutes_worked'] is not None else None,
+        'onTime': bool(row['on_time']),
+        'siteId': row['site_id']
+    } for row in conn.execute(sql, params)]
+
+
+def monthly_summary(conn, month, emp_id=None, today=None):
+    """Monthly totals for every employee, including those with no attendance (all absent)"""
+    expected = working_days(month, today)
+    sql = '''
+        SELECT e.emp_id, e.name, m.days_present, m.days_complete, m.minutes_worked,
+               m.on_time_days, m.late_days, m.weekdays_present
+        FROM employees e
+        LEFT JOIN attendance_monthly m ON m.emp_id = e.emp_id AND m.month = ?
+    '''
+    params = [month]
+    if emp_id:
+        sql += ' WHERE e.emp_id = ?'
+        params.append(emp_id)
+    sql += ' ORDER BY e.emp_id'
+    summary = []
+    for row in conn.execute(sql, params):
+        present = row['days_present'] or 0
+        summary.append({
+            'empId': row['emp_id'],
+            'name': row['name'],
+            'month': month,
+            'daysPresent': present,
+            'daysComplete': row['days_complete'] or 0,
+            'hoursWorked': round((row['minutes_worked'] or 0) / 60, 2),
+            'onTimeDays': row['on_time_days'] or 0,
+            'lateDays': row['late_days'] or 0,
+            # Weekend days worked count as present but can't offset an absent weekday
+            'absentDays': max(expected - (row['weekdays_present'] or 0), 0),
+            'workingDays': expected
+        })
+    return summary
@@ -15,8 +15,111 @@ document.addEventListener('DOMContentLoaded', function() {
     loadAttendanceRecords();
     loadPendingRegistrations();
     loadGeofenceConfig();
+    
+    // Apply changes pushed by the server instead of re-fetching the lists
+    connectLiveUpdates();
 });
 
+// Live updates (Server-Sent Events from /admin/events)
+let liveEvents = null;
+
+function liveUpdatesConnected() {
+    return liveEvents !== null && liveEvents.readyState === EventSource.OPEN;
+}
+
+function connectLiveUpdates() {
+    if (!window.EventSource) {
+        return;
+    }
+    liveEvents = new EventSource('/admin/events');
+    
+    liveEvents.addEventListener('checkin', event => applyCheckIn(JSON.parse(event.data)));
+    liveEvents.addEventListener('checkout', event => applyCheckOut(JSON.parse(event.data)));
+    liveEvents.addEventListener('registration', event => applyRegistration(JSON.parse(event.data)));
+    liveEvents.addEventListener('registrations_decided', event => applyRegistrationsDecided(JSON.parse(event.data)));
+    liveEvents.addEventListener('employee_added', event => applyEmployeeAdded(JSON.parse(event.data)));
+    liveEvents.addEventListener('employees_imported', () => loadEmployees());
+    // Events were missed (server restart or slow connection) - reload everything once
+    liveEvents.addEventListener('resync', () => {
+        loadEmployees();
+        loadAttendanceRecords();
+        loadPendingRegistrations();
+    });
+}
+
+// True when the attendance table shows the unfiltered newest-first list
+function attendanceShowsLatest() {
+    return attendanceQuery() === '';
+}
+
+function applyCheckIn(record) {
+    const row = document.querySelector(`#employeesTableBody tr[data-emp-id="${CSS.escape(record.empId)}"]`);
+    if (row) {
+        row.cells[4].innerHTML = statusBadge('checked_in');
+        row.cells[5].textContent = record.lastCheckIn;
+    }
+    
+    if (!attendanceShowsLatest()) {
+        return;
+    }
+    const tbody = document.getElementById('attendanceTableBody');
+    const key = `${record.empId}|${record.date}`;
+    const existing = tbody.querySelector(`tr[data-record-key="${CSS.escape(key)}"]`);
+    if (existing) {
+        existing.remove();
+    }
+    const empty = tbody.querySelector('.empty-state');
+    if (empty) {
+        tbody.innerHTML = '';
+    }
+    tbody.insertBefore(attendanceRow(record), tbody.firstChild);
+}
+
+function applyCheckOut(data) {
+    const row = document.querySelector(`#employeesTableBody tr[data-emp-id="${CSS.escape(data.empId)}"]`);
+    if (row) {
+        row.cells[4].innerHTML = statusBadge('checked_out');
+    }
+}
+
+function applyRegistration(reg) {
+    const tbody = document.getElementById('pendingTableBody');
+    const empty = tbody.querySelector('.empty-state');
+    if (empty) {
+        tbody.innerHTML = '';
+    }
+    tbody.insertBefore(pendingRow(reg), tbody.firstChild);
+}
+
+function applyRegistrationsDecided(data) {
+    const tbody = document.getElementById('pendingTableBody');
+    data.regIds.forEach(regId => {
+        const row = tbody.querySelector(`tr[data-reg-id="${CSS.escape(regId)}"]`);
+        if (row) {
+            row.remove();
+        }
+    });
+    if (!tbody.querySelector('tr')) {
+        tbody.innerHTML = '<tr><td colspan="5" class="empty-state">No pending registrations</td></tr>';
+    }
+    
+    Object.keys(data.devices).forEach(empId => {
+        const row = document.querySelector(`#employeesTableBody tr[data-emp-id="${CSS.escape(empId)}"]`);
+        if (row) {
+            row.cells[3].textContent = data.devices[empId];
+        }
+    });
+}
+
+function applyEmployeeAdded(employee) {
+    const tbody = document.getElementById('employeesTableBody');
+    const empty = tbody.querySelector('.empty-state');
+    if (empty) {
+        tbody.innerHTML = '';
+    }
+    tbody.appendChild(employeeRow(employee));
+}
+
 // Show tab function
 function showTab(tabName) {
     // Remove active class from all tabs
@@ -54,16 +157,7 @@ function loadEmployees() {
             if (data.success && data.employees && data.employees.length > 0) {
                 tbody.innerHTML = '';
                 data.employees.forEach(employee => {
-                    const row = document.createElement('tr');
-                    row.innerHTML = `
-                        <td>${employee.empId || 'N/A'}</td>
-                        <td>${employee.name || 'N/A'}</td>
-                        <td>${employee.email || 'N/A'}</td>
-                        <td>${employee.deviceId || 'Not Registered'}</td>
-                        <td><span class="badge badge-success">Active</span></td>
-                        <td>${employee.lastCheckIn || 'Never'}</td>
-                    `;
-                    tbody.appendChild(row);
+                    tbody.appendChild(employeeRow(employee));
                 });
             } else {
                 tbody.innerHTML = '<tr><td colspan="6" class="empty-state">No employees registered yet</td></tr>';
@@ -94,6 +188,31 @@ function loadEmployees() {
         });
 }
 
+// Table row for one employee
+function employeeRow(employee) {
+    const row = document.createElement('tr');
+    row.dataset.empId = employee.empId;
+    row.innerHTML = `
+        <td>${employee.empId || 'N/A'}</td>
+        <td>${employee.name || 'N/A'}</td>
+        <td>${employee.email || 'N/A'}</td>
+        <td>${employee.deviceId || 'Not Registered'}</td>
+        <td>${statusBadge(employee.todayStatus)}</td>
+        <td>${employee.lastCheckIn || 'Never'}</td>
+    `;
+    return row;
+}
+
+// Badge for an employee's attendance status today
+function statusBadge(status) {
+    if (status === 'checked_in') {
+        return '<span class="badge badge-success">Checked In</span>';
+    } else if (status === 'checked_out') {
+        return '<span class="badge badge-pending">Checked Out</span>';
+    }
+    return '<span class="badge badge-muted">Not Checked In</span>';
+}
+
 // Load pending device registrations
 function loadPendingRegistrations() {
     fetch('/admin/pending-registrations')
@@ -104,18 +223,7 @@ function loadPendingRegistrations() {
             if (data.success && data.registrations && data.registrations.length > 0) {
                 tbody.innerHTML = '';
                 data.registrations.forEach(reg => {
-                    const row = document.createElement('tr');
-                    row.innerHTML = `
-                        <td>${reg.employeeId || 'N/A'}</td>
-                        <td>${reg.employeeName || 'N/A'}</td>
-                        <td>${reg.deviceId || 'N/A'}</td>
-                        <td>${new Date(reg.requestDate).toLocaleDateString()}</td>
-                        <td>
-                            <button class="btn-action" onclick="approveDevice('${reg.id}')">Approve</button>
-                            <button class="btn-action btn-action-reject" onclick="rejectDevice('${reg.id}')">Reject</button>
-                        </td>
-                    `;
-                    tbody.appendChild(row);
+                    tbody.appendChild(pendingRow(reg));
                 });
             } else {
                 tbody.innerHTML = '<tr><td colspan="5" class="empty-state">No pending registrations</td></tr>';
@@ -129,6 +237,23 @@ function loadPendingRegistrations() {
         });
 }
 
+// Table row for one pending device registration
+function pendingRow(reg) {
+    const row = document.createElement('tr');
+    row.dataset.regId = reg.id;
+    row.innerHTML = `
+        <td>${reg.employeeId || 'N/A'}</td>
+        <td>${reg.employeeName || 'N/A'}</td>
+        <td>${reg.deviceId || 'N/A'}</td>
+        <td>${new Date(reg.requestDate).toLocaleDateString()}</td>
+        <td>
+            <button class="btn-action" onclick="approveDevice('${reg.id}')">Approve</button>
+            <button class="btn-action btn-action-reject" onclick="rejectDevice('${reg.id}')">Reject</button>
+        </td>
+    `;
+    return row;
+}
+
 // Approve device registration
 function approveDevice(registrationId) {
     fetch(`/admin/approve-device/${registrationId}`, {
@@ -141,8 +266,11 @@ function approveDevice(registrationId) {
     .then(data => {
         if (data.success) {
             alert('Device registration approved successfully');
-            loadPendingRegistrations();
-            loadEmployees();
+            // With live updates on, the registrations_decided event updates both lists
+            if (!liveUpdatesConnected()) {
+                loadPendingRegistrations();
+                loadEmployees();
+            }
         } else {
             alert(data.message || 'Failed to approve device registration');
         }
@@ -171,7 +299,9 @@ function rejectDevice(registrationId) {
     .then(data => {
         if (data.success) {
             alert('Device registration rejected');
-            loadPendingRegistrations();
+            if (!liveUpdatesConnected()) {
+                loadPendingRegistrations();
+            }
         } else {
             alert(data.message || 'Failed to reject device registration');
         }
@@ -188,35 +318,54 @@ function refreshEmployees() {
     loadEmployees();
 }
 
-// Load attendance records
-function loadAttendanceRecords() {
-    fetch('/admin/attendance-records')
+// Cursor for the next page of attendance records (null when there are no more)
+let attendanceCursor = null;
+
+// Build the attendance query string from the filter bar
+function attendanceQuery(cursor) {
+    const params = new URLSearchParams();
+    const filters = {
+        from: document.getElementById('filterFrom').value,
+        to: document.getElementById('filterTo').value,
+        empId: document.getElementById('filterEmpId').value.trim(),
+        siteId: document.getElementById('filterSiteId').value
+    };
+    Object.keys(filters).forEach(key => {
+        if (filters[key]) {
+            params.set(key, filters[key]);
+        }
+    });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    return params.toString();
+}
+
+// Load the next page of attendance records
+function loadMoreAttendance() {
+    if (attendanceCursor) {
+        loadAttendanceRecords(attendanceCursor);
+    }
+}
+
+// Load attendance records (first page, or the page after cursor)
+function loadAttendanceRecords(cursor) {
+    fetch(`/admin/attendance-records?${attendanceQuery(cursor)}`)
         .then(response => response.json())
         .then(data => {
             const tbody = document.getElementById('attendanceTableBody');
+            const loadMoreBtn = document.getElementById('loadMoreAttendanceBtn');
+            attendanceCursor = data.nextCursor || null;
+            loadMoreBtn.style.display = attendanceCursor ? 'inline-block' : 'none';
             
             if (data.success && data.records && data.records.length > 0) {
-                tbody.innerHTML = '';
+                if (!cursor) {
+                    tbody.innerHTML = '';
+                }
                 data.records.forEach(record => {
-                    const row = document.createElement('tr');
-                    // Escape single quotes in strings to prevent JavaScript errors
-                    const escapedPhoto = record.photo ? record.photo.replace(/'/g, "\\'") : '';
-                    const escapedName = (record.name || '').replace(/'/g, "\\'");
-                    const photoButton = record.photo 
-                        ? `<button class="btn-action btn-view-photo" onclick="viewPhoto('${escapedPhoto}', '${escapedName}', '${record.date}', '${record.checkInTime}')">📷 View Photo</button>`
-                        : '<span class="no-photo">No photo</span>';
-                    
-                    row.innerHTML = `
-                        <td>${record.empId || 'N/A'}</td>
-                        <td>${record.name || 'N/A'}</td>
-                        <td>${record.date || 'N/A'}</td>
-                        <td>${record.checkInTime || 'N/A'}</td>
-                        <td>${record.location || 'N/A'}</td>
-                        <td>${photoButton}</td>
-                    `;
-                    tbody.appendChild(row);
+                    tbody.appendChild(attendanceRow(record));
                 });
-            } else {
+            } else if (!cursor) {
                 tbody.innerHTML = '<tr><td colspan="6" class="empty-state">No attendance records found</td></tr>';
             }
         })
@@ -227,6 +376,30 @@ function loadAttendanceRecords() {
         });
 }
 
+// Table row for one attendance record
+function attendanceRow(record) {
+    const row = document.createElement('tr');
+    row.dataset.recordKey = `${record.empId}|${record.date}`;
+    // Escape single quotes in strings to prevent JavaScript errors
+    const escapedPhoto = record.photo ? record.photo.replace(/'/g, "\\'") : '';
+    const escapedName = (record.name || '').replace(/'/g, "\\'");
+    // Show the small thumbnail inline; the original is only loaded when opened
+    const photoButton = record.photo 
+        ? `<img class="photo-thumb" src="/uploads/${record.thumbnail || record.photo}" alt="Check-in photo" loading="lazy"
+               onclick="viewPhoto('${escapedPhoto}', '${escapedName}', '${record.date}', '${record.checkInTime}')">`
+        : '<span class="no-photo">No photo</span>';
+    
+    row.innerHTML = `
+        <td>${record.empId || 'N/A'}</td>
+        <td>${record.name || 'N/A'}</td>
+        <td>${record.date || 'N/A'}</td>
+        <td>${record.checkInTime || 'N/A'}</td>
+        <td>${record.location || 'N/A'}</td>
+        <td>${photoButton}</td>
+    `;
+    return row;
+}
+
 // View photo in modal
 function viewPhoto(photoPath, employeeName, date, checkInTime) {
     const modal = document.getElementById('photoModal');
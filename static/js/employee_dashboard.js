@@ -7,6 +7,17 @@ let GEOFENCE_CONFIG = {
     radius: 100  // radius in meters
 };
 
+// Named sites this employee may punch at (empty = use GEOFENCE_CONFIG)
+let GEOFENCE_SITES = [];
+
+// Server-provided location poll schedule (null = fixed 30 second polling)
+let POLL_SCHEDULE = null;
+const DEFAULT_POLL_INTERVAL = 30;
+
+// Punches made while offline, replayed to /employee/sync when back online
+const PUNCH_QUEUE_KEY = 'punchQueue';
+const PUNCH_SYNC_INTERVAL = 60000;
+
 // Device Fingerprinting Function
 function generateDeviceFingerprint() {
     // Collect browser and OS information
@@ -68,6 +79,8 @@ function getWebGLFingerprint() {
 let checkInTime = null;
 let checkOutTime = null;
 let locationWatchId = null;
+let locationMonitoring = false;
+let lastBoundaryDistance = null;  // meters from the nearest fence edge at the last fix
 let deviceRegistered = false;
 let deviceApproved = false;
 let cameraStream = null;
@@ -96,8 +109,134 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Load today's attendance
     loadAttendance();
+    
+    // Replay any punches queued while offline
+    flushPunchQueue();
+    window.addEventListener('online', flushPunchQueue);
+    setInterval(flushPunchQueue, PUNCH_SYNC_INTERVAL);
 });
 
+// Punch token: signed at login, sent as a bearer token and refreshed shortly before it expires
+const PUNCH_TOKEN_REFRESH_MARGIN = 60 * 1000;
+const PUNCH_TOKEN_RETRY_DELAY = 5 * 60 * 1000;  // after a refused refresh (tokens disabled or sign-in expired)
+
+function refreshPunchToken() {
+    const token = sessionStorage.getItem('punchToken');
+    return fetch('/employee/token', {
+        method: 'POST',
+        headers: token ? { 'Authorization': 'Bearer ' + token } : {}
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            sessionStorage.setItem('punchToken', data.token);
+            sessionStorage.setItem('punchTokenExpiresAt', Date.now() + data.tokenExpiresIn * 1000);
+        } else {
+            // Punch without a token (checked by the server as before) instead of asking again every time
+            sessionStorage.removeItem('punchToken');
+            sessionStorage.setItem('punchTokenExpiresAt', Date.now() + PUNCH_TOKEN_RETRY_DELAY);
+        }
+    });
+}
+
+// fetch() with the punch token attached, refreshing it first if it is about to expire
+function punchFetch(url, options) {
+    const expiresAt = Number(sessionStorage.getItem('punchTokenExpiresAt') || 0);
+    const ready = Date.now() > expiresAt - PUNCH_TOKEN_REFRESH_MARGIN ? refreshPunchToken() : Promise.resolve();
+    return ready.then(() => {
+        const token = sessionStorage.getItem('punchToken');
+        const headers = Object.assign({}, (options && options.headers) || {});
+        if (token) {
+            headers['Authorization'] = 'Bearer ' + token;
+        }
+        return fetch(url, Object.assign({}, options, { headers: headers }));
+    });
+}
+
+// Offline punch queue
+function getPunchQueue() {
+    try {
+        return JSON.parse(localStorage.getItem(PUNCH_QUEUE_KEY)) || [];
+    } catch (e) {
+        return [];
+    }
+}
+
+function savePunchQueue(queue) {
+    localStorage.setItem(PUNCH_QUEUE_KEY, JSON.stringify(queue));
+}
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+// True when a fetch failed because the server could not be reached
+function isNetworkError(error) {
+    return !navigator.onLine || error instanceof TypeError;
+}
+
+function queuePunch(action, latitude, longitude, timestamp) {
+    const queue = getPunchQueue();
+    queue.push({
+        idempotencyKey: newIdempotencyKey(),
+        employeeId: sessionStorage.getItem('employeeId'),
+        action: action,
+        latitude: latitude,
+        longitude: longitude,
+        timestamp: timestamp
+    });
+    savePunchQueue(queue);
+}
+
+let punchSyncInFlight = false;
+
+function flushPunchQueue() {
+    const employeeId = sessionStorage.getItem('employeeId');
+    const queue = getPunchQueue().filter(p => p && p.employeeId === employeeId);
+    if (punchSyncInFlight || !navigator.onLine || queue.length === 0) {
+        return;
+    }
+    
+    punchSyncInFlight = true;
+    punchFetch('/employee/sync', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            employeeId: employeeId,
+            deviceFingerprint: sessionStorage.getItem('deviceFingerprint') || generateDeviceFingerprint(),
+            punches: queue
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            console.error('Punch sync failed:', data.message);
+            return;
+        }
+        // Every answered key (applied, duplicate or rejected) is final - drop it, and any
+        // entry without a key, which the server rejects and could never apply
+        const done = new Set(data.results.map(r => r.idempotencyKey));
+        savePunchQueue(getPunchQueue().filter(p => p && p.idempotencyKey && !done.has(p.idempotencyKey)));
+        data.results
+            .filter(r => r.status === 'rejected')
+            .forEach(r => alert('An offline punch was rejected: ' + r.message));
+        if (data.applied > 0) {
+            loadAttendance();
+        }
+    })
+    .catch(error => {
+        console.error('Punch sync error:', error);
+    })
+    .finally(() => {
+        punchSyncInFlight = false;
+    });
+}
+
 // Load device status
 function loadDeviceStatus() {
     fetch('/employee/device-status')
@@ -147,6 +286,8 @@ function loadGeofenceConfig() {
         .then(data => {
             if (data.success && data.config) {
                 GEOFENCE_CONFIG = data.config;
+                GEOFENCE_SITES = data.sites || [];
+                POLL_SCHEDULE = data.pollSchedule || null;
                 // If device is already registered, start checking location
                 if (deviceRegistered && deviceApproved) {
                     checkLocation();
@@ -195,14 +336,12 @@ function checkLocation() {
             const userLon = position.coords.longitude;
             
             // Calculate distance from geofence center
-            const distance = calculateDistance(
-                GEOFENCE_CONFIG.latitude,
-                GEOFENCE_CONFIG.longitude,
-                userLat,
-                userLon
-            );
+            const result = checkGeofence(userLat, userLon);
+            const distance = result.distance;
+            lastBoundaryDistance = result.boundary;
+            scheduleNextLocationCheck();
             
-            if (distance <= GEOFENCE_CONFIG.radius) {
+            if (result.inside) {
                 // Inside geofence
                 statusText.textContent = `✓ You are inside the geofence area (${Math.round(distance)}m from center)`;
                 statusText.style.color = '#38a169';
@@ -223,19 +362,63 @@ function checkLocation() {
             statusIndicator.className = 'status-indicator inactive';
             checkInBtn.disabled = true;
             console.error('Geolocation error:', error);
+            scheduleNextLocationCheck();
         },
-        {
-            enableHighAccuracy: true,
-            timeout: 10000,
-            maximumAge: 0
-        }
+        locationOptions()
     );
 }
 
 // Start continuous location monitoring
 function startLocationMonitoring() {
-    // Check location every 30 seconds
-    locationWatchId = setInterval(checkLocation, 30000);
+    locationMonitoring = true;
+    scheduleNextLocationCheck();
+}
+
+// Queue the next location check using the server's adaptive schedule
+function scheduleNextLocationCheck() {
+    if (!locationMonitoring) {
+        return;
+    }
+    clearTimeout(locationWatchId);
+    locationWatchId = setTimeout(checkLocation, pollInterval() * 1000);
+}
+
+// Seconds until the next fix (mirrors geofence.poll_interval on the server)
+function pollInterval() {
+    const schedule = POLL_SCHEDULE;
+    if (!schedule || lastBoundaryDistance === null) {
+        return DEFAULT_POLL_INTERVAL;
+    }
+    if (checkOutTime) {
+        return schedule.checkedOutInterval;
+    }
+    
+    const band = schedule.bands.find(b => b.maxDistance === null || lastBoundaryDistance <= b.maxDistance)
+        || schedule.bands[schedule.bands.length - 1];
+    let interval = band.interval;
+    
+    // Poll faster around shift start/end
+    const now = new Date();
+    const minute = now.getHours() * 60 + now.getMinutes();
+    const toMinutes = hhmm => {
+        const [h, m] = hhmm.split(':');
+        return parseInt(h, 10) * 60 + parseInt(m, 10);
+    };
+    if (schedule.peakWindows.some(w => toMinutes(w.start) <= minute && minute < toMinutes(w.end))) {
+        interval *= schedule.peakFactor;
+    }
+    return Math.max(schedule.minInterval, Math.min(schedule.maxInterval, interval));
+}
+
+// Far from any fence edge a coarse, slightly stale fix is good enough (saves battery)
+function locationOptions() {
+    const precise = !POLL_SCHEDULE || lastBoundaryDistance === null ||
+        lastBoundaryDistance <= POLL_SCHEDULE.highAccuracyWithin;
+    return {
+        enableHighAccuracy: precise,
+        timeout: 10000,
+        maximumAge: precise ? 0 : pollInterval() * 500
+    };
 }
 
 // Calculate distance between two coordinates using Haversine formula
@@ -251,6 +434,69 @@ function calculateDistance(lat1, lon1, lat2, lon2) {
     return R * c;
 }
 
+// Check a coordinate against the employee's sites (or the single geofence if none)
+function checkGeofence(lat, lon) {
+    if (GEOFENCE_SITES.length === 0) {
+        const distance = calculateDistance(GEOFENCE_CONFIG.latitude, GEOFENCE_CONFIG.longitude, lat, lon);
+        return {
+            inside: distance <= GEOFENCE_CONFIG.radius,
+            distance: distance,
+            boundary: Math.abs(distance - GEOFENCE_CONFIG.radius)
+        };
+    }
+    
+    // Prefer a site we are inside, then the nearest one
+    let best = null;
+    let boundary = Infinity;
+    GEOFENCE_SITES.forEach(site => {
+        const distance = calculateDistance(site.latitude, site.longitude, lat, lon);
+        const inside = site.shape === 'polygon'
+            ? pointInPolygon(lat, lon, site.polygon)
+            : distance <= site.radius;
+        if (!best || (inside && !best.inside) || (inside === best.inside && distance < best.distance)) {
+            best = { inside: inside, distance: distance, site: site };
+        }
+        boundary = Math.min(boundary, boundaryDistance(site, lat, lon, distance));
+    });
+    best.boundary = boundary;
+    return best;
+}
+
+// Meters from a point to the nearest edge of a site (mirrors geofence.boundary_distance)
+function boundaryDistance(site, lat, lon, centerDistance) {
+    if (site.shape !== 'polygon') {
+        return Math.abs(centerDistance - site.radius);
+    }
+    const metersPerDegree = 111320;
+    const scale = metersPerDegree * Math.cos(lat * Math.PI / 180);
+    let best = Infinity;
+    for (let i = 0; i < site.polygon.length; i++) {
+        const [latA, lonA] = site.polygon[i];
+        const [latB, lonB] = site.polygon[(i + 1) % site.polygon.length];
+        const ax = (lonA - lon) * scale, ay = (latA - lat) * metersPerDegree;
+        const bx = (lonB - lon) * scale, by = (latB - lat) * metersPerDegree;
+        const dx = bx - ax, dy = by - ay;
+        const length = dx * dx + dy * dy;
+        const t = length ? Math.max(0, Math.min(1, -(ax * dx + ay * dy) / length)) : 0;
+        best = Math.min(best, Math.hypot(ax + t * dx, ay + t * dy));
+    }
+    return best;
+}
+
+// Ray-casting point-in-polygon test (polygon is a list of [lat, lon] points)
+function pointInPolygon(lat, lon, polygon) {
+    let inside = false;
+    for (let i = 0, j = polygon.length - 1; i < polygon.length; j = i++) {
+        const [latI, lonI] = polygon[i];
+        const [latJ, lonJ] = polygon[j];
+        if ((latI > lat) !== (latJ > lat) &&
+            lon < (lonJ - lonI) * (lat - latI) / (latJ - latI) + lonI) {
+            inside = !inside;
+        }
+    }
+    return inside;
+}
+
 // Check in function - opens camera first
 function checkIn() {
     const checkInBtn = document.getElementById('checkInBtn');
@@ -274,14 +520,7 @@ function checkIn() {
             const userLon = position.coords.longitude;
             
             // Verify user is still within geofence
-            const distance = calculateDistance(
-                GEOFENCE_CONFIG.latitude,
-                GEOFENCE_CONFIG.longitude,
-                userLat,
-                userLon
-            );
-            
-            if (distance > GEOFENCE_CONFIG.radius) {
+            if (!checkGeofence(userLat, userLon).inside) {
                 alert('You are outside the geofence area. Please move within the geofence to check in.');
                 checkLocation(); // Update UI
                 return;
@@ -465,7 +704,7 @@ function submitCheckInWithPhoto() {
     formData.append('photo', dataURLtoBlob(capturedPhotoData), 'checkin_photo.jpg');
     
     // Send check-in with photo to server
-    fetch('/employee/checkin', {
+    punchFetch('/employee/checkin', {
         method: 'POST',
         body: formData
     })
@@ -501,6 +740,15 @@ function submitCheckInWithPhoto() {
     })
     .catch(error => {
         console.error('Error:', error);
+        if (isNetworkError(error)) {
+            // Offline - queue the punch (without the photo) and sync later
+            queuePunch('checkin', pendingCheckInData.latitude, pendingCheckInData.longitude, actualTimestamp);
+            checkInBtn.disabled = true;
+            checkOutBtn.disabled = false;
+            closeCamera();
+            alert('You are offline. Check-in saved and will sync when you reconnect (photo not included).');
+            return;
+        }
         alert('Check-in failed. Please try again.');
         submitPhotoBtn.disabled = false;
         submitPhotoBtn.innerHTML = '<span class="icon">✓</span> Confirm Check-In';
@@ -555,7 +803,7 @@ function checkOut() {
             };
             
             // Send check-out to server
-            fetch('/employee/checkout', {
+            punchFetch('/employee/checkout', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -583,6 +831,14 @@ function checkOut() {
             })
             .catch(error => {
                 console.error('Error:', error);
+                if (isNetworkError(error)) {
+                    // Offline - queue the punch and sync later
+                    queuePunch('checkout', userLat, userLon, checkOutData.timestamp);
+                    checkOutBtn.disabled = true;
+                    checkInBtn.disabled = true;
+                    alert('You are offline. Check-out saved and will sync when you reconnect.');
+                    return;
+                }
                 alert('Check-out failed. Please try again.');
             });
         },
@@ -663,7 +919,7 @@ function verifyDeviceFingerprint() {
 function loadAttendance() {
     const employeeId = sessionStorage.getItem('employeeId');
     
-    fetch(`/employee/attendance/${employeeId}`)
+    punchFetch(`/employee/attendance/${employeeId}`)
         .then(response => response.json())
         .then(data => {
             if (data.success && data.attendance) {
@@ -707,9 +963,8 @@ function loadAttendance() {
 
 // Logout function
 function logout() {
-    if (locationWatchId) {
-        clearInterval(locationWatchId);
-    }
+    locationMonitoring = false;
+    clearTimeout(locationWatchId);
     sessionStorage.clear();
     window.location.href = '/';
 }
@@ -105,6 +105,14 @@ document.addEventListener('DOMContentLoaded', function() {
                 // Store employee info in sessionStorage
                 sessionStorage.setItem('employeeId', data.employeeId);
                 sessionStorage.setItem('employeeName', data.employeeName || 'Employee');
+                // Bearer token for check-in/out (when enabled), refreshed by the dashboard before it expires
+                if (data.token) {
+                    sessionStorage.setItem('punchToken', data.token);
+                    sessionStorage.setItem('punchTokenExpiresAt', Date.now() + data.tokenExpiresIn * 1000);
+                } else {
+                    sessionStorage.removeItem('punchToken');
+                    sessionStorage.removeItem('punchTokenExpiresAt');
+                }
                 // Redirect to dashboard
                 window.location.href = '/employee/dashboard';
             } else {
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+import rollups
+
+CUTOFF = '09:40:00'
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('''
+        CREATE TABLE attendance_records (
+            emp_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            check_in TEXT,
+            check_out TEXT,
+            site_id INTEGER,
+            UNIQUE(emp_id, date)
+        )
+    ''')
+    rollups.create_tables(conn.cursor())
+    yield conn
+    conn.close()
+
+
+def punch(conn, check_in=None, check_out=None):
+    """Apply a punch the way record_check_in / record_check_out do, then roll it up"""
+    if check_in:
+        conn.execute('''
+            INSERT INTO attendance_records (emp_id, date, check_in) VALUES ('E1', '2026-10-05', ?)
+            ON CONFLICT(emp_id, date) DO UPDATE SET check_in = excluded.check_in
+        ''', (f'2026-10-05T{check_in}',))
+    if check_out:
+        conn.execute("UPDATE attendance_records SET check_out = ? WHERE emp_id = 'E1' AND date = '2026-10-05'",
+                     (f'2026-10-05T{check_out}',))
+    rollups.refresh(conn, 'E1', '2026-10-05', CUTOFF)
+
+
+def daily(conn):
+    return conn.execute("SELECT first_in, last_out, minutes_worked, on_time FROM attendance_daily").fetchone()
+
+
+def test_check_in_after_check_out_keeps_first_check_in(conn):
+    punch(conn, check_in='09:00:00')
+    punch(conn, check_out='17:00:00')
+    punch(conn, check_in='18:00:00')
+
+    row = daily(conn)
+    assert row['first_in'] == '2026-10-05T09:00:00'
+    assert row['last_out'] == '2026-10-05T17:00:00'
+    assert row['minutes_worked'] == 480
+    assert row['on_time'] == 1
+    monthly = conn.execute('SELECT minutes_worked, days_complete FROM attendance_monthly').fetchone()
+    assert (monthly['minutes_worked'], monthly['days_complete']) == (480, 1)
+
+
+def test_rebuild_never_counts_negative_minutes(conn):
+    punch(conn, check_in='09:00:00')
+    punch(conn, check_out='17:00:00')
+    punch(conn, check_in='18:00:00')
+
+    rollups.rebuild(conn, CUTOFF)
+
+    # Only the later check-in survives in attendance_records: no minutes rather than negative ones
+    row = daily(conn)
+    assert row['minutes_worked'] is None
+    assert conn.execute('SELECT minutes_worked FROM attendance_monthly').fetchone()[0] == 0
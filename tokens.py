@@ -0,0 +1,75 @@
+import hashlib
+import hmac
+import time
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+
+class InvalidToken(Exception):
+    """The token is malformed, forged, signed with a retired key or expired"""
+
+
+def fingerprint_digest(device_fingerprint):
+    """Short digest of a device fingerprint, so tokens don't carry the fingerprint itself"""
+    return hashlib.sha256(str(device_fingerprint).encode()).hexdigest()[:32]
+
+
+def bearer_token(authorization):
+    """Token from an 'Authorization: Bearer <token>' header value, or None"""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+class PunchTokens:
+    """Signed, short-lived employee tokens for the punch API.
+
+    A token carries what a punch is authorized with - the employee ID and
+    name, the approved device (as a fingerprint digest) and the employee's
+    sites - so checking it is an HMAC and a timestamp comparison: no session,
+    no database read, and any worker that shares the secret can verify it.
+    A token without a device or without sites only means the employee had
+    none when it was issued, so those checks fall back to the employee's
+    current record. secrets is a list of keys, newest last: the newest signs,
+    all of them verify, so keys can be rotated without signing everyone out.
+    Tokens can't be revoked; ttl bounds how long one outlives a device or site
+    change made after it was issued. 'auth' is when the employee last entered
+    their password, carried over on refresh so refreshing can be limited.
+    """
+
+    def __init__(self, secrets, ttl=900, salt='punch-token'):
+        self.ttl = ttl
+        self._serializer = URLSafeTimedSerializer(list(secrets), salt=salt)
+
+    def issue(self, emp_id, name, device_fingerprint=None, site_ids=(), authenticated_at=None):
+        return self._serializer.dumps({
+            'sub': emp_id,
+            'name': name,
+            'fp': fingerprint_digest(device_fingerprint) if device_fingerprint else None,
+            'sites': sorted(site_ids),
+            'auth': int(authenticated_at if authenticated_at is not None else time.time())
+        })
+
+    def verify(self, token):
+        """The token's claims; raises InvalidToken"""
+        try:
+            claims = self._serializer.loads(token, max_age=self.ttl)
+        except SignatureExpired:
+            raise InvalidToken('Sign-in expired')
+        except BadSignature:
+            raise InvalidToken('Invalid sign-in token')
+        if not isinstance(claims, dict) or not claims.get('sub'):
+            raise InvalidToken('Invalid sign-in token')
+        return claims
+
+
+def device_error(claims, device_fingerprint, action):
+    """Device rule for a punch whose token carries a device (same messages as the database-backed check)"""
+    if not device_fingerprint:
+        return f'Device fingerprint required for {action}'
+    if not hmac.compare_digest(fingerprint_digest(device_fingerprint), claims['fp']):
+        return f'Device mismatch detected. {action.capitalize()} denied. Please use your registered device.'
+    return None